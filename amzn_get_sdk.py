@@ -4,6 +4,14 @@
 amzn_get_sdk.py
 Descarga datos de productos desde Amazon SP-API y los guarda en formato JSON.
 Compatible con entorno virtual automático y variables del archivo .env
+
+Uso:
+  python3 amzn_get_sdk.py                 # solo ASINs nuevos, fallidos o vencidos (FETCH_TTL_HOURS)
+  python3 amzn_get_sdk.py --retry-failed  # solo reintenta los que fallaron
+  python3 amzn_get_sdk.py --force         # vuelve a descargar todo
+  python3 amzn_get_sdk.py --batch         # searchCatalogItems, 20 ASINs por request
+  python3 amzn_get_sdk.py --batch --profile summary   # refresh liviano (ver INCLUDED_DATA_PROFILES)
+  python3 amzn_get_sdk.py --prune         # además da de baja los ASINs que ya no están en asins.txt
 """
 # === AUTO-ACTIVADOR DEL ENTORNO VIRTUAL ===
 import os, sys
@@ -34,37 +42,65 @@ import os
 import sys
 import json
 import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from sp_api.api import CatalogItems
-from sp_api.base import Marketplaces, SellingApiException
+from sp_api.base import Marketplaces, SellingApiException, CatalogItemsVersion
+
+from rate_limit import TokenBucket
+from token_broker import amazon_broker
+from product_store import get_store, load_product
+from fetch_manifest import (FetchManifest, payload_hash, STATUS_OK, STATUS_ERROR,
+                            STATUS_NOT_FOUND, STATUS_REMOVED)
+from delta_feed import DeltaWriter, changed_fields, CHANGE_NEW, CHANGE_CHANGED, CHANGE_REMOVED
 
 # === CONFIGURACIÓN ===
 load_dotenv()
 print("✅ Variables de entorno cargadas correctamente.")
 
 OUTPUT_DIR = "outputs/json"
+# Los productos van al store de shards (product_store.py). Con SAVE_LOOSE_JSON=1
+# además se escribe el outputs/json/{asin}.json de siempre.
+SAVE_LOOSE_JSON = os.getenv("SAVE_LOOSE_JSON", "0") == "1"
 ASINS_FILE = "asins.txt"
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Cuota de Catalog Items getCatalogItem (2022-04-01): 2 req/s, burst 2.
+# Si la cuenta tiene otra cuota, ajustala por .env.
+SPAPI_WORKERS = int(os.getenv("SPAPI_WORKERS", "4"))
+SPAPI_CATALOG_RATE = float(os.getenv("SPAPI_CATALOG_RATE", "2"))
+SPAPI_CATALOG_BURST = float(os.getenv("SPAPI_CATALOG_BURST", "2"))
+SPAPI_MAX_RETRIES = int(os.getenv("SPAPI_MAX_RETRIES", "6"))
 
-# === FUNCIÓN PRINCIPAL ===
-def main():
-    print("📦 Iniciando extracción con Amazon SP-API (SDK oficial)...\n")
+# searchCatalogItems por identifiers: hasta 20 ASINs por request (misma cuota 2 req/s)
+SEARCH_BATCH_SIZE = 20
+SPAPI_BATCH = os.getenv("SPAPI_BATCH", "0") == "1"
 
-    if not os.path.exists(ASINS_FILE):
-        print("⚠️ No se encontró asins.txt — créalo con un ASIN por línea.")
-        return
+# Perfiles de includedData: un refresh liviano no necesita bajar todo.
+# Ojo: el precio de lista (list_price) viaja dentro de `attributes`,
+# Catalog Items no tiene un bloque de precio separado.
+INCLUDED_DATA_PROFILES = {
+    "full": ["attributes", "summaries", "images"],
+    "price": ["attributes"],
+    "summary": ["summaries"],
+    "images": ["summaries", "images"],
+    "dimensions": ["summaries", "dimensions"],
+    "identifiers": ["summaries", "identifiers"],
+}
+SPAPI_PROFILE = os.getenv("SPAPI_PROFILE", "full")
 
-    # Carga los ASINs desde el archivo
-    with open(ASINS_FILE, "r", encoding="utf-8") as f:
-        asins = [a.strip() for a in f if a.strip()]
+os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    if not asins:
-        print("⚠️ No hay ASINs en el archivo.")
-        return
+# === CLIENTE SP-API (uno por hilo) ===
+# El access token LWA no lo renueva cada cliente: lo pone token_broker
+# (renovación single-flight entre hilos y procesos). python-amazon-sp-api usa
+# `restricted_data_token`, si está, como x-amz-access-token en vez de su auth propio.
+_local = threading.local()
 
-    # Inicializa cliente de Amazon SP-API
-    client = CatalogItems(
+def build_client(version=None):
+    kwargs = {"version": version} if version else {}
+    return CatalogItems(
         marketplace=Marketplaces.US,
         credentials={
             "refresh_token": os.getenv("REFRESH_TOKEN"),
@@ -73,34 +109,277 @@ def main():
             "aws_access_key": os.getenv("AWS_ACCESS_KEY_ID"),
             "aws_secret_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
         },
+        **kwargs,
+    )
+
+def _with_token(client):
+    client.restricted_data_token = getattr(_local, "token", None) or amazon_broker().get_token()
+    return client
+
+def _client():
+    if getattr(_local, "client", None) is None:
+        _local.client = build_client()
+    return _with_token(_local.client)
+
+def _search_client():
+    # La búsqueda por identifiers solo existe en la versión 2022-04-01
+    if getattr(_local, "search_client", None) is None:
+        _local.search_client = build_client(CatalogItemsVersion.V_2022_04_01)
+    return _with_token(_local.search_client)
+
+def _is_auth_error(e: SellingApiException) -> bool:
+    return getattr(e, "code", None) in (401, 403)
+
+def _is_throttled(e: SellingApiException) -> bool:
+    if getattr(e, "code", None) == 429:
+        return True
+    return "QuotaExceeded" in str(e) or "throttl" in str(e).lower()
+
+def _rate_limit_header(e: SellingApiException):
+    headers = getattr(e, "headers", None) or {}
+    try:
+        return float(headers.get("x-amzn-RateLimit-Limit"))
+    except (TypeError, ValueError):
+        return None
+
+def _call_with_backoff(call, label: str, limiter: TokenBucket):
+    """
+    Ejecuta `call()` respetando el limitador; reintenta ante throttling y,
+    una sola vez, ante 401/403 con un token renovado por el broker.
+    """
+    replayed = False
+    for attempt in range(1, SPAPI_MAX_RETRIES + 1):
+        limiter.acquire()
+        _local.token = amazon_broker().get_token()
+        try:
+            res = call()
+            limiter.recover()
+            return res
+        except SellingApiException as e:
+            if _is_auth_error(e) and not replayed and attempt < SPAPI_MAX_RETRIES:
+                replayed = True
+                print(f"🔐 {getattr(e, 'code', '')} de SP-API en {label} — renovando token y reintentando…")
+                amazon_broker().refresh(stale_token=_local.token)
+                continue
+            if not _is_throttled(e) or attempt == SPAPI_MAX_RETRIES:
+                raise
+            limiter.backoff()
+            quota = _rate_limit_header(e)
+            if quota:
+                limiter.set_rate(quota)
+            sleep_s = min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+            print(f"⏳ Throttling en {label} (intento {attempt}). Tasa → {limiter.rate:.2f} req/s, espera {sleep_s:.1f}s")
+            time.sleep(sleep_s)
+        finally:
+            _local.token = None
+
+# === DESCARGA DE UN ASIN (con backoff adaptativo) ===
+def fetch_catalog_item(asin: str, limiter: TokenBucket, included_data=None) -> dict:
+    included_data = included_data or INCLUDED_DATA_PROFILES["full"]
+    res = _call_with_backoff(
+        lambda: _client().get_catalog_item(asin, includedData=included_data),
+        asin, limiter,
+    )
+    return res.payload
+
+# === DESCARGA EN LOTE (searchCatalogItems, hasta 20 ASINs por request) ===
+def fetch_catalog_batch(asins, limiter: TokenBucket, included_data=None) -> dict:
+    """Devuelve {asin: payload} con los ASINs que Amazon encontró."""
+    if len(asins) > SEARCH_BATCH_SIZE:
+        raise ValueError(f"searchCatalogItems acepta hasta {SEARCH_BATCH_SIZE} identifiers")
+    included_data = included_data or INCLUDED_DATA_PROFILES["full"]
+    res = _call_with_backoff(
+        lambda: _search_client().search_catalog_items(
+            identifiers=",".join(asins),
+            identifiersType="ASIN",
+            includedData=",".join(included_data),
+            pageSize=SEARCH_BATCH_SIZE,
+        ),
+        f"lote {asins[0]}…({len(asins)})", limiter,
     )
+    items = (res.payload or {}).get("items", [])
+    return {item["asin"]: item for item in items if item.get("asin")}
+
+def save_product(asin: str, data: dict) -> str:
+    store = get_store()
+    store.put(asin, data)
+    if SAVE_LOOSE_JSON:
+        save_path = os.path.join(OUTPUT_DIR, f"{asin}.json")
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        return save_path
+    return f"{store.path} [{asin}]"
 
+def fetch_all(asins, workers: int = SPAPI_WORKERS, limiter: TokenBucket = None,
+              manifest: FetchManifest = None, included_data=None, batch: bool = False,
+              delta: DeltaWriter = None):
+    """
+    Descarga concurrente: un pool de hilos detrás de un token bucket
+    compartido. Con batch=True agrupa de a 20 ASINs por request. Si el
+    perfil includedData es parcial, los datos nuevos se mezclan con el JSON
+    ya guardado (no se pierden atributos). Si se pasa un manifiesto, cada
+    resultado queda registrado al terminar (checkpoint). Si se pasa un
+    DeltaWriter, solo se reescriben y reportan los productos que cambiaron
+    de verdad (hash de contenido). Devuelve (éxitos, fallos).
+    """
+    limiter = limiter or TokenBucket(SPAPI_CATALOG_RATE, SPAPI_CATALOG_BURST)
+    included_data = list(included_data or INCLUDED_DATA_PROFILES["full"])
+    partial = set(included_data) != set(INCLUDED_DATA_PROFILES["full"])
     successes, failures = 0, 0
+    total = len(asins)
+
+    if batch:
+        units = [asins[i:i + SEARCH_BATCH_SIZE] for i in range(0, total, SEARCH_BATCH_SIZE)]
+    else:
+        units = [[asin] for asin in asins]
 
-    for asin in asins:
-        print(f"🔍 Consultando ASIN {asin}...")
+    def _unit(chunk):
         try:
-            res = client.get_catalog_item(asin, includedData=["attributes", "summaries", "images"])
-            data = res.payload
+            if batch:
+                found = fetch_catalog_batch(chunk, limiter, included_data)
+            else:
+                found = {chunk[0]: fetch_catalog_item(chunk[0], limiter, included_data)}
+        except Exception as e:
+            status = STATUS_NOT_FOUND if getattr(e, "code", None) == 404 else STATUS_ERROR
+            for asin in chunk:
+                _record_missing(asin, status, e)
+            return [(asin, None, e) for asin in chunk]
 
-            save_path = os.path.join(OUTPUT_DIR, f"{asin}.json")
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            print(f"✅ Guardado: {save_path}")
+        results = []
+        for asin in chunk:
+            data = found.get(asin)
+            if data is None:
+                _record_missing(asin, STATUS_NOT_FOUND, "ASIN no devuelto por searchCatalogItems")
+                results.append((asin, None, "no encontrado"))
+                continue
+            # Si venía dado de baja, la vuelta se reporta como alta ('new')
+            gone = manifest and manifest.entries.get(asin, {}).get("status") in (STATUS_NOT_FOUND, STATUS_REMOVED)
+            old = load_product(asin)
+            if partial:
+                data = {**(old or {}), **data}
+            new_hash = payload_hash(data)
+            if gone:
+                # El store conserva los datos de las bajas: aunque el contenido
+                # sea idéntico, la vuelta es un alta
+                unchanged = old is not None and payload_hash(old) == new_hash
+                save_path = "sin cambios" if unchanged else save_product(asin, data)
+                if delta:
+                    delta.add(asin, CHANGE_NEW, data_hash=new_hash)
+            elif old is not None and payload_hash(old) == new_hash:
+                save_path = "sin cambios"
+            else:
+                save_path = save_product(asin, data)
+                if delta:
+                    if old is None:
+                        delta.add(asin, CHANGE_NEW, data_hash=new_hash)
+                    else:
+                        delta.add(asin, CHANGE_CHANGED, changed_fields(old, data), new_hash)
+            if manifest:
+                manifest.record(asin, STATUS_OK, data_hash=new_hash)
+            results.append((asin, save_path, None))
+        return results
 
-            successes += 1
+    def _record_missing(asin, status, error):
+        was_ok = manifest and manifest.entries.get(asin, {}).get("status") == STATUS_OK
+        if manifest:
+            manifest.record(asin, status, error=error)
+        # Un ASIN que existía y Amazon ya no devuelve → baja en el feed.
+        # Los datos del store se conservan.
+        if delta and was_ok and status == STATUS_NOT_FOUND:
+            delta.add(asin, CHANGE_REMOVED)
 
-        except SellingApiException as e:
-            print(f"❌ Error con ASIN {asin}: {e}")
-            failures += 1
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_unit, chunk) for chunk in units]
+        for fut in as_completed(futures):
+            for asin, save_path, error in fut.result():
+                if error is None:
+                    successes += 1
+                    print(f"✅ [{successes + failures}/{total}] Guardado: {save_path}")
+                else:
+                    failures += 1
+                    print(f"❌ Error con ASIN {asin}: {error}")
+    return successes, failures
+
+def _mark_removed(asin: str, manifest: FetchManifest, delta: DeltaWriter):
+    """Baja explícita (--prune): se marca en el manifiesto y se reporta en el feed.
+    Los datos del store NO se borran; si el ASIN vuelve, entra como 'new'."""
+    manifest.record(asin, STATUS_REMOVED)
+    delta.add(asin, CHANGE_REMOVED)
+
+def _arg_value(name: str, default=None):
+    """Lee `--name=valor` o `--name valor` de sys.argv."""
+    for i, arg in enumerate(sys.argv):
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+        if arg == f"--{name}" and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
+
+# === FUNCIÓN PRINCIPAL ===
+def main():
+    print("📦 Iniciando extracción con Amazon SP-API (SDK oficial)...\n")
+
+    if not os.path.exists(ASINS_FILE):
+        print("⚠️ No se encontró asins.txt — créalo con un ASIN por línea.")
+        return
+
+    # Carga los ASINs desde el archivo
+    with open(ASINS_FILE, "r", encoding="utf-8") as f:
+        asins = [a.strip() for a in f if a.strip()]
+
+    if not asins:
+        print("⚠️ No hay ASINs en el archivo.")
+        return
 
-        time.sleep(1.2)  # pausa entre requests
+    # Manifiesto: saltea ASINs frescos y retoma desde el último checkpoint
+    force = "--force" in sys.argv
+    only_failed = "--retry-failed" in sys.argv
+    batch = SPAPI_BATCH or "--batch" in sys.argv
+    profile = _arg_value("profile", SPAPI_PROFILE)
+    if profile not in INCLUDED_DATA_PROFILES:
+        print(f"⚠️ Perfil desconocido '{profile}'. Opciones: {', '.join(INCLUDED_DATA_PROFILES)}")
+        return
+    manifest = FetchManifest()
+    delta = DeltaWriter()
+    if "--prune" in sys.argv and not only_failed:
+        # ASINs que estaban descargados y ya no figuran en asins.txt → bajas.
+        # Solo con --prune: un asins.txt parcial no debe dar de baja el catálogo.
+        current = set(asins)
+        for asin, entry in list(manifest.entries.items()):
+            if asin not in current and entry.get("status") == STATUS_OK:
+                _mark_removed(asin, manifest, delta)
+
+    pending = manifest.plan(asins, force=force, only_failed=only_failed)
+    skipped = len(set(asins)) - len(pending)
+    if skipped:
+        print(f"♻️ {skipped} ASINs frescos (TTL {manifest.ttl_seconds / 3600:g}h) — se saltean.")
+    if not pending:
+        print("✅ Nada para descargar.")
+        if delta.total:
+            manifest.compact()
+            print(f"🔀 Delta: {delta.path} → {delta.counts}")
+        return
+
+    mode = f"lotes de {SEARCH_BATCH_SIZE}" if batch else "1 ASIN/request"
+    print(f"🚦 {len(pending)} ASINs | {SPAPI_WORKERS} workers | {SPAPI_CATALOG_RATE} req/s (burst {SPAPI_CATALOG_BURST:g}) | {mode} | perfil '{profile}'")
+    started = time.time()
+    successes, failures = fetch_all(pending, manifest=manifest,
+                                    included_data=INCLUDED_DATA_PROFILES[profile], batch=batch,
+                                    delta=delta)
+    manifest.compact()
 
     print("\n📊 Resumen:")
     print(f"✅ Éxitos: {successes}")
     print(f"❌ Fallos: {failures}")
-    print(f"📁 Archivos en: {os.path.abspath(OUTPUT_DIR)}")
+    print(f"♻️ Salteados: {skipped}")
+    print(f"⏱️ Tiempo: {time.time() - started:.1f}s")
+    print(f"📁 Store: {os.path.abspath(get_store().path)} ({len(get_store())} productos)")
+    print(f"🧾 Manifiesto: {manifest.path} → {manifest.summary()}")
+    if delta.total:
+        print(f"🔀 Delta: {delta.path} → {delta.counts}")
+    else:
+        print("🔀 Delta: sin cambios de contenido.")
 
 # === EJECUCIÓN ===
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ann_index.py
+Índice aproximado (IVF) para buscar categorías sin recorrer toda la matriz.
+
+Las categorías se agrupan con k-means esférico en `n_lists` listas; una
+consulta solo puntúa las filas de las `nprobe` listas con centroide más
+cercano (con la misma matriz cuantizada de category_index.py). nprobe es
+la perilla recall/latencia: más listas = más recall y más tiempo.
+
+Se guarda junto a la matriz: <prefijo>.ivf.npz (centroides + listas).
+Se activa con CATEGORY_ANN=1; ANN_NPROBE ajusta la perilla.
+
+Uso:
+  python3 ann_index.py build [data/cbt_embeddings.npy] [--lists 256]
+  python3 ann_index.py check [data/cbt_embeddings.npy] [--nprobe 8] [--k 10] [--queries 500]
+"""
+
+import os, sys, json, time
+import numpy as np
+
+from category_index import EMB_PATH, SCORE_BLOCK_ROWS, index_prefix, load_index
+
+ANN_ENABLED = os.getenv("CATEGORY_ANN", "0") == "1"
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_LISTS = int(os.getenv("ANN_LISTS", "0"))               # 0 = ~4·√N
+ANN_KMEANS_ITERS = int(os.getenv("ANN_KMEANS_ITERS", "20"))
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))
+
+
+def ivf_path(emb_path: str = EMB_PATH) -> str:
+    return index_prefix(emb_path) + ".ivf.npz"
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    return X / np.clip(np.linalg.norm(X, axis=-1, keepdims=True), 1e-12, None)
+
+
+def _top_k_rows(S: np.ndarray, k: int):
+    """Índices (ordenados) y valores de los k mayores de cada fila de S."""
+    k = min(k, S.shape[1])
+    top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(S, top, axis=1)
+    order = np.argsort(-vals, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+# ============================================================
+# 🧭 IVF
+# ============================================================
+class IVFIndex:
+    def __init__(self, centroids, order, offsets, meta=None):
+        self.centroids = centroids   # (L, d) normalizados
+        self.order = order           # ids de fila agrupados por lista
+        self.offsets = offsets       # lista l = order[offsets[l]:offsets[l + 1]]
+        self.meta = meta or {}
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(cls, index, n_lists: int = ANN_LISTS, iters: int = ANN_KMEANS_ITERS,
+              sample: int = ANN_TRAIN_SAMPLE, seed: int = 0):
+        """k-means esférico sobre una muestra y asignación de todas las filas a su lista."""
+        n = len(index)
+        n_lists = max(1, min(n, n_lists or int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, max(sample, n_lists)), replace=False))
+        X = _normalize(index.vectors(sample_rows))
+        C = X[rng.choice(len(X), size=n_lists, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(X @ C.T, axis=1)
+            sums = np.zeros_like(C)
+            np.add.at(sums, assign, X)
+            counts = np.bincount(assign, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():   # listas vacías: se resiembran con puntos al azar
+                sums[empty] = X[rng.choice(len(X), size=int(empty.sum()), replace=False)]
+            C = _normalize(sums)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            stop = min(n, start + SCORE_BLOCK_ROWS)
+            assign[start:stop] = np.argmax(index.vectors(slice(start, stop)) @ C.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))]).astype(np.int64)
+        meta = {"count": n, "n_lists": n_lists, "iters": iters,
+                "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        return cls(C.astype(np.float32), order, offsets, meta)
+
+    def candidates(self, qn: np.ndarray, nprobe: int) -> np.ndarray:
+        """Filas de las `nprobe` listas más cercanas a una consulta preparada."""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        cs = self.centroids @ qn
+        probes = np.argpartition(-cs, nprobe - 1)[:nprobe]
+        rows = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in probes])
+        return np.sort(rows)   # lectura secuencial sobre el mmap
+
+    def search(self, index, Qn: np.ndarray, k: int, nprobe: int = ANN_NPROBE):
+        """
+        Qn: consultas ya preparadas (index.prepare). Devuelve (ids, scores) de
+        forma (q, k), ordenados; si hay menos de k candidatos se rellena con -1 / -inf.
+        """
+        Qn = np.atleast_2d(Qn)
+        ids = np.full((len(Qn), k), -1, dtype=np.int64)
+        scores = np.full((len(Qn), k), -np.inf, dtype=np.float32)
+        for i, qn in enumerate(Qn):
+            rows = self.candidates(qn, nprobe)
+            if not len(rows):
+                continue
+            s = index.dot(qn[None, :], rows=rows)
+            top, vals = _top_k_rows(s, k)
+            ids[i, :top.shape[1]] = rows[top[0]]
+            scores[i, :top.shape[1]] = vals[0]
+        return ids, scores
+
+    # ============================================================
+    # 💾 Persistencia
+    # ============================================================
+    def save(self, path: str):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as z:
+            return cls(z["centroids"], z["order"], z["offsets"], json.loads(str(z["meta"])))
+
+
+def build_ivf(emb_path: str = EMB_PATH, n_lists: int = ANN_LISTS, index=None) -> IVFIndex:
+    index = index if index is not None else load_index(emb_path)
+    ivf = IVFIndex.train(index, n_lists=n_lists)
+    ivf.save(ivf_path(emb_path))
+    return ivf
+
+
+def load_ivf(emb_path: str = EMB_PATH, index=None) -> IVFIndex:
+    """Abre el IVF de `emb_path`; lo reconstruye si falta o si el índice cuantizado es más nuevo."""
+    path = ivf_path(emb_path)
+    src = index_prefix(emb_path) + ".json"
+    if not os.path.exists(path) or (os.path.exists(src) and os.path.getmtime(path) < os.path.getmtime(src)):
+        print(f"🧭 Construyendo índice IVF de {emb_path} ...")
+        return build_ivf(emb_path, index=index)
+    return IVFIndex.load(path)
+
+
+# ============================================================
+# 📏 Recall contra búsqueda exacta
+# ============================================================
+def recall_check(index, ivf: IVFIndex, k: int = 10, nprobe: int = ANN_NPROBE,
+                 n_queries: int = 500, seed: int = 1) -> dict:
+    """
+    Usa filas del propio índice (con un poco de ruido) como consultas y mide
+    recall@k del IVF contra la búsqueda exacta, más la latencia de cada una.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(index), size=min(n_queries, len(index)), replace=False))
+    Q = index.vectors(rows)
+    Qn = _normalize(Q + rng.normal(scale=0.1 / np.sqrt(Q.shape[1]), size=Q.shape).astype(np.float32))
+
+    t0 = time.perf_counter()
+    exact_ids, _ = _top_k_rows(index.dot(Qn), k)
+    exact_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ann_ids, _ = ivf.search(index, Qn, k, nprobe)
+    ann_s = time.perf_counter() - t0
+
+    hits = sum(len(set(a) & set(e)) for a, e in zip(ann_ids.tolist(), exact_ids.tolist()))
+    return {
+        "k": k, "nprobe": nprobe, "queries": len(rows),
+        "recall": hits / float(len(rows) * exact_ids.shape[1]),
+        "exact_ms_per_query": 1000 * exact_s / len(rows),
+        "ann_ms_per_query": 1000 * ann_s / len(rows),
+    }
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def _opt(name, default):
+    if name in sys.argv:
+        i = sys.argv.index(name)
+        if i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    pos = [a for i, a in enumerate(sys.argv[2:], 2)
+           if not a.startswith("--") and not sys.argv[i - 1].startswith("--")]
+    emb_path = pos[0] if pos else EMB_PATH
+    if cmd == "build":
+        ivf = build_ivf(emb_path, n_lists=int(_opt("--lists", ANN_LISTS)))
+        sizes = np.diff(ivf.offsets)
+        print(f"✅ IVF con {ivf.n_lists} listas → {ivf_path(emb_path)} "
+              f"(filas por lista: media {sizes.mean():.0f}, máx {sizes.max()})")
+    elif cmd == "check":
+        index = load_index(emb_path)
+        ivf = load_ivf(emb_path, index=index)
+        k = int(_opt("--k", 10))
+        n_queries = int(_opt("--queries", 500))
+        probes = [int(_opt("--nprobe", 0))] if "--nprobe" in sys.argv else [1, 2, 4, 8, 16, 32]
+        print(f"📏 Recall@{k} IVF ({ivf.n_lists} listas) vs búsqueda exacta, {n_queries} consultas:")
+        for nprobe in probes:
+            r = recall_check(index, ivf, k=k, nprobe=nprobe, n_queries=n_queries)
+            print(f"   • nprobe={nprobe:<3} recall={r['recall']:.3f} | "
+                  f"exacta {r['exact_ms_per_query']:.2f} ms | IVF {r['ann_ms_per_query']:.2f} ms por consulta")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
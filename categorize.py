@@ -6,9 +6,12 @@
 # Preparado para integrarse con embeddings locales de MercadoLibre CBT
 # ============================================================
 
-import os, sys, json, requests, subprocess
+import os, sys, json, time, random, requests, subprocess
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from openai import OpenAI
+from product_store import load_product
+from delta_feed import read_delta, delta_arg, CHANGE_CHANGED
 
 # ============================================================
 # 🧠 Autoactivar entorno virtual
@@ -59,20 +62,21 @@ def flatten_json(data, prefix="", out=None):
     return out
 
 # ============================================================
-# 🧠 IA: clasificación corta y precisa
+# 🧠 IA: clasificación corta y precisa (por lotes)
 # ============================================================
-def ai_classify_category(title: str):
-    if not client:
-        return "Unknown"
-    prompt = f"""
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "25"))   # títulos por request
+CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_WORKERS", "4"))          # requests en paralelo
+CLASSIFY_MAX_REASKS = int(os.getenv("CLASSIFY_MAX_REASKS", "2"))    # reintentos solo de los inválidos
+
+# Prefijo común (reglas + few-shot): es idéntico en todos los requests
+CLASSIFY_RULES = """
 You are a product classification AI for e-commerce.
-Your task is to identify the **main product category** from the given title, in clear **English**.
+Your task is to identify the **main product category** of each given title, in clear **English**.
 
 Follow these strict rules:
-- Output must be **1 to 3 words only**, in singular form.
+- Each category must be **1 to 3 words only**, in singular form.
 - Do NOT include brand names, models, specs, colors, or features.
 - Focus only on what the product **is**.
-- Return only the category name, no explanations.
 
 Examples:
 - "LEGO Bouquet of Flowers Building Kit" → "LEGO Set"
@@ -92,74 +96,160 @@ Examples:
 - "Samsung 4K Smart TV 55 inch" → "Television"
 - "LEGO Star Wars Millennium Falcon" → "LEGO Set"
 - "Nintendo Switch OLED Console" → "Video Game Console"
+"""
 
-Now classify this product:
-Title: {title}
+CLASSIFY_SCHEMA = {
+    "name": "product_categories",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "integer"},
+                        "category": {"type": "string", "description": "1 to 3 words, singular"},
+                    },
+                    "required": ["index", "category"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
 
-Return only the category name in English.
-"""
+
+def _valid_category(cat) -> bool:
+    if not isinstance(cat, str):
+        return False
+    cat = cat.strip().strip('"')
+    return 0 < len(cat.split()) <= 3 and len(cat) <= 40 and cat.lower() != "unknown"
+
+
+def _classify_request(titles: list) -> dict:
+    """Un request para varios títulos → {índice: categoría} (solo las válidas)."""
+    numbered = "\n".join(f"{i}. {t}" for i, t in enumerate(titles))
+    r = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": CLASSIFY_RULES},
+            {"role": "user", "content": f"Classify each of these products (index. title):\n{numbered}\n\n"
+                                        f"Return one result per index, from 0 to {len(titles) - 1}."},
+        ],
+        response_format={"type": "json_schema", "json_schema": CLASSIFY_SCHEMA},
+        temperature=0.0,
+    )
+    data = json.loads(r.choices[0].message.content)
+    out = {}
+    for item in data.get("results", []):
+        idx, cat = item.get("index"), item.get("category")
+        if isinstance(idx, int) and 0 <= idx < len(titles) and _valid_category(cat):
+            out[idx] = cat.strip().strip('"')
+    return out
+
+
+def _retry_after(e) -> float:
     try:
-        r = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-        )
-        return r.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"⚠️ Error in AI classification: {e}")
-        return "Unknown"
+        return float(e.response.headers.get("retry-after"))
+    except Exception:
+        return 0.0
+
+
+def _classify_chunk(titles: list) -> list:
+    """
+    Clasifica un lote; vuelve a preguntar solo por los índices inválidos o
+    faltantes, con backoff exponencial + jitter entre intentos (respeta
+    Retry-After si la API lo manda), igual que EmbeddingJob.
+    """
+    result = [None] * len(titles)
+    pending = list(range(len(titles)))
+    last_error = None
+    for attempt in range(1 + CLASSIFY_MAX_REASKS):
+        if not pending:
+            break
+        if attempt:
+            sleep_s = max(_retry_after(last_error), min(2 ** attempt, 60) * (0.5 + random.random() / 2))
+            time.sleep(sleep_s)
+        last_error = None
+        try:
+            got = _classify_request([titles[i] for i in pending])
+        except Exception as e:
+            last_error = e
+            print(f"⚠️ Error in AI classification (intento {attempt + 1}): {e}")
+            continue
+        for local, cat in got.items():
+            result[pending[local]] = cat
+        pending = [i for i in pending if result[i] is None]
+        if pending:
+            print(f"🔁 {len(pending)} títulos sin categoría válida, se vuelven a pedir")
+    return [r or "Unknown" for r in result]
+
+
+def ai_classify_categories(titles):
+    """
+    Clasifica muchos títulos: CLASSIFY_BATCH_SIZE por request (el prefijo de
+    reglas/ejemplos se comparte), hasta CLASSIFY_WORKERS requests en paralelo
+    y respuesta validada con JSON schema. Devuelve una categoría por título.
+    """
+    titles = list(titles)
+    if not client:
+        return ["Unknown"] * len(titles)
+    chunks = [titles[i:i + CLASSIFY_BATCH_SIZE] for i in range(0, len(titles), CLASSIFY_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, CLASSIFY_WORKERS)) as pool:
+        return [cat for chunk in pool.map(_classify_chunk, chunks) for cat in chunk]
+
+
+def ai_classify_category(title: str):
+    return ai_classify_categories([title])[0]
 
 # ============================================================
 # 🚀 Proceso principal
 # ============================================================
-def categorize_product(json_path):
-    if not os.path.exists(json_path):
-        for base in ["outputs/json", "outputs"]:
-            candidate = os.path.join(base, os.path.basename(json_path))
-            if os.path.exists(candidate):
-                json_path = candidate
-                break
-    if not os.path.exists(json_path):
-        print(f"❌ File not found: {json_path}")
-        sys.exit(1)
+TITLE_KEYS = [
+    "attributes.item_name[0].value",
+    "attribute_sets[0].item_name",
+    "attribute_sets[0].title",
+    "summaries[0].itemName",
+    "summaries[0].productTitle",
+    "attribute_sets[0].productTitle",
+    "attributes.title[0].value",
+    "attributes.item_title[0].value",
+    "productInfo.title",
+    "product_title",
+    "item_name",
+    "title",
+    "display_name",
+    "name",
+    "product_name",
+    "product_label",
+    "product_summary.title",
+    "details.title",
+]
 
-    data = load_json(json_path)
+
+def _load(json_path):
+    """(data, asin, cache_path) de una ruta o ASIN; data=None si no existe."""
+    if not os.path.exists(json_path):
+        candidate = os.path.join("outputs", os.path.basename(json_path))
+        if os.path.exists(candidate):
+            json_path = candidate
+    data = load_product(json_path)
+    if data is None:
+        return None, None, None
     asin = data.get("asin", os.path.basename(json_path).split(".")[0])
-    cache_path = f"{CACHE_DIR}/{asin}_category.json"
+    return data, asin, f"{CACHE_DIR}/{asin}_category.json"
 
-    # 🧠 Cache
-    if os.path.exists(cache_path):
-        print(f"♻️ Using cached category: {cache_path}\n")
-        result = load_json(cache_path)
-        print(json.dumps(result, indent=2, ensure_ascii=False))
-        return result
 
+def extract_title(data):
     flat = flatten_json(data)
 
     # 🔍 Posibles claves de título
-    possible_keys = [
-        "attributes.item_name[0].value",
-        "attribute_sets[0].item_name",
-        "attribute_sets[0].title",
-        "summaries[0].itemName",
-        "summaries[0].productTitle",
-        "attribute_sets[0].productTitle",
-        "attributes.title[0].value",
-        "attributes.item_title[0].value",
-        "productInfo.title",
-        "product_title",
-        "item_name",
-        "title",
-        "display_name",
-        "name",
-        "product_name",
-        "product_label",
-        "product_summary.title",
-        "details.title",
-    ]
-
     title = None
-    for key in possible_keys:
+    for key in TITLE_KEYS:
         for fk, v in flat.items():
             if key.lower() in fk.lower() and len(str(v)) > 5:
                 title = v
@@ -176,17 +266,13 @@ def categorize_product(json_path):
             and not v.lower().startswith(("en_", "es_", "fr_"))
         ]
         title = candidates[0] if candidates else "Unknown Product"
+    return title
 
-    print(f"\n🔍 Analyzing product:\n🧱 Title: {title}\n")
-
-    # 1️⃣ IA genera categoría base
-    ai_cat = ai_classify_category(title)
-    print(f"🤖 AI category guess: {ai_cat}")
 
+def _build_result(asin, title, ai_cat):
     # 2️⃣ (Luego se integrará con embeddings)
     found = None
-
-    result = {
+    return {
         "asin": asin,
         "title": title,
         "ai_category": ai_cat,
@@ -195,20 +281,94 @@ def categorize_product(json_path):
         "site": found.get("site") if found else None,
     }
 
+
+def categorize_product(json_path, refresh=False):
+    """
+    Acepta una ruta a JSON o directamente un ASIN (se busca en el product store).
+    Con refresh=True ignora la categoría cacheada (producto que cambió).
+    """
+    data, asin, cache_path = _load(json_path)
+    if data is None:
+        print(f"❌ File not found: {json_path}")
+        sys.exit(1)
+
+    # 🧠 Cache
+    if os.path.exists(cache_path) and not refresh:
+        print(f"♻️ Using cached category: {cache_path}\n")
+        result = load_json(cache_path)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return result
+
+    title = extract_title(data)
+    print(f"\n🔍 Analyzing product:\n🧱 Title: {title}\n")
+
+    # 1️⃣ IA genera categoría base
+    ai_cat = ai_classify_category(title)
+    print(f"🤖 AI category guess: {ai_cat}")
+
+    result = _build_result(asin, title, ai_cat)
     save_json(cache_path, result)
     print(f"\n💾 Saved to cache: {cache_path}")
     print(json.dumps(result, indent=2, ensure_ascii=False))
     return result
 
+
+def categorize_products(refs, refresh=()):
+    """
+    Versión batch: carga todos los productos, descarta los ya cacheados (salvo
+    los de `refresh`) y clasifica el resto con ai_classify_categories.
+    Devuelve {asin: resultado}.
+    """
+    refresh = set(refresh)
+    results, todo = {}, []
+    for ref in refs:
+        data, asin, cache_path = _load(ref)
+        if data is None:
+            print(f"⚠️ {ref} no está disponible, se saltea.")
+            continue
+        if os.path.exists(cache_path) and ref not in refresh and asin not in refresh:
+            results[asin] = load_json(cache_path)
+            continue
+        todo.append((asin, cache_path, extract_title(data)))
+
+    print(f"♻️ {len(results)} en cache | 🤖 {len(todo)} títulos a clasificar "
+          f"(lotes de {CLASSIFY_BATCH_SIZE}, {CLASSIFY_WORKERS} en paralelo)")
+    cats = ai_classify_categories([t for _, _, t in todo])
+    for (asin, cache_path, title), ai_cat in zip(todo, cats):
+        results[asin] = _build_result(asin, title, ai_cat)
+        save_json(cache_path, results[asin])
+        print(f"   • {asin} → {ai_cat} | {title[:70]}")
+    return results
+
 # ============================================================
 # 🧩 CLI (robusto)
 # ============================================================
 if __name__ == "__main__":
     print("🔧 categorize.py started")
     if len(sys.argv) < 2:
-        print("⚠️ Usage: python3 categorize.py <amazon_json_path>")
+        print("⚠️ Usage: python3 categorize.py <amazon_json_path | ASIN>")
+        print("         python3 categorize.py <ASIN> <ASIN> ...            (batch)")
+        print("         python3 categorize.py --batch [asins.txt]          (batch desde archivo)")
+        print("         python3 categorize.py --delta [delta.jsonl]   (solo ASINs nuevos/cambiados)")
         sys.exit(1)
 
+    delta_path = delta_arg(sys.argv)
+    if delta_path is not None:
+        entries = read_delta(delta_path)
+        print(f"🔀 Delta {delta_path or '(ninguno)'}: {len(entries)} ASINs para categorizar")
+        categorize_products([e["asin"] for e in entries],
+                            refresh=[e["asin"] for e in entries if e["change"] == CHANGE_CHANGED])
+        sys.exit(0)
+
+    if sys.argv[1] == "--batch" or len(sys.argv) > 2:
+        if sys.argv[1] == "--batch":
+            with open(sys.argv[2] if len(sys.argv) > 2 else "asins.txt", "r", encoding="utf-8") as f:
+                refs = [a.strip() for a in f if a.strip()]
+        else:
+            refs = sys.argv[1:]
+        categorize_products(list(dict.fromkeys(refs)))
+        sys.exit(0)
+
     json_path = sys.argv[1]
     print(f"📂 Input path: {json_path}")
     try:
@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-category_downloader.py — v5 (CBT version)
-Descarga el árbol de categorías Global Selling (CBT)
-y lo guarda en data/cbt_categories.json con todos los atributos incluidos.
+category_downloader.py — v6 (CBT version, streaming)
+Descarga el árbol de categorías Global Selling (CBT) con todos los atributos
+y lo procesa en streaming: descomprime el gzip a medida que llega, parsea
+categoría por categoría y las escribe en el store indexado
+(data/cbt_categories.sqlite) y en data/cbt_categories.json (compacto).
+
+Usa GET condicional (If-None-Match / If-Modified-Since): si el árbol no
+cambió desde la última descarga, no se vuelve a bajar.
+
+Uso:
+  python3 category_downloader.py           # descarga solo si cambió
+  python3 category_downloader.py --force   # ignora ETag / Last-Modified
 """
 
-import os, sys, gzip, json, requests
+import os, sys, json, requests
 from dotenv import load_dotenv
 
 # ============================================================
@@ -17,52 +26,103 @@ if os.path.exists(venv_python) and sys.executable != venv_python:
     print(f"⚙️ Activando entorno virtual automáticamente desde: {venv_python}")
     os.execv(venv_python, [venv_python] + sys.argv)
 
+from token_broker import meli_broker
+from category_store import CategoryStoreBuilder, STORE_PATH, iter_text, iter_object_items
+
 # ============================================================
-# 🚀 Cargar entorno y credenciales
+# 🚀 Cargar entorno y configuración
 # ============================================================
 load_dotenv()
-ACCESS_TOKEN = os.getenv("ML_ACCESS_TOKEN", "")
 API_URL = "https://api.mercadolibre.com/sites/CBT/categories/all?withAttributes=true"
 OUT_DIR = "data"
-OUT_GZ = os.path.join(OUT_DIR, "cbt_categories.gz")
 OUT_JSON = os.path.join(OUT_DIR, "cbt_categories.json")
+META_PATH = os.path.join(OUT_DIR, "cbt_categories.download.json")
+CHUNK_SIZE = 64 * 1024
+# Seguimos escribiendo el JSON plano para los scripts que todavía lo leen
+WRITE_JSON = os.getenv("CATEGORIES_WRITE_JSON", "1") == "1"
 
 os.makedirs(OUT_DIR, exist_ok=True)
 
-if not ACCESS_TOKEN:
-    print("❌ ERROR: No se encontró ML_ACCESS_TOKEN en .env o variables de entorno.")
-    print("➡️ Usa: export ML_ACCESS_TOKEN='APP_USR-XXXXXX'")
-    sys.exit(1)
 
-print("⬇️ Descargando árbol de categorías Global Selling (CBT)...")
-print(f"🔑 Token usado: {ACCESS_TOKEN[:20]}...")
+# ============================================================
+# 🌐 Descarga condicional
+# ============================================================
+def load_meta():
+    try:
+        with open(META_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_meta(meta):
+    with open(META_PATH, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def main():
+    force = "--force" in sys.argv
+    meta = load_meta()
+    have_outputs = os.path.exists(STORE_PATH)
 
-try:
-    r = requests.get(API_URL, headers={"Authorization": f"Bearer {ACCESS_TOKEN}"}, stream=True)
-    print(f"🔍 HTTP status: {r.status_code}")
-    r.raise_for_status()
-except Exception as e:
-    print(f"❌ Error al descargar: {e}")
-    sys.exit(1)
+    headers = {}
+    if not force and have_outputs:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
 
-with open(OUT_GZ, "wb") as f:
-    for chunk in r.iter_content(chunk_size=8192):
-        f.write(chunk)
+    print("⬇️ Descargando árbol de categorías Global Selling (CBT)...")
+    try:
+        r = meli_broker().request("GET", API_URL, headers=headers, stream=True, timeout=120)
+        print(f"🔍 HTTP status: {r.status_code}")
+        if r.status_code == 304:
+            print("♻️ El árbol no cambió desde la última descarga (304). Nada que hacer.")
+            return
+        r.raise_for_status()
+    except Exception as e:
+        print(f"❌ Error al descargar: {e}")
+        sys.exit(1)
 
-print(f"✅ Archivo comprimido guardado: {OUT_GZ}")
+    print("🗜️ Descomprimiendo y parseando en streaming...")
+    builder = CategoryStoreBuilder()
+    json_tmp = OUT_JSON + ".tmp"
+    out = open(json_tmp, "w", encoding="utf-8") if WRITE_JSON else None
+    try:
+        if out:
+            out.write("{")
+        for cid, cdata in iter_object_items(iter_text(r.iter_content(chunk_size=CHUNK_SIZE))):
+            builder.add(cid, cdata)
+            if out:
+                out.write(("," if builder.count > 1 else "") + json.dumps(cid) + ":"
+                          + json.dumps(cdata, ensure_ascii=False, separators=(",", ":")))
+            if builder.count % 1000 == 0:
+                print(f"\r📦 {builder.count} categorías procesadas...", end="")
+        if out:
+            out.write("}")
+            out.close()
+            os.replace(json_tmp, OUT_JSON)
+        builder.commit()
+    except Exception as e:
+        builder.abort()
+        if out:
+            out.close()
+            os.remove(json_tmp)
+        print(f"\n❌ Error al procesar el árbol: {e}")
+        sys.exit(1)
 
-print("🗜️ Descomprimiendo JSON...")
-try:
-    with gzip.open(OUT_GZ, "rb") as gz_file:
-        data = json.loads(gz_file.read().decode("utf-8"))
-except Exception as e:
-    print(f"❌ Error al descomprimir: {e}")
-    sys.exit(1)
+    save_meta({
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "categories": builder.count,
+    })
 
-with open(OUT_JSON, "w", encoding="utf-8") as out:
-    json.dump(data, out, indent=2, ensure_ascii=False)
+    print(f"\n✅ Store de categorías guardado: {STORE_PATH}")
+    if WRITE_JSON:
+        print(f"✅ Árbol de categorías guardado: {OUT_JSON}")
+    print(f"📊 Total de categorías descargadas: {builder.count}")
+    print("\n🎯 Finalizado correctamente.")
 
-print(f"✅ Árbol de categorías guardado: {OUT_JSON}")
-print(f"📊 Total de categorías descargadas: {len(data)}")
 
-print("\n🎯 Finalizado correctamente.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -3,29 +3,48 @@
 """
 category_embedder.py
 Convierte el árbol de categorías CBT en embeddings locales para clasificación IA.
+Incremental: cada embedding se guarda en data/embeddings_store.sqlite con clave
+sha256(modelo + texto), así una nueva corrida solo embebe categorías nuevas o
+renombradas y reconstruye la matriz desde el store.
+
+Los lotes se embeben en paralelo (EMBED_WORKERS) detrás de un limitador de
+requests/min y tokens/min (EMBED_RPM / EMBED_TPM). El tamaño de lote se
+adapta solo: crece mientras todo va bien y se achica ante errores. Cada lote
+terminado queda guardado, así un corte no pierde el progreso.
+
+Backend de embeddings según EMBEDDING_BACKEND (ver embedding_backend.py):
+con `onnx` el índice se arma en local, sin red ni límites de la API.
 """
 
-import os, sys, json, numpy as np, time
-from openai import OpenAI
+import os, sys, json, numpy as np, time, random, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
 from dotenv import load_dotenv
+from category_store import get_category_store
+from embedding_cache import EmbeddingStore, embedding_key
+from rate_limit import TokenBucket
+from embedding_backend import get_backend, write_index_info, INFO_PATH
+from category_index import build_index, index_prefix
+from ann_index import ANN_ENABLED, build_ivf, ivf_path
 
 # ============================================================
 # ⚙️ Configuración
 # ============================================================
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "text-embedding-3-small")
-
 DATA_DIR = "data"
 IN_PATH = os.path.join(DATA_DIR, "cbt_categories.json")
 OUT_PATH = os.path.join(DATA_DIR, "cbt_embeddings.npy")
 META_PATH = os.path.join(DATA_DIR, "cbt_categories_meta.json")
 
-if not OPENAI_API_KEY:
-    print("❌ Falta la variable OPENAI_API_KEY en .env")
-    sys.exit(1)
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Límites de la API de embeddings (ajustar según el tier de la cuenta)
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RPM = float(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = float(os.getenv("EMBED_TPM", "1000000"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "2048"))            # máx. inputs por request
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "250000"))
+EMBED_START_BATCH = int(os.getenv("EMBED_START_BATCH", "256"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
 
 # ============================================================
 # 📊 Utilidad: barra de progreso
@@ -39,9 +58,123 @@ def progress_bar(current, total, width=40):
 # ============================================================
 # 🧠 Generar embeddings
 # ============================================================
-def embed_texts(texts):
-    res = client.embeddings.create(model=OPENAI_MODEL, input=texts)
-    return [d.embedding for d in res.data]
+def embed_texts(texts, backend=None):
+    return (backend or get_backend()).embed(texts)
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token en inglés/español; alcanza para el limitador
+    return len(text) // 4 + 1
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError,
+              openai.APITimeoutError, openai.InternalServerError)
+
+def _retry_after(e) -> float:
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except Exception:
+        return 0.0
+
+
+class EmbeddingJob:
+    """
+    Embebe `texts` con varios workers y guarda cada lote en `store` apenas
+    termina. Lotes adaptativos: x2 tras cada éxito (hasta EMBED_MAX_BATCH /
+    EMBED_MAX_BATCH_TOKENS), /2 ante un BadRequest (lote demasiado grande).
+    Con un backend local no hay límites de la API y alcanza un solo worker
+    (onnxruntime ya usa todos los núcleos).
+    """
+
+    def __init__(self, texts, store, backend=None, workers=EMBED_WORKERS):
+        self.pending = deque(texts)
+        self.total = len(texts)
+        self.store = store
+        self.backend = backend or get_backend()
+        self.model = self.backend.model_id
+        self.remote = self.backend.remote
+        self.workers = max(1, workers) if self.remote else 1
+        self.batch_size = min(EMBED_START_BATCH, EMBED_MAX_BATCH)
+        self.rpm = TokenBucket(EMBED_RPM / 60.0, max(1.0, EMBED_RPM / 60.0))
+        self.tpm = TokenBucket(EMBED_TPM / 60.0, max(EMBED_MAX_BATCH_TOKENS, EMBED_TPM / 60.0))
+        self.done = 0
+        self.failed = []
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def _next_batch(self):
+        with self._lock:
+            batch, tokens = [], 0
+            while self.pending and len(batch) < self.batch_size:
+                t = estimate_tokens(self.pending[0])
+                if batch and tokens + t > EMBED_MAX_BATCH_TOKENS:
+                    break
+                batch.append(self.pending.popleft())
+                tokens += t
+            return batch, tokens
+
+    def _requeue(self, batch):
+        with self._lock:
+            self.pending.extendleft(reversed(batch))
+
+    def _embed(self, batch, tokens):
+        if not self.remote:
+            return embed_texts(batch, self.backend)
+        for attempt in range(1, EMBED_MAX_RETRIES + 1):
+            self.rpm.acquire()
+            self.tpm.acquire(tokens)
+            try:
+                vecs = embed_texts(batch, self.backend)
+                self.rpm.recover()
+                self.tpm.recover()
+                return vecs
+            except _RETRYABLE as e:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self.rpm.backoff()
+                    self.tpm.backoff()
+                sleep_s = max(_retry_after(e), min(2 ** attempt, 60) * (0.5 + random.random() / 2))
+                print(f"\n⏳ {type(e).__name__} (intento {attempt}), reintento en {sleep_s:.1f}s")
+                time.sleep(sleep_s)
+
+    def _worker(self):
+        while True:
+            batch, tokens = self._next_batch()
+            if not batch:
+                return
+            try:
+                vecs = self._embed(batch, tokens)
+            except openai.BadRequestError as e:
+                if len(batch) == 1:
+                    print(f"\n⚠️ Texto rechazado por la API, se omite: {batch[0][:60]!r} ({e})")
+                    with self._lock:
+                        self.failed.extend(batch)
+                    continue
+                with self._lock:
+                    self.batch_size = max(1, len(batch) // 2)
+                self._requeue(batch[len(batch) // 2:])
+                self._requeue(batch[:len(batch) // 2])
+                continue
+            except Exception as e:
+                print(f"\n❌ Lote de {len(batch)} textos falló: {e}")
+                with self._lock:
+                    self.failed.extend(batch)
+                continue
+
+            items = [(embedding_key(self.model, t), v) for t, v in zip(batch, vecs)]
+            self.store.put_many(self.model, items)   # checkpoint
+            with self._lock:
+                self.results.update((k, np.asarray(v, dtype=np.float32)) for k, v in items)
+                self.done += len(batch)
+                self.batch_size = min(EMBED_MAX_BATCH, self.batch_size * 2)
+                progress_bar(self.done, self.total)
+
+    def run(self) -> dict:
+        if not self.total:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for f in [pool.submit(self._worker) for _ in range(self.workers)]:
+                f.result()
+        return self.results
 
 # ============================================================
 # 🚀 Main
@@ -49,42 +182,72 @@ def embed_texts(texts):
 def main():
     print("\n⚙️ Ejecutando category_embedder.py...\n")
 
-    if not os.path.exists(IN_PATH):
-        print(f"❌ No existe {IN_PATH}")
-        sys.exit(1)
-
-    print(f"📖 Cargando categorías desde {IN_PATH} ...")
-    with open(IN_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
+    leaves_only = "--leaves" in sys.argv
+    store = get_category_store()
     categories = []
-    for cid, cdata in data.items():
-        name = cdata.get("name", "").strip()
-        if name:
-            categories.append((cid, name))
+    if store is not None:
+        # Store indexado: no hace falta parsear el JSON completo
+        print(f"📖 Cargando categorías desde {store.path} ...")
+        for cid, name, _path in store.iter_categories(leaves_only=leaves_only):
+            if name.strip():
+                categories.append((cid, name.strip()))
+    else:
+        if not os.path.exists(IN_PATH):
+            print(f"❌ No existe {IN_PATH}")
+            sys.exit(1)
+
+        print(f"📖 Cargando categorías desde {IN_PATH} ...")
+        with open(IN_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        for cid, cdata in data.items():
+            name = cdata.get("name", "").strip()
+            if name and (not leaves_only or not cdata.get("children_categories")):
+                categories.append((cid, name))
+
+    try:
+        backend = get_backend()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"🧠 Backend de embeddings: {backend.name} ({backend.model_id})")
 
     total = len(categories)
-    print(f"📦 {total} categorías detectadas. Generando embeddings...\n")
-
     names = [c[1] for c in categories]
-    embeddings = []
-    batch_size = 100
-
-    for i in range(0, total, batch_size):
-        batch = names[i:i + batch_size]
-        emb = embed_texts(batch)
-        embeddings.extend(emb)
-        progress_bar(i + len(batch), total)
-        time.sleep(0.05)
+    keys = [embedding_key(backend.model_id, n) for n in names]
+
+    emb_store = EmbeddingStore()
+    cached = emb_store.get_many(keys)
+    # Textos únicos que todavía no tienen embedding con este modelo
+    missing = list(dict.fromkeys(n for n, k in zip(names, keys) if k not in cached))
+    print(f"📦 {total} categorías detectadas | ♻️ {total - sum(k not in cached for k in keys)} reutilizadas "
+          f"| 🆕 {len(missing)} textos a embeber\n")
+
+    job = EmbeddingJob(missing, emb_store, backend)
+    cached.update(job.run())
+    if job.failed:
+        print(f"\n\n⚠️ {len(job.failed)} textos sin embedding. Lo ya embebido quedó guardado: "
+              "volvé a correr el script para completar.")
+        sys.exit(1)
 
     print("\n\n✅ Proceso completado.")
 
-    np.save(OUT_PATH, np.array(embeddings))
+    embeddings = np.stack([cached[k] for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+    np.save(OUT_PATH, embeddings)
     with open(META_PATH, "w", encoding="utf-8") as f:
         json.dump(categories, f, ensure_ascii=False, indent=2)
+    write_index_info(backend, *embeddings.shape)
+    if len(embeddings):
+        index = build_index(OUT_PATH)
+        ivf = build_ivf(OUT_PATH, index=index) if ANN_ENABLED else None
 
     print(f"💾 Embeddings guardados en: {OUT_PATH}")
     print(f"💾 Metadatos guardados en: {META_PATH}")
+    print(f"💾 Info del índice en: {INFO_PATH}")
+    if len(embeddings):
+        print(f"🗜️ Índice {index.meta['dtype']} (dim {index.dim}) en: {index_prefix(OUT_PATH)}.npy")
+        if ivf is not None:
+            print(f"🧭 Índice IVF ({ivf.n_lists} listas) en: {ivf_path(OUT_PATH)}")
     print("✅ Listo para usar con category_matcher.py\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+category_index.py
+Índice de embeddings de categorías listo para consultar:
+
+- vectores normalizados de antemano (coseno = producto punto)
+- cuantizados a float16, o a int8 con un factor de escala por fila
+- reducción de dimensiones opcional con PCA (CATEGORY_INDEX_DIM)
+- se abre con mmap: varios procesos comparten las mismas páginas y no
+  hay que cargar la matriz entera en RAM
+
+`get_category_index()` devuelve el CategoryIndex del proceso (matriz, ids,
+nombres y backend de embeddings), cargado una sola vez y a demanda. Con
+CATEGORY_ANN=1 las búsquedas pasan por el índice IVF de ann_index.py.
+Las consultas se embeben a través de QueryEmbeddingCache (memoria + disco).
+
+Archivos (prefijo = la matriz de origen sin .npy + ".index"):
+  <prefijo>.npy         matriz cuantizada (N × d)
+  <prefijo>.scales.npy  escala por fila (solo int8)
+  <prefijo>.pca.npz     media + componentes (solo si hay PCA)
+  <prefijo>.json        metadata (dtype, dims, cantidad)
+
+Uso:
+  python3 category_index.py build [data/cbt_embeddings.npy] [--dtype int8] [--dim 256]
+  python3 category_index.py stats [data/cbt_embeddings.npy]
+  python3 category_index.py query "water filter pitcher" [--k 5]
+"""
+
+import os, sys, json, time, threading
+import numpy as np
+
+from embedding_cache import QueryEmbeddingCache
+
+EMB_PATH = os.path.join("data", "cbt_embeddings.npy")
+# (matriz, metadatos) en orden de preferencia; el par viejo queda como respaldo
+SOURCES = [
+    (EMB_PATH, os.path.join("data", "cbt_categories_meta.json")),
+    (os.path.join("data", "category_embeddings.npy"), os.path.join("data", "category_texts.json")),
+]
+INDEX_DTYPE = os.getenv("CATEGORY_INDEX_DTYPE", "float16").strip().lower()   # float32 | float16 | int8
+INDEX_DIM = int(os.getenv("CATEGORY_INDEX_DIM", "0"))                          # 0 = sin PCA
+DTYPES = ("float32", "float16", "int8")
+SCORE_BLOCK_ROWS = 16384
+
+
+def index_prefix(emb_path: str = EMB_PATH) -> str:
+    return os.path.splitext(emb_path)[0] + ".index"
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    return X / np.clip(norms, 1e-12, None)
+
+
+def _save_npy(path: str, arr: np.ndarray):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+# ============================================================
+# 🔎 Matriz cuantizada
+# ============================================================
+class IndexMatrix:
+    """
+    Matriz de categorías ya normalizada/cuantizada. `scores(q)` recibe el
+    embedding crudo de la consulta (misma dimensión que el modelo) y devuelve
+    la similitud coseno contra todas las filas con un solo producto punto.
+    """
+
+    def __init__(self, matrix, scales=None, pca_mean=None, pca_components=None, meta=None):
+        self.matrix = matrix
+        self.scales = scales
+        self.pca_mean = pca_mean
+        self.pca_components = pca_components
+        self.meta = meta or {}
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def prepare(self, Q) -> np.ndarray:
+        """Proyecta (PCA) y normaliza consultas: (d,) o (q, d) → float32."""
+        Q = np.asarray(Q, dtype=np.float32)
+        if self.pca_components is not None:
+            Q = (Q - self.pca_mean) @ self.pca_components.T
+        return _normalize(Q).astype(np.float32, copy=False)
+
+    def scores(self, Q) -> np.ndarray:
+        """Coseno contra todas las categorías: (N,) para un vector, (q, N) para varios."""
+        return self.dot(self.prepare(Q))
+
+    def dot(self, Qn, rows=None) -> np.ndarray:
+        """Producto punto de consultas ya preparadas contra todas las filas o solo `rows`."""
+        if rows is not None:
+            return Qn @ self.vectors(rows).T
+        if self.matrix.dtype == np.float32:
+            S = Qn @ self.matrix.T
+        else:
+            # numpy no tiene BLAS para f16/int8: se pasa a float32 por bloques,
+            # así nunca hay una copia float32 de la matriz entera en memoria
+            S = np.empty(Qn.shape[:-1] + (len(self),), dtype=np.float32)
+            for start in range(0, len(self), SCORE_BLOCK_ROWS):
+                block = self.matrix[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+                S[..., start:start + len(block)] = Qn @ block.T
+        if self.scales is not None:
+            S *= self.scales
+        return S
+
+    def vectors(self, rows) -> np.ndarray:
+        """Filas decuantizadas a float32 (slice o array de índices)."""
+        V = np.asarray(self.matrix[rows], dtype=np.float32)
+        if self.scales is not None:
+            V *= self.scales[rows][..., None]
+        return V
+
+    @classmethod
+    def from_embeddings(cls, X, dtype: str = INDEX_DTYPE, dim: int = INDEX_DIM):
+        """Construye el índice en memoria (normaliza, PCA opcional, cuantiza)."""
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype inválido: {dtype} (opciones: {', '.join(DTYPES)})")
+        X = np.asarray(X, dtype=np.float32)
+        source_dim = X.shape[1]
+        mean = components = None
+        if dim and dim < source_dim:
+            mean = X.mean(axis=0)
+            Xc = X - mean
+            # Autovectores de la covarianza (d × d): más barato que SVD sobre N × d
+            w, v = np.linalg.eigh(Xc.T @ Xc)
+            components = v[:, np.argsort(w)[::-1][:dim]].T.astype(np.float32)
+            X = Xc @ components.T
+        X = _normalize(X)
+
+        scales = None
+        if dtype == "int8":
+            scales = (np.abs(X).max(axis=1) / 127.0).astype(np.float32)
+            scales[scales == 0] = 1.0
+            M = np.round(X / scales[:, None]).astype(np.int8)
+        else:
+            M = X.astype(dtype)
+        meta = {"dtype": dtype, "count": int(M.shape[0]), "dim": int(M.shape[1]),
+                "source_dim": int(source_dim), "pca": components is not None}
+        return cls(M, scales, mean, components, meta)
+
+    # ============================================================
+    # 💾 Persistencia
+    # ============================================================
+    def save(self, prefix: str):
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        _save_npy(prefix + ".npy", self.matrix)
+        if self.scales is not None:
+            _save_npy(prefix + ".scales.npy", self.scales)
+        if self.pca_components is not None:
+            tmp = prefix + ".pca.tmp.npz"
+            np.savez(tmp, mean=self.pca_mean, components=self.pca_components)
+            os.replace(tmp, prefix + ".pca.npz")
+        meta = dict(self.meta, built_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        # El .json se escribe último: es la marca de que el índice está completo
+        tmp = prefix + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, prefix + ".json")
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = True):
+        with open(prefix + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(prefix + ".npy", mmap_mode="r" if mmap else None)
+        scales = np.load(prefix + ".scales.npy") if meta.get("dtype") == "int8" else None
+        mean = components = None
+        if meta.get("pca"):
+            with np.load(prefix + ".pca.npz") as z:
+                mean, components = z["mean"], z["components"]
+        return cls(matrix, scales, mean, components, meta)
+
+
+def build_index(emb_path: str = EMB_PATH, dtype: str = INDEX_DTYPE, dim: int = INDEX_DIM) -> IndexMatrix:
+    X = np.load(emb_path, mmap_mode="r")
+    index = IndexMatrix.from_embeddings(X, dtype=dtype, dim=dim)
+    index.save(index_prefix(emb_path))
+    return index
+
+
+def load_index(emb_path: str = EMB_PATH) -> IndexMatrix:
+    """
+    Abre (mmap) el índice de `emb_path`. Si no existe o es más viejo que la
+    matriz de origen, lo reconstruye primero con la configuración actual.
+    """
+    prefix = index_prefix(emb_path)
+    meta_path = prefix + ".json"
+    if not os.path.exists(meta_path) or os.path.getmtime(meta_path) < os.path.getmtime(emb_path):
+        print(f"🗜️ Construyendo índice {INDEX_DTYPE} de {emb_path} ...")
+        build_index(emb_path)
+    return IndexMatrix.load(prefix)
+
+
+# ============================================================
+# 🗂️ Índice de categorías del proceso
+# ============================================================
+def _parse_meta_entry(m):
+    """Metadatos viejos y nuevos: {"id", "name"/"full_name"} o [id, name]."""
+    if isinstance(m, dict):
+        return m.get("id") or m.get("category_id"), m.get("full_name") or m.get("name") or m.get("category_name") or ""
+    if isinstance(m, (list, tuple)) and len(m) >= 2:
+        return m[0], m[1]
+    return str(m), str(m)
+
+
+class CategoryIndex:
+    """
+    Matriz + ids + nombres + backend de embeddings, cargados una sola vez
+    (la primera consulta) y compartidos entre hilos.
+    """
+
+    def __init__(self, emb_path: str = None, meta_path: str = None):
+        if emb_path is None:
+            emb_path, meta_path = next(((e, m) for e, m in SOURCES
+                                        if os.path.exists(e) and os.path.exists(m)), SOURCES[0])
+        self.emb_path = emb_path
+        self.meta_path = meta_path
+        self.matrix = None
+        self.ids = []
+        self.names = []
+        self.row_of = {}
+        self.backend = None
+        self.query_cache = None
+        self.ann = None
+        self._lock = threading.Lock()
+
+    def load(self) -> "CategoryIndex":
+        """Carga el índice ya (en vez de en la primera consulta). Idempotente."""
+        self._ensure_loaded()
+        return self
+
+    def _ensure_loaded(self):
+        if self.matrix is not None:
+            return
+        with self._lock:
+            if self.matrix is not None:
+                return
+            if not (os.path.exists(self.emb_path) and os.path.exists(self.meta_path)):
+                raise FileNotFoundError(
+                    f"Faltan {self.emb_path} / {self.meta_path}. Ejecutá primero: category_embedder.py")
+            from embedding_backend import backend_for_index
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                entries = [_parse_meta_entry(m) for m in json.load(f)]
+            matrix = load_index(self.emb_path)
+            if len(entries) != len(matrix):
+                raise RuntimeError(f"{self.meta_path} tiene {len(entries)} categorías y "
+                                   f"{self.emb_path} {len(matrix)}. Regenerá con category_embedder.py")
+            self.ids = [e[0] for e in entries]
+            self.names = [e[1] for e in entries]
+            self.row_of = {cid: i for i, cid in enumerate(self.ids)}
+            self.backend = backend_for_index()
+            self.query_cache = QueryEmbeddingCache(self.backend)
+            from ann_index import ANN_ENABLED, load_ivf
+            if ANN_ENABLED:
+                self.ann = load_ivf(self.emb_path, index=matrix)
+            print(f"📦 Índice de categorías cargado: {len(entries)} categorías ({matrix.meta.get('dtype')})")
+            self.matrix = matrix   # último: marca el índice como listo para los demás hilos
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.ids)
+
+    def scores(self, queries) -> np.ndarray:
+        """(Q, N): un solo request de embeddings y un solo producto de matrices."""
+        self._ensure_loaded()
+        return self.matrix.scores(self.query_cache.embed(list(queries)))
+
+    def top_k_many(self, queries, k: int = 5):
+        """Por cada consulta: [(category_id, name, similitud)] de mayor a menor."""
+        queries = list(queries)
+        if not queries:
+            return []
+        self._ensure_loaded()
+        if self.ann is not None:
+            from ann_index import ANN_NPROBE
+            Qn = self.matrix.prepare(self.query_cache.embed(queries))
+            top, top_scores = self.ann.search(self.matrix, Qn, k, ANN_NPROBE)
+            return [[(self.ids[i], self.names[i], float(s)) for i, s in zip(row, row_s) if i >= 0]
+                    for row, row_s in zip(top, top_scores)]
+        S = self.scores(queries)
+        k = min(k, S.shape[1])
+        # argpartition deja los k mejores (sin ordenar) y solo esos se ordenan
+        top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(S, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [[(self.ids[i], self.names[i], float(s)) for i, s in zip(row, row_s)]
+                for row, row_s in zip(top, top_scores)]
+
+    def top_k(self, query: str, k: int = 5):
+        """[(category_id, name, similitud)] de mayor a menor."""
+        return self.top_k_many([query], k)[0]
+
+    def best(self, query: str):
+        """(category_id, name, similitud) de la categoría más cercana."""
+        return self.top_k(query, 1)[0]
+
+    def similarities(self, queries, id_lists):
+        """Coseno de cada consulta contra sus propias categorías (None si el id no está indexado)."""
+        self._ensure_loaded()
+        Qn = self.matrix.prepare(self.query_cache.embed(list(queries)))
+        out = []
+        for qn, ids in zip(Qn, id_lists):
+            rows = [self.row_of.get(cid) for cid in ids]
+            valid = np.asarray([r for r in rows if r is not None], dtype=np.int64)
+            sims = iter(self.matrix.dot(qn[None, :], rows=valid)[0].tolist() if len(valid) else [])
+            out.append([next(sims) if r is not None else None for r in rows])
+        return out
+
+    def cache_stats(self) -> dict:
+        """Hits/misses del cache de embeddings de consultas."""
+        return self.query_cache.stats() if self.query_cache else {}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_category_index() -> CategoryIndex:
+    """CategoryIndex compartido del proceso (se carga en la primera consulta)."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CategoryIndex()
+    return _index
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def _opt(name, default):
+    if name in sys.argv:
+        i = sys.argv.index(name)
+        if i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    pos = [a for i, a in enumerate(sys.argv[2:], 2)
+           if not a.startswith("--") and not sys.argv[i - 1].startswith("--")]
+    emb_path = pos[0] if pos else EMB_PATH
+    if cmd == "build":
+        index = build_index(emb_path, dtype=_opt("--dtype", INDEX_DTYPE), dim=int(_opt("--dim", INDEX_DIM)))
+        src_mb = os.path.getsize(emb_path) / 1e6
+        idx_mb = index.matrix.nbytes / 1e6
+        print(f"✅ {len(index)} categorías → {index_prefix(emb_path)}.npy "
+              f"({index.meta['dtype']}, dim {index.dim}) | {src_mb:.1f} MB → {idx_mb:.1f} MB")
+    elif cmd == "stats":
+        index = IndexMatrix.load(index_prefix(emb_path))
+        print(json.dumps(index.meta, indent=2))
+    elif cmd == "query" and pos:
+        for cid, name, score in get_category_index().top_k(" ".join(pos), int(_opt("--k", 5))):
+            print(f"   • {name} ({cid}) → {score:.3f}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
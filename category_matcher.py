@@ -8,11 +8,16 @@ Autor: Felipe Melucci + GPT-5
 
 import json
 import numpy as np
+import os
 import sys
+import time
 import openai
 from openai import OpenAI
 from pathlib import Path
-from sklearn.metrics.pairwise import cosine_similarity
+from product_store import load_product
+from category_index import get_category_index
+from category_store import get_category_store
+from lexical_index import get_lexical_index
 
 # ────────────────────────────────────────────────────────────────
 # CONFIG
@@ -20,120 +25,356 @@ from sklearn.metrics.pairwise import cosine_similarity
 DATA_DIR = Path("data")
 LOGS_DIR = Path("logs/categories")
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
+# Consultas por request de embeddings / por producto de matrices en modo batch
+MATCH_BATCH_SIZE = int(os.getenv("MATCH_BATCH_SIZE", "256"))
 
-# Detecta automáticamente nombres de archivo
-EMB_PATH = None
-TXT_PATH = None
-for emb in ["data/cbt_embeddings.npy", "data/category_embeddings.npy"]:
-    if Path(emb).exists():
-        EMB_PATH = emb
-for meta in ["data/cbt_categories_meta.json", "data/category_texts.json"]:
-    if Path(meta).exists():
-        TXT_PATH = meta
+# Gate del LLM: si el top-1 por embeddings es claro, no se consulta a GPT
+REFINE_MIN_SCORE = float(os.getenv("REFINE_MIN_SCORE", "0.55"))     # similitud mínima del top-1
+REFINE_MIN_MARGIN = float(os.getenv("REFINE_MIN_MARGIN", "0.04"))   # top-1 − top-2
+REFINE_REQUIRE_LEAF = os.getenv("REFINE_REQUIRE_LEAF", "1") == "1"  # el top-1 tiene que ser hoja
+REFINE_BATCH_SIZE = int(os.getenv("REFINE_BATCH_SIZE", "8"))        # productos por llamada al LLM
+DECISIONS_LOG = LOGS_DIR / "decisions.jsonl"
 
-if EMB_PATH is None or TXT_PATH is None:
-    print("❌ No se encontraron embeddings o metadatos.")
-    sys.exit(1)
+# Recuperación híbrida: BM25 local (lexical_index.py) + embeddings, fusionados por RRF
+LEXICAL_ENABLED = os.getenv("CATEGORY_LEXICAL", "1") == "1"
+HYBRID_POOL = int(os.getenv("HYBRID_POOL", "20"))   # candidatos de cada lado que entran a la fusión
+RRF_K = 60
 
-client = OpenAI()
+# Los embeddings/metadatos (data/cbt_embeddings.npy + cbt_categories_meta.json,
+# o el par viejo category_embeddings.npy + category_texts.json) los resuelve
+# y carga una sola vez CategoryIndex (category_index.py).
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
 
 # ────────────────────────────────────────────────────────────────
 # FUNCIONES
 # ────────────────────────────────────────────────────────────────
 
-def load_embeddings():
-    print(f"📦 Cargando embeddings desde {EMB_PATH}")
-    X = np.load(EMB_PATH)
-    with open(TXT_PATH, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-    texts = [m.get("full_name", m.get("name", "")) for m in meta]
-    ids = [m.get("id") for m in meta]
-    return X, texts, ids
-
 
 def get_product_info(asin):
-    path = Path(f"outputs/json/{asin}.json")
-    if not path.exists():
-        print(f"❌ No existe el archivo {path}")
+    data = load_product(asin)
+    if data is None:
+        print(f"❌ No existe el producto {asin} (ni en el store ni en outputs/json)")
         sys.exit(1)
-    data = json.loads(path.read_text())
     title = data.get("attributes", {}).get("item_name", [{}])[0].get("value", "")
     bullets = [b.get("value") for b in data.get("attributes", {}).get("bullet_point", [])]
     desc = " ".join(bullets)
     return title, desc, data
 
 
-def find_top_k_categories(query, embeddings, texts, ids, k=5):
-    from openai import embeddings as emb_mod
-    emb = client.embeddings.create(model="text-embedding-3-small", input=query).data[0].embedding
-    sims = cosine_similarity([emb], embeddings)[0]
-    top_idx = np.argsort(sims)[::-1][:k]
-    return [(ids[i], texts[i], float(sims[i])) for i in top_idx]
+def find_top_k_categories(query, k=5):
+    return hybrid_top_k_many([query], k)[0][0]
 
 
-def refine_with_ai(title, desc, candidates):
-    prompt = f"""
-You are an expert in e-commerce category classification.
-A product with the following information must be matched to the most appropriate Mercado Libre Global Selling category.
+def hybrid_top_k_many(queries, k=5):
+    """
+    Por consulta: (candidatos, origen). Si el título nombra sin ambigüedad una
+    categoría hoja, los candidatos salen solo de BM25 (origen "lexical"). Si
+    no, se fusionan BM25 y embeddings con Reciprocal Rank Fusion (origen
+    "hybrid", o "vector" si no hay índice léxico).
+    Candidatos: [(category_id, name, similitud, score)] donde `similitud` es
+    el coseno contra la consulta (None en el camino léxico: no se embebe nada)
+    y `score` es el puntaje del ranking: BM25 normalizado al top-1, RRF o el
+    mismo coseno.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    lex = get_lexical_index() if LEXICAL_ENABLED else None
+    if lex is not None and not len(lex):
+        lex = None
+    ranked = [None] * len(queries)
+    sources = [None] * len(queries)
+    lexical = [[] for _ in queries]
+    pending = []
+    for i, q in enumerate(queries):
+        if lex is not None:
+            lexical[i] = lex.search(q, max(k, HYBRID_POOL))
+            hit = lex.confident_hit(q, lexical[i])
+            if hit:
+                top = lexical[i][0][2]
+                ranked[i] = [(c[0], c[1], None, round(c[2] / top, 4)) for c in lexical[i][:k]]
+                sources[i] = "lexical"
+                continue
+        pending.append(i)
+    if not pending:
+        return list(zip(ranked, sources))
+
+    index = get_category_index()
+    vector = index.top_k_many([queries[i] for i in pending], max(k, HYBRID_POOL) if lex else k)
+    if lex is None:
+        return [([(cid, name, sim, sim) for cid, name, sim in top[:k]], "vector") for top in vector]
+    fused_ids = []
+    for i, vec in zip(pending, vector):
+        fused, names = {}, {}
+        for hits in (vec, lexical[i]):
+            for rank, (cid, name, _) in enumerate(hits):
+                fused[cid] = fused.get(cid, 0.0) + 1.0 / (RRF_K + rank + 1)
+                names[cid] = name
+        ids = sorted(fused, key=fused.get, reverse=True)[:k]
+        fused_ids.append(ids)
+        ranked[i] = [(cid, names[cid], round(fused[cid], 6)) for cid in ids]
+
+    # Coseno solo de las consultas híbridas (ya embebidas por top_k_many: salen del cache)
+    sims = index.similarities([queries[i] for i in pending], fused_ids)
+    for i, s in zip(pending, sims):
+        ranked[i] = [(cid, name, sim if sim is not None else 0.0, score)
+                     for (cid, name, score), sim in zip(ranked[i], s)]
+        sources[i] = "hybrid"
+    return list(zip(ranked, sources))
+
+
+def _product_title(data: dict) -> str:
+    return (data.get("attributes", {}).get("item_name", [{}])[0].get("value")
+            or (data.get("summaries") or [{}])[0].get("itemName") or "")
 
-Product title:
-"{title}"
 
-Product description (summarized):
-"{desc[:600]}"
+# ────────────────────────────────────────────────────────────────
+# GATE + REFINAMIENTO POR LOTES
+# ────────────────────────────────────────────────────────────────
+def _is_leaf(category_id):
+    store = get_category_store()
+    if store is None:
+        return None   # sin store no sabemos: no bloquea el camino rápido
+    cat = store.get(category_id, with_attributes=False)
+    return cat["is_leaf"] if cat else None
+
+
+def gate_decision(candidates, source: str = "vector") -> dict:
+    """
+    ¿Alcanza con el top-1? Mira la similitud coseno del top-1, el margen
+    contra el top-2 y si el top-1 es una categoría hoja (publicable).
+    Un acierto léxico (source="lexical") no tiene coseno: confident_hit ya
+    exigió una sola categoría hoja nombrada y ventaja en BM25, así que se
+    acepta y se reporta su score BM25 normalizado.
+    """
+    if source == "lexical" and candidates:
+        top1 = candidates[0][3]
+        top2 = candidates[1][3] if len(candidates) > 1 else 0.0
+        return {"confident": True, "score": round(top1, 4), "margin": round(top1 - top2, 4),
+                "leaf": True, "reasons": []}
+    top1 = candidates[0][2] if candidates else 0.0
+    top2 = candidates[1][2] if len(candidates) > 1 else 0.0
+    leaf = _is_leaf(candidates[0][0]) if candidates else None
+    reasons = []
+    if top1 < REFINE_MIN_SCORE:
+        reasons.append("low_score")
+    if top1 - top2 < REFINE_MIN_MARGIN:
+        reasons.append("low_margin")
+    if REFINE_REQUIRE_LEAF and leaf is False:
+        reasons.append("not_leaf")
+    return {"confident": not reasons, "score": round(top1, 4), "margin": round(top1 - top2, 4),
+            "leaf": leaf, "reasons": reasons}
+
+
+def refine_many_with_ai(items):
+    """
+    Refinamiento por lotes: un solo prompt para varios productos.
+    items: [{"title", "desc", "candidates"}]. Devuelve un resultado por item
+    ({"final_category_id", "final_category_name", "reason"}); si el modelo
+    elige una categoría que no estaba entre los candidatos, ese item queda
+    con "error".
+    """
+    payload = [{
+        "key": i,
+        "title": it["title"],
+        "description": (it.get("desc") or "")[:400],
+        "candidates": [{"id": c[0], "name": c[1], "similarity": None if c[2] is None else round(c[2], 3)}
+                       for c in it["candidates"]],
+    } for i, it in enumerate(items)]
+    prompt = f"""
+You are an expert in e-commerce category classification.
+For EACH product below, choose the single best Mercado Libre Global Selling category
+among its own candidate categories.
 
-Candidate categories (with similarity scores):
-{json.dumps(candidates, indent=2)}
+Products:
+{json.dumps(payload, indent=2, ensure_ascii=False)}
 
-Choose the **single best category** that most precisely fits this product and explain your reasoning briefly.
-Return a JSON like:
-{{
-  "final_category_id": "...",
-  "final_category_name": "...",
-  "reason": "..."
-}}
+Return ONLY a JSON object like:
+{{"results": [{{"key": 0, "final_category_id": "...", "final_category_name": "...", "reason": "..."}}]}}
+with exactly one entry per product key.
 """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4o-mini",
         messages=[{"role": "system", "content": "You are a professional e-commerce taxonomy expert."},
                   {"role": "user", "content": prompt}],
+        response_format={"type": "json_object"},
         temperature=0
     )
+    content = response.choices[0].message.content
     try:
-        result = json.loads(response.choices[0].message.content)
-        return result
+        by_key = {r.get("key"): r for r in json.loads(content).get("results", []) if isinstance(r, dict)}
     except Exception:
-        return {"error": response.choices[0].message.content}
+        return [{"error": content} for _ in items]
+
+    out = []
+    for i, it in enumerate(items):
+        r = by_key.get(i) or {}
+        valid = {c[0] for c in it["candidates"]}
+        if r.get("final_category_id") in valid:
+            out.append({k: r.get(k) for k in ("final_category_id", "final_category_name", "reason")})
+        else:
+            out.append({"error": f"respuesta inválida para el producto {i}: {r or 'sin resultado'}"})
+    return out
+
+
+def _log_decision(record: dict):
+    record = dict(record, ts=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    with open(DECISIONS_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def resolve_categories(items, force_llm: bool = False):
+    """
+    items: [{"asin", "title", "desc", "candidates"}] (candidates = top-k por
+    embeddings). Los casos claros se resuelven con el top-1; los dudosos van
+    al LLM en lotes de REFINE_BATCH_SIZE. Cada decisión queda en
+    logs/categories/decisions.jsonl. Devuelve un `refined_result` por item.
+    """
+    results = [None] * len(items)
+    gates = [gate_decision(it["candidates"], it.get("source", "vector")) for it in items]
+    uncertain = []
+    for i, (it, gate) in enumerate(zip(items, gates)):
+        if gate["confident"] and not force_llm:
+            cid, cname = it["candidates"][0][:2]
+            results[i] = {"final_category_id": cid, "final_category_name": cname,
+                          "reason": f"embedding top-1 (score {gate['score']}, margen {gate['margin']})"}
+            gate["path"] = "lexical" if it.get("source") == "lexical" else "embedding"
+        else:
+            uncertain.append(i)
+
+    for start in range(0, len(uncertain), REFINE_BATCH_SIZE):
+        chunk = uncertain[start:start + REFINE_BATCH_SIZE]
+        try:
+            refined = refine_many_with_ai([items[i] for i in chunk])
+        except Exception as e:
+            refined = [{"error": str(e)} for _ in chunk]
+        for i, r in zip(chunk, refined):
+            if "error" in r and items[i]["candidates"]:
+                # El LLM falló: nos quedamos con el top-1 por embeddings
+                cid, cname = items[i]["candidates"][0][:2]
+                r = dict(r, final_category_id=cid, final_category_name=cname, reason="fallback embedding top-1")
+                gates[i]["path"] = "llm_error"
+            else:
+                gates[i]["path"] = "llm"
+            results[i] = r
+
+    for it, gate, res in zip(items, gates, results):
+        _log_decision({
+            "asin": it.get("asin"), "title": it["title"][:120],
+            "top1_id": it["candidates"][0][0] if it["candidates"] else None,
+            "final_id": res.get("final_category_id"),
+            "path": gate["path"], "source": it.get("source", "vector"),
+            "forced": force_llm and gate["confident"],
+            "score": gate["score"], "margin": gate["margin"], "leaf": gate["leaf"], "reasons": gate["reasons"],
+        })
+        res["decision"] = {k: gate[k] for k in ("path", "score", "margin", "leaf", "reasons")}
+    return results
+
+
+def _save_plus(asin, title, candidates, refined):
+    out_path = LOGS_DIR / f"{asin}_category_plus.json"
+    result = {
+        "asin": asin,
+        "title": title,
+        "candidates": [{"id": c[0], "name": c[1], "similarity": c[2], "score": c[3]} for c in candidates],
+        "refined_result": refined
+    }
+    out_path.write_text(json.dumps(result, indent=2))
+    return out_path
+
+
+def main_batch(asins, force_llm=False):
+    """
+    Recategoriza muchos ASINs: un request de embeddings y un matmul por bloque;
+    solo los casos dudosos pasan por el LLM, agrupados en lotes.
+    """
+    titles, descs, found = [], [], []
+    for asin in asins:
+        data = load_product(asin)
+        title = _product_title(data) if data else ""
+        if not title:
+            print(f"⚠️ {asin}: sin producto o sin título, se omite")
+            continue
+        bullets = [b.get("value") or "" for b in data.get("attributes", {}).get("bullet_point", [])]
+        titles.append(title)
+        descs.append(" ".join(bullets))
+        found.append(asin)
+
+    print(f"🧠 Clasificando {len(found)} productos en bloques de {MATCH_BATCH_SIZE}...")
+    matches = match_categories(titles, asins=found, k=5)
+    items = [{"asin": a, "title": t, "desc": d, "source": m["source"],
+              "candidates": [(c["id"], c["name"], c["similarity"], c["score"]) for c in m["candidates"]]}
+             for a, t, d, m in zip(found, titles, descs, matches)]
+    refined = resolve_categories(items, force_llm=force_llm)
+    paths = {"lexical": 0, "embedding": 0, "llm": 0, "llm_error": 0}
+    for it, res in zip(items, refined):
+        _save_plus(it["asin"], it["title"], it["candidates"], res)
+        paths[res["decision"]["path"]] += 1
+        print(f"   • {it['asin']} → {res.get('final_category_name')} ({res.get('final_category_id')}) "
+              f"[{res['decision']['path']}] | {it['title'][:60]}")
+    print(f"\n🚦 Decisiones: {paths['lexical']} por nombre exacto, {paths['embedding']} por embeddings, "
+          f"{paths['llm']} con LLM, "
+          f"{paths['llm_error']} LLM fallido (top-1)")
+    stats = get_category_index().cache_stats()
+    print(f"\n♻️ Cache de embeddings: {stats['memory_hits']} hits en memoria, {stats['disk_hits']} en disco, "
+          f"{stats['misses']} llamadas a la API ({stats['hit_rate']:.0%} hit rate)")
+    print(f"💾 Resultados en {LOGS_DIR}/<ASIN>_category.json y <ASIN>_category_plus.json | telemetría en {DECISIONS_LOG}")
 
 
 def main():
     if len(sys.argv) < 2:
         print("Uso: python3 category_matcher_plus.py <ASIN>")
+        print("     python3 category_matcher_plus.py --batch [ASIN ...]   # default: asins.txt")
+        print("     --refine: consultar al LLM aunque el top-1 por embeddings sea claro")
         sys.exit(1)
 
-    asin = sys.argv[1]
-    embeddings, texts, ids = load_embeddings()
+    force_llm = "--refine" in sys.argv
+    args = [a for a in sys.argv[1:] if a != "--refine"]
+    if args and args[0] == "--batch":
+        asins = args[1:]
+        if not asins:
+            with open("asins.txt", "r", encoding="utf-8") as f:
+                asins = [a.strip() for a in f if a.strip()]
+        try:
+            main_batch(list(dict.fromkeys(asins)), force_llm=force_llm)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        return
+
+    asin = args[0]
     title, desc, product_data = get_product_info(asin)
 
     print(f"\n🔍 Producto: {title}")
     print("🧠 Buscando categorías más cercanas por embeddings...")
 
-    top5 = find_top_k_categories(title, embeddings, texts, ids, k=5)
+    try:
+        top5, source = hybrid_top_k_many([title], k=5)[0]
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
     print("\n🏆 Top 5 coincidencias por similitud:")
-    for cid, cname, sim in top5:
-        print(f"   • {cname} ({cid}) → {sim:.3f}")
-
-    print("\n🤖 Refinando con IA...")
-    refined = refine_with_ai(title, desc, top5)
+    for cid, cname, sim, score in top5:
+        print(f"   • {cname} ({cid}) → " + (f"{sim:.3f}" if sim is not None else f"BM25 {score:.3f}"))
+
+    refined = resolve_categories([{"asin": asin, "title": title, "desc": desc, "candidates": top5,
+                                   "source": source}], force_llm=force_llm)[0]
+    decision = refined["decision"]
+    if decision["path"] == "lexical":
+        print("\n⚡ El título nombra una categoría hoja sin ambigüedad: sin embeddings ni LLM")
+    elif decision["path"] == "embedding":
+        print(f"\n⚡ Top-1 claro (score {decision['score']}, margen {decision['margin']}): sin LLM")
+    else:
+        print(f"\n🤖 Refinado con IA ({', '.join(decision['reasons']) or 'forzado'})")
 
-    out_path = LOGS_DIR / f"{asin}_category_plus.json"
-    result = {
-        "asin": asin,
-        "title": title,
-        "candidates": [{"id": c[0], "name": c[1], "similarity": c[2]} for c in top5],
-        "refined_result": refined
-    }
-    out_path.write_text(json.dumps(result, indent=2))
+    out_path = _save_plus(asin, title, top5, refined)
     print(f"\n💾 Guardado en {out_path}")
 
     if "final_category_name" in refined:
@@ -150,55 +391,52 @@ def match_category(ai_category: str, asin: str = None):
     Dada una categoría detectada por IA (por ejemplo "Water Filter" o "LEGO Set"),
     busca el embedding más similar en el árbol local de categorías CBT.
     Devuelve un diccionario con los datos de la categoría y similitud.
+    El índice se carga una sola vez por proceso (get_category_index); si el
+    texto nombra una categoría hoja sin ambigüedad, ni siquiera se embebe
+    ("similarity" queda en None y "score" lleva el BM25 normalizado).
     """
-    import numpy as np, os, json
-    from openai import OpenAI
-    from numpy.linalg import norm
-
-    EMB_PATH = "data/category_embeddings.npy"
-    META_PATH = "data/category_texts.json"
-
-    if not os.path.exists(EMB_PATH) or not os.path.exists(META_PATH):
-        print("❌ Faltan embeddings o metadatos. Ejecutá primero: category_embedder.py")
+    try:
+        return match_categories([ai_category], asins=[asin] if asin else None)[0]
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
         return None
 
-    embeddings = np.load(EMB_PATH)
-    meta = json.load(open(META_PATH, "r", encoding="utf-8"))
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
-
-    emb = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=ai_category
-    ).data[0].embedding
-
-    scores = np.dot(embeddings, emb) / (norm(embeddings, axis=1) * norm(emb))
-    idx = int(np.argmax(scores))
-    best = meta[idx]
-    best_score = float(scores[idx])
-
-    # ✅ mejora: soporta listas o dicts
-    if isinstance(best, dict):
-        cat_id = best.get("id") or best.get("category_id")
-        cat_name = best.get("name") or best.get("category_name")
-    elif isinstance(best, list) and len(best) >= 2:
-        cat_id, cat_name = best[0], best[1]
-    else:
-        cat_id, cat_name = str(best), str(best)
-
-    result = {
-        "matched_category_id": cat_id,
-        "matched_category_name": cat_name,
-        "similarity": best_score
-    }
-
-    if asin:
-        os.makedirs("logs/categories", exist_ok=True)
-        out_path = f"logs/categories/{asin}_category.json"
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-
-    return result
+def match_categories(queries, asins=None, k: int = 1):
+    """
+    Versión batch de match_category: embebe las consultas de a bloques de
+    MATCH_BATCH_SIZE (un request por bloque) y las puntúa con un solo
+    producto de matrices. Devuelve un resultado por consulta, en orden;
+    con k > 1 agrega "candidates" con el top-k. "source" indica si salió
+    del camino léxico, de la fusión híbrida o solo de embeddings.
+    """
+    queries = list(queries)
+    results = []
+    for start in range(0, len(queries), MATCH_BATCH_SIZE):
+        for top, source in hybrid_top_k_many(queries[start:start + MATCH_BATCH_SIZE], k):
+            cat_id, cat_name, sim, score = top[0]
+            res = {
+                "matched_category_id": cat_id,
+                "matched_category_name": cat_name,
+                "similarity": sim,
+                "score": score,
+                "source": source
+            }
+            if k > 1:
+                res["candidates"] = [{"id": c[0], "name": c[1], "similarity": c[2], "score": c[3]} for c in top]
+            results.append(res)
+    if asins:
+        for asin, res in zip(asins, results):
+            if asin:
+                _save_match(asin, res)
+    return results
+
+
+def _save_match(asin: str, result: dict):
+    os.makedirs("logs/categories", exist_ok=True)
+    out_path = f"logs/categories/{asin}_category.json"
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
 
 # ────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
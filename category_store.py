@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+category_store.py
+Store local indexado (SQLite) del árbol de categorías CBT.
+
+Se llena en streaming desde category_downloader.py (categoría por
+categoría, sin cargar el árbol entero en memoria) y se abre en
+milisegundos desde cualquier proceso. Da acceso O(1) por id a nombre,
+ruta, si es hoja y atributos (con valores y unidades permitidas),
+navegación padre/hijos y un iterador rápido de hojas.
+
+Uso:
+  python3 category_store.py build [data/cbt_categories.json]   # desde un JSON ya descargado
+  python3 category_store.py get CBT1157
+  python3 category_store.py stats
+"""
+
+import os, sys, json, zlib, codecs, sqlite3, threading
+
+STORE_PATH = os.getenv("CATEGORY_STORE_PATH", os.path.join("data", "cbt_categories.sqlite"))
+JSON_PATH = os.path.join("data", "cbt_categories.json")
+PATH_SEP = " > "
+
+SCHEMA = """
+CREATE TABLE categories (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    parent_id TEXT,
+    path TEXT NOT NULL,
+    path_ids TEXT NOT NULL,
+    is_leaf INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE attributes (
+    category_id TEXT NOT NULL,
+    attr_id TEXT NOT NULL,
+    name TEXT,
+    value_type TEXT,
+    required INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (category_id, attr_id)
+);
+"""
+INDEXES = """
+CREATE INDEX idx_categories_parent ON categories (parent_id);
+CREATE INDEX idx_categories_leaf ON categories (is_leaf);
+"""
+
+
+# ============================================================
+# 🗜️ Lectura incremental del árbol (gzip / JSON)
+# ============================================================
+def iter_text(byte_chunks):
+    """Descomprime gzip al vuelo (si viene comprimido) y decodifica UTF-8 por partes."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    inflater = None
+    head = b""
+    for chunk in byte_chunks:
+        if not chunk:
+            continue
+        if inflater is None:
+            head += chunk
+            if len(head) < 2:
+                continue
+            # 1f 8b = gzip. Si requests ya lo descomprimió (Content-Encoding), viene plano.
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if head[:2] == b"\x1f\x8b" else False
+            chunk = head
+        data = inflater.decompress(chunk) if inflater else chunk
+        if data:
+            yield decoder.decode(data)
+    if inflater is None and head:
+        yield decoder.decode(head)
+    if inflater:
+        tail = inflater.flush()
+        if tail:
+            yield decoder.decode(tail)
+    rest = decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+def iter_object_items(text_chunks):
+    """
+    Recorre un objeto JSON de primer nivel ({"id": {...}, ...}) devolviendo
+    (clave, valor) a medida que cada valor está completo. En memoria queda
+    solo la categoría en curso, no el árbol entero.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(text_chunks)
+    buf, pos, eof = "", 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        try:
+            buf = buf[pos:] + next(chunks)
+            pos = 0
+        except StopIteration:
+            eof = True
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            more()
+
+    def expect(ch):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != ch:
+            raise ValueError(f"JSON inválido: se esperaba '{ch}' en {buf[pos:pos + 40]!r}")
+        pos += 1
+
+    def decode_value():
+        nonlocal pos
+        while True:
+            skip_ws()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # Un número al final del buffer podría seguir en el próximo chunk
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more()
+
+    expect("{")
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "}":
+        return
+    while True:
+        key = decode_value()
+        expect(":")
+        value = decode_value()
+        yield key, value
+        skip_ws()
+        if pos < len(buf) and buf[pos] == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+
+def iter_file_categories(path: str = JSON_PATH, chunk_size: int = 1024 * 1024):
+    """(id, data) de un cbt_categories.json (o .gz) sin cargarlo entero."""
+    def chunks():
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    return
+                yield block
+    return iter_object_items(iter_text(chunks()))
+
+
+# ============================================================
+# 🔍 Lectura
+# ============================================================
+class CategoryStore:
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _one(self, sql, args=()):
+        with self._lock:
+            return self.conn.execute(sql, args).fetchone()
+
+    def _all(self, sql, args=()):
+        with self._lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _row(row):
+        cid, name, parent_id, path, path_ids, is_leaf = row
+        return {"id": cid, "name": name, "parent_id": parent_id, "path": path,
+                "path_ids": json.loads(path_ids), "is_leaf": bool(is_leaf)}
+
+    def get(self, category_id: str, with_attributes: bool = True):
+        """{id, name, parent_id, path, path_ids, is_leaf, attributes} o None."""
+        row = self._one("SELECT id, name, parent_id, path, path_ids, is_leaf FROM categories WHERE id = ?",
+                        (category_id,))
+        if not row:
+            return None
+        out = self._row(row)
+        if with_attributes:
+            out["attributes"] = self.attributes(category_id)
+        return out
+
+    def get_raw(self, category_id: str):
+        row = self._one("SELECT data FROM categories WHERE id = ?", (category_id,))
+        return json.loads(row[0]) if row else None
+
+    def attributes(self, category_id: str):
+        """Atributos tal como los devuelve ML (incluye `values` y `allowed_units`)."""
+        return [json.loads(r[0]) for r in
+                self._all("SELECT data FROM attributes WHERE category_id = ? ORDER BY rowid", (category_id,))]
+
+    def allowed_values(self, category_id: str, attr_id: str) -> dict:
+        """{nombre en minúsculas: value_id} de un atributo tipo lista."""
+        row = self._one("SELECT data FROM attributes WHERE category_id = ? AND attr_id = ?", (category_id, attr_id))
+        if not row:
+            return {}
+        return {v["name"].lower(): v["id"] for v in json.loads(row[0]).get("values", []) if v.get("id")}
+
+    def parent(self, category_id: str):
+        row = self._one("SELECT parent_id FROM categories WHERE id = ?", (category_id,))
+        return self.get(row[0], with_attributes=False) if row and row[0] else None
+
+    def children(self, category_id: str):
+        return [self._row(r) for r in self._all(
+            "SELECT id, name, parent_id, path, path_ids, is_leaf FROM categories WHERE parent_id = ? ORDER BY name",
+            (category_id,))]
+
+    def roots(self):
+        return [self._row(r) for r in self._all(
+            "SELECT id, name, parent_id, path, path_ids, is_leaf FROM categories WHERE parent_id IS NULL ORDER BY name")]
+
+    def iter_categories(self, leaves_only: bool = False):
+        """(id, name, path) de todas las categorías (o solo hojas), en orden de id."""
+        sql = "SELECT id, name, path FROM categories"
+        if leaves_only:
+            sql += " WHERE is_leaf = 1"
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            yield from conn.execute(sql + " ORDER BY id")
+        finally:
+            conn.close()
+
+    def iter_leaves(self):
+        return self.iter_categories(leaves_only=True)
+
+    def count(self, leaves_only: bool = False) -> int:
+        sql = "SELECT COUNT(*) FROM categories" + (" WHERE is_leaf = 1" if leaves_only else "")
+        return self._one(sql)[0]
+
+    def close(self):
+        self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_category_store():
+    """Store compartido del proceso, o None si todavía no se descargó el árbol."""
+    global _store
+    if _store is None and os.path.exists(STORE_PATH):
+        with _store_lock:
+            if _store is None:
+                _store = CategoryStore()
+    return _store
+
+
+# ============================================================
+# ✍️ Construcción
+# ============================================================
+class CategoryStoreBuilder:
+    """
+    Construye el store en un archivo temporal y lo reemplaza de forma atómica
+    al terminar: los lectores nunca ven un árbol a medio escribir.
+    """
+
+    def __init__(self, path: str = STORE_PATH, batch_size: int = 500):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.batch_size = batch_size
+        self.count = 0
+        self._cats, self._attrs = [], []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, category_id: str, data: dict):
+        path_nodes = data.get("path_from_root") or [{"id": category_id, "name": data.get("name", "")}]
+        parent_id = path_nodes[-2]["id"] if len(path_nodes) > 1 else None
+        path = PATH_SEP.join(n.get("name", "") for n in path_nodes)
+        is_leaf = 0 if data.get("children_categories") else 1
+        attributes = data.get("attributes") or []
+        slim = {k: v for k, v in data.items() if k != "attributes"}
+        self._cats.append((category_id, data.get("name", ""), parent_id, path,
+                           json.dumps([n.get("id") for n in path_nodes]), is_leaf,
+                           json.dumps(slim, ensure_ascii=False, separators=(",", ":"))))
+        for a in attributes:
+            if not a.get("id"):
+                continue
+            tags = a.get("tags") or {}
+            required = 1 if (isinstance(tags, dict) and (tags.get("required") or tags.get("catalog_required"))) \
+                or (isinstance(tags, list) and "required" in tags) else 0
+            self._attrs.append((category_id, a["id"], a.get("name"), a.get("value_type"), required,
+                                json.dumps(a, ensure_ascii=False, separators=(",", ":"))))
+        self.count += 1
+        if len(self._cats) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._cats:
+            self.conn.executemany("INSERT OR REPLACE INTO categories VALUES (?, ?, ?, ?, ?, ?, ?)", self._cats)
+            self._cats = []
+        if self._attrs:
+            self.conn.executemany("INSERT OR REPLACE INTO attributes VALUES (?, ?, ?, ?, ?, ?)", self._attrs)
+            self._attrs = []
+
+    def commit(self):
+        self._flush()
+        self.conn.executescript(INDEXES)
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.conn.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def build_from_json(json_path: str = JSON_PATH, path: str = STORE_PATH) -> int:
+    builder = CategoryStoreBuilder(path)
+    try:
+        for cid, cdata in iter_file_categories(json_path):
+            builder.add(cid, cdata)
+        builder.commit()
+    except Exception:
+        builder.abort()
+        raise
+    return builder.count
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "build":
+        src = sys.argv[2] if len(sys.argv) > 2 else JSON_PATH
+        n = build_from_json(src)
+        print(f"✅ {n} categorías → {STORE_PATH}")
+    elif cmd == "get" and len(sys.argv) > 2:
+        cat = CategoryStore().get(sys.argv[2])
+        if not cat:
+            print(f"❌ {sys.argv[2]} no existe en {STORE_PATH}")
+            sys.exit(1)
+        print(json.dumps(cat, indent=2, ensure_ascii=False))
+    elif cmd == "stats":
+        store = CategoryStore()
+        print(f"📦 {store.count()} categorías | 🍃 {store.count(leaves_only=True)} hojas | {STORE_PATH}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
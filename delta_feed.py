@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+delta_feed.py
+Detección de cambios por hash de contenido + feed de deltas.
+
+Cada payload de SP-API se normaliza (se descartan campos volátiles como
+rankings de venta) y se hashea. El fetch escribe un feed JSONL con los
+ASINs nuevos / cambiados / eliminados y qué campos cambiaron, y las etapas
+siguientes (categorize, transform, publisher) pueden procesar solo eso:
+
+  python3 categorize.py --delta [outputs/delta/delta_XXXX.jsonl]
+  python3 transform_mapper_new2.py --delta
+  python3 publisher_from_transform.py --delta
+"""
+
+import os, json, time, glob, hashlib, threading
+
+DELTA_DIR = os.getenv("DELTA_DIR", "outputs/delta")
+
+CHANGE_NEW = "new"
+CHANGE_CHANGED = "changed"
+CHANGE_REMOVED = "removed"
+
+# Campos que cambian solos entre descargas y no afectan la publicación
+VOLATILE_KEYS = {
+    "salesRanks", "sales_ranks", "salesRank",
+    "offers", "lastUpdated", "last_updated", "lastUpdatedDate",
+    "requestId", "request_id", "fetched_at",
+}
+
+
+def normalize_payload(data):
+    """Copia del payload sin campos volátiles (recursivo)."""
+    if isinstance(data, dict):
+        return {k: normalize_payload(v) for k, v in data.items() if k not in VOLATILE_KEYS}
+    if isinstance(data, list):
+        return [normalize_payload(v) for v in data]
+    return data
+
+
+def content_hash(data) -> str:
+    raw = json.dumps(normalize_payload(data), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def changed_fields(old: dict, new: dict):
+    """
+    Lista de campos que cambiaron. Baja un nivel en los bloques grandes
+    (`attributes`, `summaries`…) para devolver p.ej. "attributes.list_price".
+    """
+    old = normalize_payload(old or {})
+    new = normalize_payload(new or {})
+    fields = []
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key), new.get(key)
+        if a == b:
+            continue
+        if isinstance(a, dict) and isinstance(b, dict):
+            fields.extend(f"{key}.{sub}" for sub in sorted(set(a) | set(b)) if a.get(sub) != b.get(sub))
+        else:
+            fields.append(key)
+    return fields
+
+
+# ============================================================
+# ✍️ Escritura del feed
+# ============================================================
+class DeltaWriter:
+    """
+    Un archivo por corrida: outputs/delta/delta_YYYYmmdd_HHMMSS.jsonl.
+    Se crea al arrancar aunque la corrida no encuentre cambios: así
+    latest_delta_path() apunta a esta corrida (vacía) y `--delta` no vuelve
+    a procesar los cambios de la anterior.
+    """
+
+    def __init__(self, folder: str = DELTA_DIR):
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, time.strftime("delta_%Y%m%d_%H%M%S.jsonl"))
+        open(self.path, "w", encoding="utf-8").close()
+        self.counts = {CHANGE_NEW: 0, CHANGE_CHANGED: 0, CHANGE_REMOVED: 0}
+        self._lock = threading.Lock()
+
+    def add(self, asin: str, change: str, fields=None, data_hash: str = None):
+        entry = {"asin": asin, "change": change, "fields": fields or [], "hash": data_hash, "at": time.time()}
+        with self._lock:
+            self.counts[change] = self.counts.get(change, 0) + 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+# ============================================================
+# 📖 Lectura del feed
+# ============================================================
+def latest_delta_path(folder: str = DELTA_DIR):
+    files = sorted(glob.glob(os.path.join(folder, "delta_*.jsonl")))
+    return files[-1] if files else None
+
+
+def read_delta(path: str = None, changes=(CHANGE_NEW, CHANGE_CHANGED)):
+    """Devuelve las entradas del feed (la última por ASIN) filtradas por tipo de cambio."""
+    path = path or latest_delta_path()
+    if not path or not os.path.exists(path):
+        return []
+    entries = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                entries[entry["asin"]] = entry
+    return [e for e in entries.values() if e["change"] in changes]
+
+
+def delta_arg(argv):
+    """
+    Soporte común de `--delta [ruta]` para los CLIs.
+    Devuelve None si no se pidió modo delta, o la ruta del feed a usar.
+    """
+    if "--delta" not in argv:
+        return None
+    i = argv.index("--delta")
+    if i + 1 < len(argv) and not argv[i + 1].startswith("--"):
+        return argv[i + 1]
+    return latest_delta_path() or ""
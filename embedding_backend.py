@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embedding_backend.py
+Backends de embeddings intercambiables para categorías y consultas.
+
+- openai (default): API de embeddings de OpenAI (OPENAI_EMBEDDING_MODEL)
+- onnx: modelo sentence-embedding local en CPU con onnxruntime, sin red.
+  Espera en ONNX_MODEL_DIR un `model.onnx` exportado y su `tokenizer.json`
+  (formato HuggingFace, se lee con la librería `tokenizers`).
+
+Se elige con EMBEDDING_BACKEND=openai|onnx. Cada backend expone `model_id`,
+que forma parte de la clave del cache de embeddings y queda anotado en
+data/cbt_embeddings_info.json: un índice armado con un backend no se puede
+consultar con otro (los vectores no son comparables).
+"""
+
+import os, json, threading, time
+import numpy as np
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").strip().lower()
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("models", "all-MiniLM-L6-v2"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", str(os.cpu_count() or 4)))
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", "64"))
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", "128"))
+
+INFO_PATH = os.path.join("data", "cbt_embeddings_info.json")
+
+
+# ============================================================
+# ☁️ OpenAI
+# ============================================================
+class OpenAIBackend:
+    name = "openai"
+    remote = True   # pasa por la red: el embedder aplica RPM/TPM y reintentos
+
+    def __init__(self, model: str = OPENAI_EMBEDDING_MODEL):
+        from openai import OpenAI
+        api_key = os.getenv("OPENAI_API_KEY", "")
+        if not api_key:
+            raise RuntimeError("Falta la variable OPENAI_API_KEY en .env")
+        self.model = model
+        self.model_id = model   # sin prefijo: mantiene válidas las claves ya cacheadas
+        self.client = OpenAI(api_key=api_key)
+
+    def embed(self, texts) -> np.ndarray:
+        res = self.client.embeddings.create(model=self.model, input=list(texts))
+        return np.asarray([d.embedding for d in res.data], dtype=np.float32)
+
+
+# ============================================================
+# 🖥️ ONNX local
+# ============================================================
+class OnnxBackend:
+    name = "onnx"
+    remote = False
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, threads: int = ONNX_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx requiere onnxruntime (pip install onnxruntime)")
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx requiere tokenizers (pip install tokenizers)")
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        tok_path = os.path.join(model_dir, "tokenizer.json")
+        for p in (model_path, tok_path):
+            if not os.path.exists(p):
+                raise RuntimeError(f"No existe {p} (ONNX_MODEL_DIR={model_dir})")
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = max(1, threads)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tok_path)
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        self.model_id = f"onnx:{os.path.basename(os.path.normpath(model_dir))}"
+        # Una InferenceSession admite run() concurrente, pero ya usa todos los
+        # hilos de intra_op: serializamos para no sobresuscribir la CPU
+        self._lock = threading.Lock()
+
+    def _run(self, texts) -> np.ndarray:
+        encs = self.tokenizer.encode_batch(texts)
+        ids = np.asarray([e.ids for e in encs], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in encs], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.asarray([e.type_ids for e in encs], dtype=np.int64)
+        with self._lock:
+            hidden = self.session.run(None, feeds)[0]
+        if hidden.ndim == 2:   # el modelo ya devuelve el vector por oración
+            pooled = hidden
+        else:                  # mean pooling sobre los tokens reales
+            m = mask[..., None].astype(np.float32)
+            pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def embed(self, texts) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Ordenar por largo reduce el padding dentro de cada lote
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = [None] * len(texts)
+        for start in range(0, len(order), ONNX_BATCH_SIZE):
+            idx = order[start:start + ONNX_BATCH_SIZE]
+            vecs = self._run([texts[i] for i in idx])
+            for i, v in zip(idx, vecs):
+                out[i] = v
+        return np.stack(out)
+
+
+# ============================================================
+# 🏭 Selección del backend (uno por proceso)
+# ============================================================
+BACKENDS = {"openai": OpenAIBackend, "onnx": OnnxBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name: str = None):
+    name = (name or EMBEDDING_BACKEND).lower()
+    if name not in BACKENDS:
+        raise RuntimeError(f"EMBEDDING_BACKEND desconocido: {name} (opciones: {', '.join(BACKENDS)})")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+# ============================================================
+# 📝 Info del índice
+# ============================================================
+def write_index_info(backend, count: int, dim: int, path: str = INFO_PATH):
+    info = {
+        "backend": backend.name,
+        "model_id": backend.model_id,
+        "count": int(count),
+        "dim": int(dim),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def read_index_info(path: str = INFO_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def backend_for_index(path: str = INFO_PATH):
+    """
+    Backend con el que hay que embeber las consultas contra el índice de
+    `path`. Si el índice se armó con otro backend/modelo que el configurado,
+    se usa el del índice (si no, las similitudes no tendrían sentido).
+    """
+    info = read_index_info(path)
+    backend = get_backend(info.get("backend"))
+    if info.get("model_id") and info["model_id"] != backend.model_id:
+        raise RuntimeError(
+            f"El índice de categorías se generó con {info['model_id']} pero el backend "
+            f"configurado usa {backend.model_id}. Regenerá con category_embedder.py"
+        )
+    return backend
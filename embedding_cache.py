@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embedding_cache.py
+Store persistente de embeddings direccionado por contenido:
+clave = sha256(modelo + texto embebido). Si un texto ya se embebió con el
+mismo modelo, se reutiliza; solo se paga la API por textos nuevos o
+modificados. Vive en data/embeddings_store.sqlite (WAL, seguro entre procesos).
+
+QueryEmbeddingCache agrega adelante un LRU en memoria para las consultas
+(títulos, categorías adivinadas por IA): miles de productos repiten los
+mismos textos y así casi nunca llegan a la API de embeddings.
+"""
+
+import os, re, hashlib, sqlite3, threading, unicodedata
+from collections import OrderedDict
+import numpy as np
+
+EMBED_STORE_PATH = os.getenv("EMBED_STORE_PATH", os.path.join("data", "embeddings_store.sqlite"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_DISK = os.getenv("QUERY_CACHE_DISK", "1") == "1"
+
+
+def embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, path: str = EMBED_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys) -> dict:
+        """{key: vector float32} para las claves que ya existen."""
+        keys = list(dict.fromkeys(keys))
+        out = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, vec in self.conn.execute(
+                        f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", chunk):
+                    out[key] = np.frombuffer(vec, dtype=np.float32)
+        return out
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, model: str, items):
+        """items: [(key, vector)]. Se escribe en una sola transacción (checkpoint)."""
+        rows = []
+        for key, vec in items:
+            arr = np.asarray(vec, dtype=np.float32)
+            rows.append((key, model, int(arr.shape[0]), arr.tobytes()))
+        if not rows:
+            return
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def count(self, model: str = None) -> int:
+        with self._lock:
+            if model:
+                return self.conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+# ============================================================
+# 🔁 Cache de embeddings de consultas
+# ============================================================
+def normalize_query(text: str) -> str:
+    """Forma canónica de una consulta: NFKC, minúsculas y espacios colapsados."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip().casefold()
+
+
+def query_key(model: str, text: str) -> str:
+    """
+    Clave de cache de una consulta: texto normalizado, en un espacio aparte
+    de las claves por contenido (el vector guardado no es el del texto normalizado).
+    """
+    return embedding_key(f"{model}\x00query", normalize_query(text))
+
+
+class QueryEmbeddingCache:
+    """
+    LRU en memoria → store en disco → backend. La clave es
+    (model_id del backend, texto normalizado), así "LEGO Set" y " lego  set"
+    comparten entrada; lo que se embebe es el texto original (la primera
+    variante vista), igual que los nombres de categoría del índice.
+    """
+
+    def __init__(self, backend, size: int = QUERY_CACHE_SIZE, disk: bool = QUERY_CACHE_DISK):
+        self.backend = backend
+        self.size = size
+        self.disk = disk
+        self._lru = OrderedDict()
+        self._store = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _get_store(self):
+        if self._store is None:
+            self._store = EmbeddingStore()
+        return self._store
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def embed(self, texts) -> np.ndarray:
+        """(len(texts), d) float32, en el mismo orden que `texts`."""
+        texts = list(texts)
+        keys = [query_key(self.backend.model_id, t) for t in texts]
+        found = {}
+        with self._lock:
+            for k in keys:
+                if k in self._lru:
+                    found[k] = self._lru[k]
+                    self._lru.move_to_end(k)
+        pending = [k for k in dict.fromkeys(keys) if k not in found]
+
+        from_disk = self._get_store().get_many(pending) if pending and self.disk else {}
+        text_by_key = {}
+        for k, t in zip(keys, texts):
+            text_by_key.setdefault(k, (t or "").strip())
+        to_embed = [k for k in pending if k not in from_disk]
+        fresh = {}
+        if to_embed:
+            vecs = self.backend.embed([text_by_key[k] for k in to_embed])
+            fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(to_embed, vecs)}
+            if self.disk:
+                self._get_store().put_many(self.backend.model_id, fresh.items())
+
+        with self._lock:
+            for k, v in list(from_disk.items()) + list(fresh.items()):
+                self._remember(k, v)
+            # Contadores por consulta (no por texto único)
+            for k in keys:
+                if k in found:
+                    self.memory_hits += 1
+                elif k in from_disk:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+        found.update(from_disk)
+        found.update(fresh)
+        return np.stack([found[k] for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+                "size": len(self._lru),
+            }
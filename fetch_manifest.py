@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fetch_manifest.py
+Manifiesto de descargas de SP-API: por cada ASIN guarda la última fecha
+de descarga, el hash del payload y el estado (ok / error / not_found).
+
+Se persiste como JSONL append-only (una línea por resultado), así cada
+descarga queda registrada al instante y un crash no pierde progreso:
+al relanzar, los ASINs ya descargados y frescos se saltean solos.
+"""
+
+import os, json, time, threading
+
+from delta_feed import content_hash
+
+MANIFEST_PATH = os.getenv("FETCH_MANIFEST_PATH", "outputs/fetch_manifest.jsonl")
+FETCH_TTL_HOURS = float(os.getenv("FETCH_TTL_HOURS", "24"))
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_NOT_FOUND = "not_found"
+STATUS_REMOVED = "removed"
+
+
+def payload_hash(data) -> str:
+    """Hash de contenido del payload, ignorando campos volátiles (ver delta_feed)."""
+    return content_hash(data)
+
+
+class FetchManifest:
+    def __init__(self, path: str = MANIFEST_PATH, ttl_hours: float = FETCH_TTL_HOURS):
+        self.path = path
+        self.ttl_seconds = float(ttl_hours) * 3600.0
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    # ============================================================
+    # 📖 Lectura / escritura
+    # ============================================================
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última línea cortada por un crash: se ignora
+                    continue
+                if entry.get("asin"):
+                    self.entries[entry["asin"]] = entry
+        # Si el crash dejó la última línea sin "\n", la cerramos para no pegarle la siguiente
+        with open(self.path, "rb+") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def record(self, asin: str, status: str, data_hash: str = None, error: str = None) -> dict:
+        """Registra un resultado y lo agrega al archivo de inmediato (checkpoint)."""
+        entry = {"asin": asin, "status": status, "fetched_at": time.time()}
+        prev = self.entries.get(asin, {})
+        entry["hash"] = data_hash or prev.get("hash")
+        if error:
+            entry["error"] = str(error)[:500]
+        with self._lock:
+            self.entries[asin] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+        return entry
+
+    def compact(self):
+        """Reescribe el archivo con una sola línea por ASIN (escritura atómica)."""
+        with self._lock:
+            tmp = self.path + ".tmp"
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    # ============================================================
+    # 🧮 Planificación
+    # ============================================================
+    def is_fresh(self, asin: str, now: float = None) -> bool:
+        entry = self.entries.get(asin)
+        if not entry or entry.get("status") != STATUS_OK:
+            return False
+        now = now or time.time()
+        return (now - entry.get("fetched_at", 0)) < self.ttl_seconds
+
+    def plan(self, asins, force: bool = False, only_failed: bool = False):
+        """
+        Devuelve los ASINs a descargar, en el orden original:
+        - force: todos
+        - only_failed: solo los que fallaron en la última corrida
+        - por defecto: nuevos, fallidos y vencidos (TTL)
+        """
+        now = time.time()
+        todo = []
+        for asin in dict.fromkeys(asins):
+            entry = self.entries.get(asin)
+            if force:
+                todo.append(asin)
+            elif only_failed:
+                if entry and entry.get("status") != STATUS_OK:
+                    todo.append(asin)
+            elif not self.is_fresh(asin, now):
+                todo.append(asin)
+        return todo
+
+    def summary(self) -> dict:
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry.get("status")] = counts.get(entry.get("status"), 0) + 1
+        return counts
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+kv_store.py
+Store clave-valor embebido (SQLite WAL) para los caches de IA del mapper:
+títulos, descripciones y equivalencias de atributos. Reemplaza a los JSON
+logs/ai_title_cache.json, logs/ai_desc_cache.json y
+logs/ai_equivalences_cache.json, que se reescribían enteros en cada producto
+y se corrompían con varios workers.
+
+- Lecturas y escrituras puntuales por (namespace, clave); valores en JSON
+- put_many escribe un lote en una sola transacción
+- Seguro entre hilos (un lock por conexión) y entre procesos (WAL + timeout)
+- La primera vez que se abre importa los JSON viejos (una sola vez: queda
+  registrado en la tabla `migrations`; los archivos no se tocan)
+
+Uso:
+  python3 kv_store.py stats
+  python3 kv_store.py get ai_title B0XXXXXXX
+  python3 kv_store.py export ai_equivalences [salida.json]
+"""
+
+import os, sys, json, time, sqlite3, threading
+
+KV_STORE_PATH = os.getenv("KV_STORE_PATH", os.path.join("data", "kv_store.sqlite"))
+
+# namespace → JSON del cache anterior (se migra una vez)
+LEGACY_CACHES = {
+    "ai_equivalences": os.path.join("logs", "ai_equivalences_cache.json"),
+    "ai_title": os.path.join("logs", "ai_title_cache.json"),
+    "ai_desc": os.path.join("logs", "ai_desc_cache.json"),
+}
+
+
+class KVStore:
+    def __init__(self, path: str = KV_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS migrations ("
+            " source TEXT PRIMARY KEY, ns TEXT NOT NULL, count INTEGER NOT NULL, migrated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    # ============================================================
+    # 🔍 Lectura
+    # ============================================================
+    def get(self, ns: str, key: str, default=None):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_many(self, ns: str, keys) -> dict:
+        """{clave: valor} para las claves que existen."""
+        keys = list(dict.fromkeys(keys))
+        out = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, value in self.conn.execute(
+                        f"SELECT key, value FROM kv WHERE ns = ? AND key IN ({marks})", [ns] + chunk):
+                    out[key] = json.loads(value)
+        return out
+
+    def items(self, ns: str) -> dict:
+        with self._lock:
+            rows = self.conn.execute("SELECT key, value FROM kv WHERE ns = ? ORDER BY key", (ns,)).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def count(self, ns: str = None) -> int:
+        with self._lock:
+            if ns:
+                return self.conn.execute("SELECT COUNT(*) FROM kv WHERE ns = ?", (ns,)).fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    # ============================================================
+    # ✍️ Escritura
+    # ============================================================
+    def put(self, ns: str, key: str, value):
+        self.put_many(ns, [(key, value)])
+
+    def put_many(self, ns: str, items, overwrite: bool = True):
+        """items: [(clave, valor)] o dict. Una sola transacción para todo el lote."""
+        if isinstance(items, dict):
+            items = items.items()
+        now = time.time()
+        rows = [(ns, str(k), json.dumps(v, ensure_ascii=False), now) for k, v in items]
+        if not rows:
+            return
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(f"{verb} INTO kv VALUES (?, ?, ?, ?)", rows)
+
+    def delete(self, ns: str, key: str):
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    # ============================================================
+    # 📦 Migración desde los JSON
+    # ============================================================
+    def migrate_json(self, ns: str, path: str) -> int:
+        """
+        Importa un cache JSON {clave: valor} al namespace, una sola vez por
+        archivo. No pisa claves que ya existan en el store. Devuelve cuántas importó.
+        """
+        source = os.path.abspath(path)
+        with self._lock:
+            done = self.conn.execute("SELECT 1 FROM migrations WHERE source = ?", (source,)).fetchone()
+        if done or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ No se pudo migrar {path}: {e}")
+            return 0
+        if not isinstance(data, dict):
+            data = {}
+        now = time.time()
+        rows = [(ns, str(k), json.dumps(v, ensure_ascii=False), now) for k, v in data.items()]
+        with self._lock:
+            with self.conn:   # datos + registro de la migración en la misma transacción
+                self.conn.executemany("INSERT OR IGNORE INTO kv VALUES (?, ?, ?, ?)", rows)
+                self.conn.execute("INSERT OR IGNORE INTO migrations VALUES (?, ?, ?, ?)",
+                                  (source, ns, len(rows), now))
+        print(f"📦 Migradas {len(rows)} entradas de {path} → {self.path} [{ns}]")
+        return len(rows)
+
+    def migrate_legacy(self):
+        for ns, path in LEGACY_CACHES.items():
+            self.migrate_json(ns, path)
+
+    def close(self):
+        self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_kv_store() -> KVStore:
+    """KVStore del proceso; la primera vez importa los caches JSON viejos."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = KVStore()
+                store.migrate_legacy()
+                _store = store
+    return _store
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    store = get_kv_store()
+    if cmd == "stats":
+        print(f"🗄️ {store.path}")
+        for ns in LEGACY_CACHES:
+            print(f"   • {ns:<16} {store.count(ns)} claves")
+    elif cmd == "get" and len(sys.argv) > 3:
+        value = store.get(sys.argv[2], sys.argv[3])
+        if value is None:
+            print(f"❌ {sys.argv[3]} no está en [{sys.argv[2]}]")
+            sys.exit(1)
+        print(json.dumps(value, indent=2, ensure_ascii=False))
+    elif cmd == "export" and len(sys.argv) > 2:
+        data = json.dumps(store.items(sys.argv[2]), indent=2, ensure_ascii=False)
+        if len(sys.argv) > 3:
+            with open(sys.argv[3], "w", encoding="utf-8") as f:
+                f.write(data)
+        else:
+            print(data)
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+lexical_index.py
+Índice invertido BM25 local sobre nombres y rutas de las categorías hoja
+(desde el store data/cbt_categories.sqlite, o cbt_categories.json si no hay).
+
+- `search(query, k)`: top-k por BM25, sin red
+- `confident_hit(query)`: si el título contiene literalmente el nombre de
+  una sola categoría hoja (p. ej. "Drill", "Printer") y esa categoría además
+  es el top-1 por BM25 con ventaja clara, se puede responder sin embeddings
+
+El nombre de la categoría pesa doble respecto de la ruta. Los tokens se
+normalizan (minúsculas, sin acentos, singular simple).
+
+Uso:
+  python3 lexical_index.py "dewalt 20v cordless drill" [--k 5]
+"""
+
+import os, re, sys, math, threading, unicodedata
+from collections import defaultdict
+import numpy as np
+
+from category_store import get_category_store, iter_file_categories, JSON_PATH, PATH_SEP
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+NAME_WEIGHT = int(os.getenv("LEXICAL_NAME_WEIGHT", "2"))       # repeticiones del nombre frente a la ruta
+FAST_PATH_RATIO = float(os.getenv("LEXICAL_FAST_RATIO", "1.3"))  # top-1 / top-2 mínimo para el camino rápido
+
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "for", "with", "in", "on", "to", "by", "or", "other", "others",
+    "y", "e", "o", "de", "del", "la", "el", "los", "las", "para", "con", "en", "otros", "otras",
+}
+
+
+def tokenize(text: str):
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    out = []
+    for tok in re.findall(r"[a-z0-9]+", text):
+        if tok in STOPWORDS:
+            continue
+        # Singular simple: batteries → battery, drills → drill (no toca "glass")
+        if len(tok) > 4 and tok.endswith("ies"):
+            tok = tok[:-3] + "y"
+        elif len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        out.append(tok)
+    return out
+
+
+def _iter_leaves():
+    """(id, name, path) de las categorías hoja: store indexado o JSON."""
+    store = get_category_store()
+    if store is not None:
+        yield from store.iter_categories(leaves_only=True)
+        return
+    if not os.path.exists(JSON_PATH):
+        return
+    for cid, cdata in iter_file_categories(JSON_PATH):
+        if cdata.get("children_categories"):
+            continue
+        nodes = cdata.get("path_from_root") or [{"name": cdata.get("name", "")}]
+        yield cid, cdata.get("name", ""), PATH_SEP.join(n.get("name", "") for n in nodes)
+
+
+# ============================================================
+# 🔤 BM25
+# ============================================================
+class LexicalIndex:
+    def __init__(self, categories=None):
+        self.ids, self.names = [], []
+        postings = defaultdict(lambda: defaultdict(int))
+        lengths = []
+        self.phrases = defaultdict(set)   # tokens del nombre → docs con ese nombre exacto
+        for cid, name, path in (categories if categories is not None else _iter_leaves()):
+            doc = len(self.ids)
+            self.ids.append(cid)
+            self.names.append(name)
+            name_toks = tokenize(name)
+            toks = name_toks * NAME_WEIGHT + tokenize(path)
+            for t in toks:
+                postings[t][doc] += 1
+            lengths.append(len(toks))
+            if name_toks:
+                self.phrases[tuple(name_toks)].add(doc)
+
+        n = len(self.ids)
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if n else 1.0
+        self.max_phrase = max((len(p) for p in self.phrases), default=0)
+        # Postings como arrays: docs y tf por token, más su idf
+        self.postings = {}
+        for t, docs in postings.items():
+            d = np.fromiter(docs.keys(), dtype=np.int32, count=len(docs))
+            tf = np.fromiter(docs.values(), dtype=np.float32, count=len(docs))
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[t] = (d, tf, idf)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, query: str) -> np.ndarray:
+        S = np.zeros(len(self.ids), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / self.avgdl)
+        for t in set(tokenize(query)):
+            hit = self.postings.get(t)
+            if hit is None:
+                continue
+            docs, tf, idf = hit
+            S[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        return S
+
+    def search(self, query: str, k: int = 10):
+        """[(category_id, name, score BM25)] de mayor a menor (solo score > 0)."""
+        S = self.scores(query)
+        nz = np.flatnonzero(S)
+        if not len(nz):
+            return []
+        k = min(k, len(nz))
+        top = nz[np.argpartition(-S[nz], k - 1)[:k]]
+        top = top[np.argsort(-S[top])]
+        return [(self.ids[i], self.names[i], float(S[i])) for i in top]
+
+    def phrase_hits(self, query: str):
+        """
+        Docs cuyo nombre completo aparece como frase contigua en la consulta.
+        Un nombre contenido en otro más largo que también aparece no cuenta:
+        en "drill bits set" gana "Drill Bits", no "Drills".
+        """
+        toks = tokenize(query)
+        matches = []
+        for n in range(1, self.max_phrase + 1):
+            for i in range(len(toks) - n + 1):
+                docs = self.phrases.get(tuple(toks[i:i + n]))
+                if docs:
+                    matches.append((i, i + n, docs))
+        hits = set()
+        for start, end, docs in matches:
+            if not any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in matches):
+                hits |= docs
+        return hits
+
+    def confident_hit(self, query: str, results=None):
+        """
+        (category_id, name, score) si la consulta nombra una sola categoría hoja
+        sin ambigüedad y esa categoría lidera BM25 con ventaja; si no, None.
+        """
+        hits = self.phrase_hits(query)
+        if len(hits) != 1:
+            return None
+        doc = next(iter(hits))
+        results = results if results is not None else self.search(query, 2)
+        if not results or results[0][0] != self.ids[doc]:
+            return None
+        if len(results) > 1 and results[0][2] < FAST_PATH_RATIO * results[1][2]:
+            return None
+        return results[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_lexical_index() -> LexicalIndex:
+    """LexicalIndex del proceso (se arma la primera vez desde el store de categorías)."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LexicalIndex()
+    return _index
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def main():
+    args = [a for i, a in enumerate(sys.argv[1:], 1)
+            if not a.startswith("--") and sys.argv[i - 1] != "--k"]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    k = int(sys.argv[sys.argv.index("--k") + 1]) if "--k" in sys.argv else 5
+    index = get_lexical_index()
+    query = " ".join(args)
+    results = index.search(query, k)
+    print(f"🔤 {len(index)} categorías hoja indexadas")
+    for cid, name, score in results:
+        print(f"   • {name} ({cid}) → {score:.2f}")
+    hit = index.confident_hit(query, results)
+    print(f"⚡ Camino rápido: {hit[1]} ({hit[0]})" if hit else "🧠 Sin acierto léxico claro: hace falta embeddings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+Pipeline streaming de punta a punta en un solo proceso:
+
+  fetch (SP-API) → categoría → atributos ML → imágenes → publicación
+
+Cada etapa tiene su propio pool de hilos y se conecta con la siguiente por
+una cola acotada: si una etapa lenta (LLM, API de ML) se atrasa, las colas
+se llenan y las etapas anteriores esperan (backpressure) en vez de acumular
+productos en memoria. El índice de categorías (get_category_index) se carga
+una vez al armar el pipeline y lo comparten todos los hilos de la etapa de
+categoría; el cliente de OpenAI y los tokens son singletons del proceso.
+
+Uso:
+  python3 pipeline.py                      # ASINs de asins.txt
+  python3 pipeline.py B0AAAA B0BBBB        # ASINs sueltos
+  python3 pipeline.py --delta [feed]       # solo nuevos/cambiados del último delta
+  python3 pipeline.py --dry-run            # no publica, solo deja logs/publish_ready
+
+Concurrencia por etapa (.env): PIPELINE_FETCH_WORKERS, PIPELINE_CATEGORY_WORKERS,
+PIPELINE_MAPPING_WORKERS, PIPELINE_IMAGES_WORKERS, PIPELINE_PUBLISH_WORKERS,
+y el tamaño de cada cola con PIPELINE_QUEUE_SIZE.
+"""
+
+import os, sys, time, queue, threading, traceback
+
+# ---------- Auto-activar entorno virtual ----------
+if sys.prefix == sys.base_prefix:
+    vpy = os.path.join(os.path.dirname(__file__), "venv", "bin", "python")
+    if os.path.exists(vpy):
+        print(f"⚙️ Activando entorno virtual automáticamente desde: {vpy}")
+        os.execv(vpy, [vpy] + sys.argv)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import amzn_get_sdk
+import transform_mapper_new2 as mapper
+import publisher_from_transform as publisher
+from image_selector import select_best_images
+from rate_limit import TokenBucket
+from fetch_manifest import FetchManifest, payload_hash, STATUS_OK
+from product_store import get_store
+from category_index import get_category_index
+from delta_feed import read_delta, delta_arg
+
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+STAGE_WORKERS = {
+    "fetch": int(os.getenv("PIPELINE_FETCH_WORKERS", "4")),
+    "category": int(os.getenv("PIPELINE_CATEGORY_WORKERS", "4")),
+    "mapping": int(os.getenv("PIPELINE_MAPPING_WORKERS", "4")),
+    "images": int(os.getenv("PIPELINE_IMAGES_WORKERS", "8")),
+    "publish": int(os.getenv("PIPELINE_PUBLISH_WORKERS", "2")),
+}
+
+_DONE = object()   # centinela de fin de stream
+
+
+# ============================================================
+# 🔗 Motor genérico de etapas
+# ============================================================
+class Stage:
+    """
+    Etapa del pipeline: `workers` hilos leen de `inbox`, aplican `fn(item)` y
+    escriben el resultado en `outbox`. Si fn devuelve None el item se descarta;
+    si lanza una excepción se registra y el item no sigue.
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.ok = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._alive = self.workers
+        self._threads = []
+
+    def start(self, next_stage_workers):
+        self._next_workers = next_stage_workers
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                break
+            started = time.time()
+            try:
+                out = self.fn(item)
+                with self._lock:
+                    self.ok += 1
+                if out is not None and self.outbox is not None:
+                    self.outbox.put(out)   # bloquea si la etapa siguiente va atrasada
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"❌ [{self.name}] {item.get('asin')}: {e}")
+                if os.getenv("PIPELINE_DEBUG") == "1":
+                    traceback.print_exc()
+            finally:
+                with self._lock:
+                    self.busy_seconds += time.time() - started
+        # El último hilo en terminar avisa a todos los hilos de la etapa siguiente
+        with self._lock:
+            self._alive -= 1
+            last = self._alive == 0
+        if last and self.outbox is not None:
+            for _ in range(self._next_workers):
+                self.outbox.put(_DONE)
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+
+def run_stages(items, stage_defs, queue_size=QUEUE_SIZE):
+    """
+    stage_defs: lista de (nombre, fn, workers). Alimenta `items` en la primera
+    cola y espera a que todas las etapas terminen. Devuelve las Stage (stats).
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stage_defs]
+    stages = []
+    for i, (name, fn, workers) in enumerate(stage_defs):
+        outbox = queues[i + 1] if i + 1 < len(queues) else None
+        stages.append(Stage(name, fn, workers, queues[i], outbox))
+    for i, stage in enumerate(stages):
+        stage.start(stages[i + 1].workers if i + 1 < len(stages) else 0)
+
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0].workers):
+        queues[0].put(_DONE)
+
+    for stage in stages:
+        stage.join()
+    return stages
+
+
+# ============================================================
+# 🧩 Etapas concretas
+# ============================================================
+class PublishPipeline:
+    def __init__(self, dry_run=False, force_fetch=False):
+        self.dry_run = dry_run
+        self.force_fetch = force_fetch
+        self.store = get_store()
+        self.manifest = FetchManifest()
+        self.limiter = TokenBucket(amzn_get_sdk.SPAPI_CATALOG_RATE, amzn_get_sdk.SPAPI_CATALOG_BURST)
+        self._sites = None
+        self._sites_lock = threading.Lock()
+        self._published = None
+        self._published_lock = threading.Lock()
+        # Mismo CategoryIndex que usa match_category: se carga acá, no en el primer item
+        try:
+            self.categories = get_category_index().load()
+        except FileNotFoundError as e:
+            self.categories = None
+            print(f"⚠️ {e}")
+
+    def fetch(self, item):
+        asin = item["asin"]
+        data = None
+        if not self.force_fetch and self.manifest.is_fresh(asin):
+            data = self.store.get(asin)
+        if data is None:
+            data = amzn_get_sdk.fetch_catalog_item(asin, self.limiter)
+            amzn_get_sdk.save_product(asin, data)
+            self.manifest.record(asin, STATUS_OK, data_hash=payload_hash(data))
+        data.setdefault("asin", asin)
+        item["amazon_json"] = data
+        return item
+
+    def category(self, item):
+        amazon_json = item["amazon_json"]
+        summaries = amazon_json.get("summaries") or [{}]
+        title = (mapper._first(amazon_json, ["attributes.item_name[0].value", "summaries[0].itemName"])
+                 or summaries[0].get("itemName") or "Producto")
+        item["category_id"] = mapper.predict_category(title, amazon_json)
+        # El schema se baja en segundo plano mientras el item espera en la cola de mapping
+        mapper.prefetch_category_schemas([item["category_id"]], wait=False)
+        return item
+
+    def mapping(self, item):
+        result = mapper.build_meli_attributes(item["amazon_json"], item["category_id"])
+        item["api_ready_item"] = result["api_ready_item"]
+        return item
+
+    def images(self, item):
+        found = []
+        for block in item["amazon_json"].get("images", []) or []:
+            for img in block.get("images", []) or []:
+                if img.get("link"):
+                    found.append((img.get("width") or 0, img["link"]))
+        # Las más grandes primero: select_best_images se queda con la primera de cada imagen base
+        found.sort(key=lambda wl: -wl[0])
+        best = select_best_images([link for _, link in found])
+        if best:
+            item["api_ready_item"]["pictures"] = [{"source": u} for u in best]
+        out_path = f"logs/publish_ready/{item['category_id']}_{item['asin']}.json"
+        mapper.save_json_file(out_path, item["api_ready_item"])
+        item["publish_ready_path"] = out_path
+        return item
+
+    def _get_sites(self):
+        with self._sites_lock:
+            if self._sites is None:
+                self._sites = publisher.get_sites_to_sell()
+            return self._sites
+
+    def _published_item(self, asin):
+        """item_id ya publicado para el ASIN (logs/published se lee una vez por corrida)."""
+        with self._published_lock:
+            if self._published is None:
+                self._published = publisher.load_published_items()
+            return self._published.get(asin)
+
+    def publish(self, item):
+        if self.dry_run:
+            print(f"📝 [dry-run] {item['asin']} listo en {item['publish_ready_path']}")
+            return item
+        # Ya publicado (re-corrida o --delta con cambios): PUT, no un listing duplicado
+        item_id = self._published_item(item["asin"])
+        if item_id:
+            publisher.update_from_transform(item["publish_ready_path"], item_id)
+            item["item_id"] = item_id
+            return item
+        item["item_id"] = publisher.publish_item(dict(item["api_ready_item"]), self._get_sites())
+        return item
+
+    def run(self, asins):
+        stage_defs = [
+            ("fetch", self.fetch, STAGE_WORKERS["fetch"]),
+            ("category", self.category, STAGE_WORKERS["category"]),
+            ("mapping", self.mapping, STAGE_WORKERS["mapping"]),
+            ("images", self.images, STAGE_WORKERS["images"]),
+            ("publish", self.publish, STAGE_WORKERS["publish"]),
+        ]
+        return run_stages(({"asin": a} for a in asins), stage_defs)
+
+
+# ============================================================
+# 🚀 CLI
+# ============================================================
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    delta_path = delta_arg(sys.argv)
+    if delta_path is not None:
+        asins = [e["asin"] for e in read_delta(delta_path)]
+        print(f"🔀 Delta {delta_path or '(ninguno)'}: {len(asins)} ASINs")
+    elif args:
+        asins = args
+    else:
+        with open(amzn_get_sdk.ASINS_FILE, "r", encoding="utf-8") as f:
+            asins = [a.strip() for a in f if a.strip()]
+    asins = list(dict.fromkeys(a for a in asins if a))
+    if not asins:
+        print("⚠️ No hay ASINs para procesar.")
+        return
+
+    print(f"🚦 Pipeline: {len(asins)} ASINs | colas de {QUEUE_SIZE} | workers {STAGE_WORKERS}")
+    started = time.time()
+    pipe = PublishPipeline(dry_run="--dry-run" in sys.argv, force_fetch="--force" in sys.argv)
+    stages = pipe.run(asins)
+    pipe.manifest.compact()
+
+    print("\n📊 Resumen por etapa:")
+    for s in stages:
+        print(f"   • {s.name:<9} ✅ {s.ok:<6} ❌ {s.failed:<5} ⏱️ {s.busy_seconds:.1f}s de trabajo")
+    if pipe.categories is not None:
+        stats = pipe.categories.cache_stats()
+        print(f"♻️ Embeddings de consultas: {stats['memory_hits']} hits en memoria, {stats['disk_hits']} en disco, "
+              f"{stats['misses']} llamadas a la API")
+    print(f"⏱️ Total: {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
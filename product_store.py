@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+product_store.py
+Almacén append-only de productos de Amazon: shards JSONL comprimidos
++ índice de offsets (asin → shard, offset, length).
+
+Cada registro se guarda como un miembro gzip independiente, así se puede
+leer un ASIN suelto con un seek (acceso aleatorio) y a la vez recorrer un
+shard entero con gzip.open (lectura secuencial). Reemplaza a los miles de
+outputs/json/{asin}.json sueltos.
+
+Uso:
+  python3 product_store.py import outputs/json   # migra los JSON sueltos
+  python3 product_store.py get B0XXXXXXX          # imprime un producto
+  python3 product_store.py stats
+  python3 product_store.py compact                # descarta versiones viejas
+"""
+
+import os, sys, json, gzip, fcntl, threading
+
+STORE_DIR = os.getenv("PRODUCT_STORE_DIR", "outputs/store")
+LEGACY_JSON_DIR = "outputs/json"
+SHARD_MAX_BYTES = int(os.getenv("PRODUCT_STORE_SHARD_MB", "256")) * 1024 * 1024
+
+
+class ProductNotFound(LookupError):
+    """El producto no está como ruta, ni en el store, ni en outputs/json."""
+
+
+class ProductStore:
+    def __init__(self, path: str = STORE_DIR):
+        self.path = path
+        self.index_path = os.path.join(path, "index.jsonl")
+        self.lock_path = os.path.join(path, ".lock")
+        self.index = {}
+        self._index_pos = 0
+        self._index_ino = None
+        self._lock = threading.RLock()   # reentrante: put_many/compact llaman a refresh()
+        os.makedirs(path, exist_ok=True)
+        self.refresh()
+
+    # ============================================================
+    # 📖 Índice
+    # ============================================================
+    def refresh(self):
+        """Lee las líneas nuevas del índice (lo que escribieron otros procesos)."""
+        with self._lock:
+            try:
+                ino = os.stat(self.index_path).st_ino
+            except FileNotFoundError:
+                return
+            if ino != self._index_ino:
+                # Otro proceso compactó y publicó un índice nuevo: se relee desde cero
+                self.index, self._index_pos, self._index_ino = {}, 0, ino
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_pos)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break  # línea a medio escribir: se relee en el próximo refresh
+                    self._index_pos += len(raw)
+                    try:
+                        entry = json.loads(raw)
+                    except json.JSONDecodeError:
+                        continue
+                    if entry.get("deleted"):
+                        self.index.pop(entry["asin"], None)
+                    else:
+                        self.index[entry["asin"]] = (entry["shard"], entry["offset"], entry["length"])
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, f"shard-{shard:05d}.jsonl.gz")
+
+    def _current_shard(self) -> int:
+        shards = sorted(int(n[6:11]) for n in os.listdir(self.path) if n.startswith("shard-"))
+        shard = shards[-1] if shards else 0
+        if os.path.exists(self._shard_path(shard)) and os.path.getsize(self._shard_path(shard)) >= SHARD_MAX_BYTES:
+            shard += 1
+        return shard
+
+    def _append_index(self, lines):
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+
+    # ============================================================
+    # ✍️ Escritura (append-only)
+    # ============================================================
+    def put_many(self, items):
+        """Agrega varios (asin, data) en una sola apertura de shard e índice."""
+        items = list(items)
+        if not items:
+            return
+        with self._lock, open(self.lock_path, "w") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            self.refresh()
+            shard = self._current_shard()
+            index_lines = []
+            with open(self._shard_path(shard), "ab") as f:
+                for asin, data in items:
+                    line = json.dumps({"asin": asin, "data": data}, ensure_ascii=False, separators=(",", ":"))
+                    blob = gzip.compress((line + "\n").encode("utf-8"))
+                    offset = f.tell()
+                    f.write(blob)
+                    self.index[asin] = (shard, offset, len(blob))
+                    index_lines.append((json.dumps({"asin": asin, "shard": shard, "offset": offset,
+                                                    "length": len(blob)}) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_index(index_lines)
+            st = os.stat(self.index_path)
+            self._index_pos, self._index_ino = st.st_size, st.st_ino
+
+    def put(self, asin: str, data: dict):
+        self.put_many([(asin, data)])
+
+    def delete(self, asin: str):
+        """Tombstone: el ASIN deja de aparecer (se limpia físicamente al compactar)."""
+        with self._lock, open(self.lock_path, "w") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            self.refresh()
+            if self.index.pop(asin, None) is not None:
+                self._append_index([(json.dumps({"asin": asin, "deleted": True}) + "\n").encode("utf-8")])
+            self._index_pos = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+
+    # ============================================================
+    # 🔍 Lectura
+    # ============================================================
+    def __contains__(self, asin) -> bool:
+        return asin in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def asins(self):
+        with self._lock:
+            return list(self.index.keys())
+
+    def get(self, asin: str):
+        loc = self.index.get(asin)
+        if loc is None:
+            self.refresh()
+            loc = self.index.get(asin)
+            if loc is None:
+                return None
+        shard, offset, length = loc
+        try:
+            f = open(self._shard_path(shard), "rb")
+        except FileNotFoundError:
+            # Shard borrado por un compact de otro proceso: se toma el índice nuevo
+            self.refresh()
+            loc = self.index.get(asin)
+            if loc is None:
+                return None
+            shard, offset, length = loc
+            f = open(self._shard_path(shard), "rb")
+        with f:
+            f.seek(offset)
+            blob = f.read(length)
+        return json.loads(gzip.decompress(blob))["data"]
+
+    def iter_products(self):
+        """Recorre todos los productos vigentes, shard por shard y en orden de offset."""
+        with self._lock:
+            entries = list(self.index.items())
+        by_shard = {}
+        for asin, (shard, offset, length) in entries:
+            by_shard.setdefault(shard, []).append((offset, length, asin))
+        for shard in sorted(by_shard):
+            with open(self._shard_path(shard), "rb") as f:
+                for offset, length, asin in sorted(by_shard[shard]):
+                    f.seek(offset)
+                    yield asin, json.loads(gzip.decompress(f.read(length)))["data"]
+
+    # ============================================================
+    # 🧹 Mantenimiento
+    # ============================================================
+    def compact(self):
+        """
+        Reescribe solo las versiones vigentes en shards nuevos y un índice limpio.
+        Toma el mismo lock de archivo que put_many/delete, así ningún writer
+        escribe mientras tanto. Los shards viejos se borran recién cuando los
+        nuevos y el índice que apunta a ellos están en disco y publicados.
+        """
+        with self._lock, open(self.lock_path, "w") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            self.refresh()
+            old_shards = {s for s, _, _ in self.index.values()}
+            old_files = [n for n in os.listdir(self.path) if n.startswith("shard-")]
+            base = max([int(n[6:11]) for n in old_files] + [-1]) + 1
+            shard, new_index, out = base, {}, None
+            lines = []
+            try:
+                for asin, data in self.iter_products():
+                    if out is None or out.tell() >= SHARD_MAX_BYTES:
+                        if out:
+                            out.flush()
+                            os.fsync(out.fileno())
+                            out.close()
+                            shard += 1
+                        out = open(self._shard_path(shard), "wb")
+                    line = json.dumps({"asin": asin, "data": data}, ensure_ascii=False, separators=(",", ":"))
+                    blob = gzip.compress((line + "\n").encode("utf-8"))
+                    offset = out.tell()
+                    out.write(blob)
+                    new_index[asin] = (shard, offset, len(blob))
+                    lines.append(json.dumps({"asin": asin, "shard": shard, "offset": offset,
+                                             "length": len(blob)}) + "\n")
+                if out:
+                    out.flush()
+                    os.fsync(out.fileno())
+            finally:
+                if out:
+                    out.close()
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.index_path)
+            dir_fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            # Recién con el índice nuevo publicado se borran los shards viejos
+            self.index = new_index
+            self._index_pos = os.path.getsize(self.index_path)
+            self._index_ino = os.stat(self.index_path).st_ino
+            for n in old_files:
+                os.remove(os.path.join(self.path, n))
+            return len(old_shards), len({s for s, _, _ in new_index.values()})
+
+    def import_dir(self, folder: str = LEGACY_JSON_DIR, batch_size: int = 500) -> int:
+        """Migra outputs/json/{asin}.json al store."""
+        names = sorted(n for n in os.listdir(folder) if n.endswith(".json"))
+        batch, total = [], 0
+        for name in names:
+            with open(os.path.join(folder, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            batch.append((data.get("asin") or name[:-5], data))
+            if len(batch) >= batch_size:
+                self.put_many(batch)
+                total += len(batch)
+                batch = []
+        self.put_many(batch)
+        return total + len(batch)
+
+
+# ============================================================
+# 🧩 Acceso compartido para los demás módulos
+# ============================================================
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> ProductStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ProductStore()
+    return _store
+
+
+def load_product(ref: str):
+    """
+    Carga un producto a partir de un ASIN o de una ruta a JSON.
+    Orden: ruta existente → store → outputs/json/{asin}.json (legacy).
+    """
+    if ref and os.path.isfile(ref):
+        with open(ref, "r", encoding="utf-8") as f:
+            return json.load(f)
+    asin = os.path.basename(str(ref))
+    if asin.endswith(".json"):
+        asin = asin[:-5]
+    data = get_store().get(asin)
+    if data is not None:
+        return data
+    legacy = os.path.join(LEGACY_JSON_DIR, f"{asin}.json")
+    if os.path.exists(legacy):
+        with open(legacy, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    cmd = sys.argv[1]
+    store = get_store()
+    if cmd == "import":
+        folder = sys.argv[2] if len(sys.argv) > 2 else LEGACY_JSON_DIR
+        n = store.import_dir(folder)
+        print(f"✅ {n} productos importados desde {folder} → {store.path}")
+    elif cmd == "get" and len(sys.argv) > 2:
+        data = store.get(sys.argv[2])
+        if data is None:
+            print(f"❌ {sys.argv[2]} no está en el store")
+            sys.exit(1)
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+    elif cmd == "stats":
+        shards = sorted(n for n in os.listdir(store.path) if n.startswith("shard-"))
+        size = sum(os.path.getsize(os.path.join(store.path, n)) for n in shards)
+        print(f"📦 {len(store)} productos | {len(shards)} shards | {size / 1024 / 1024:.1f} MB")
+    elif cmd == "compact":
+        before, after = store.compact()
+        print(f"🧹 Compactado: {before} → {after} shards, {len(store)} productos vigentes")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,10 @@
 # 📦 publisher_from_transform_global_like.py — versión espejo del main global
 # ============================================================
 
-import os, sys, json, time, requests, datetime
+import os, sys, json, time, glob, requests, datetime
 from dotenv import load_dotenv
+from token_broker import meli_broker
+from delta_feed import read_delta, delta_arg, CHANGE_NEW, CHANGE_CHANGED, CHANGE_REMOVED
 
 # ---------- Inicialización ----------
 if sys.prefix == sys.base_prefix:
@@ -15,25 +17,25 @@ if sys.prefix == sys.base_prefix:
         os.execv(vpy, [vpy] + sys.argv)
 
 load_dotenv()
-ML_ACCESS_TOKEN = os.getenv("ML_ACCESS_TOKEN")
 API = "https://api.mercadolibre.com"
-HEADERS = {"Authorization": f"Bearer {ML_ACCESS_TOKEN}", "Content-Type": "application/json"}
+# Authorization lo agrega el token broker en cada request (renovación + replay ante 401)
+HEADERS = {"Content-Type": "application/json"}
 
 # ---------- Helpers ----------
 def http_get(url):
-    r = requests.get(url, headers=HEADERS, timeout=30)
+    r = meli_broker().request("GET", url, headers=HEADERS, timeout=30)
     if not r.ok:
         raise RuntimeError(f"GET {url} → {r.status_code} {r.text}")
     return r.json()
 
 def http_post(url, body):
-    r = requests.post(url, headers=HEADERS, json=body, timeout=60)
+    r = meli_broker().request("POST", url, headers=HEADERS, json=body, timeout=60)
     if not r.ok:
         raise RuntimeError(f"POST {url} → {r.status_code} {r.text}")
     return r.json()
 
 def http_put(url, body):
-    r = requests.put(url, headers=HEADERS, json=body, timeout=60)
+    r = meli_broker().request("PUT", url, headers=HEADERS, json=body, timeout=60)
     if not r.ok:
         print(f"⚠️ PUT {url} → {r.status_code} {r.text}")
     return r.json() if r.text else {}
@@ -62,7 +64,11 @@ def publish_from_transform(path):
     user = http_get(f"{API}/users/me")
     print(f"👤 Usuario: {user.get('nickname')} ({user.get('id')})")
 
-    sites = get_sites_to_sell()
+    return publish_item(data, get_sites_to_sell())
+
+
+def publish_item(data, sites):
+    """Publica un item ya transformado (dict). `sites` sale de get_sites_to_sell()."""
 
     # --- Defaults seguros ---
     pictures = data.get("pictures") or [
@@ -73,6 +79,12 @@ def publish_from_transform(path):
         {"id": "WARRANTY_TIME", "value_name": "30 days"},
     ]
 
+    # Normalizar nombres de claves por si vienen en camelCase
+    for alt in ["packageLength", "packageWidth", "packageHeight", "packageWeight"]:
+        val = data.get(alt)
+        if val and f"package_{alt[7:].lower()}" not in data:
+            data[f"package_{alt[7:].lower()}"] = val
+
     # --- Valores obligatorios ---
     L = float(data.get("package_length") or 10.0)
     W = float(data.get("package_width") or 10.0)
@@ -80,12 +92,6 @@ def publish_from_transform(path):
     KG = float(data.get("package_weight") or 0.5)
     net = float(data.get("global_net_proceeds") or data.get("prices", {}).get("price_with_markup_usd") or 99.0)
 
-    # Normalizar nombres de claves por si vienen en camelCase
-for alt in ["packageLength", "packageWidth", "packageHeight", "packageWeight"]:
-    val = data.get(alt)
-    if val and f"package_{alt[7:].lower()}" not in data:
-        data[f"package_{alt[7:].lower()}"] = val
-
     body = {
         "title": data.get("title")[:60],
         "category_id": data.get("category_id"),
@@ -136,17 +142,95 @@ for alt in ["packageLength", "packageWidth", "packageHeight", "packageWeight"]:
         "title": data.get("title"),
         "price": net,
         "category_id": data.get("category_id"),
-        "asin": data.get("asin"),
+        "asin": data.get("asin") or data.get("seller_custom_field"),
     }
     with open(f"logs/published/{item_id or int(time.time())}.json", "w", encoding="utf-8") as f:
         json.dump(log, f, indent=2, ensure_ascii=False)
     print(f"📝 Guardado log → logs/published/{item_id}.json")
+    return item_id
+
+# ============================================================
+# 🔀 Modo delta: solo productos nuevos / cambiados
+# ============================================================
+def find_publish_ready(asin):
+    """Último JSON de transform_mapper para el ASIN (logs/publish_ready/{cid}_{asin}.json)."""
+    files = glob.glob(f"logs/publish_ready/*_{asin}.json")
+    return max(files, key=os.path.getmtime) if files else None
+
+def load_published_items():
+    """ASIN → item_id de la última publicación registrada (un solo barrido de logs/published)."""
+    best = {}
+    for path in glob.glob("logs/published/*.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                log = json.load(f)
+        except Exception:
+            continue
+        asin = log.get("asin")
+        if asin and log.get("item_id"):
+            prev = best.get(asin)
+            if prev is None or log.get("timestamp", "") > prev.get("timestamp", ""):
+                best[asin] = log
+    return {asin: log["item_id"] for asin, log in best.items()}
+
+def update_from_transform(path, item_id):
+    """Producto que cambió y ya estaba publicado: PUT en vez de crear otro item."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # Solo campos editables: site_id / logistic_type son de creación
+    body = {
+        "title": (data.get("title") or "")[:60],
+        "description": data.get("description"),
+        "attributes": data.get("attributes", []),
+        "global_net_proceeds": data.get("global_net_proceeds"),
+        "seller_custom_field": data.get("seller_custom_field"),
+    }
+    print(f"🛠️ Actualizando {item_id} con PUT ...")
+    http_put(f"{API}/global/items/{item_id}", {k: v for k, v in body.items() if v not in (None, "", [])})
+
+def pause_item(item_id):
+    """Producto que Amazon ya no devuelve: se pausa el item para no vender sin stock."""
+    print(f"⏸️ Pausando {item_id} ...")
+    http_put(f"{API}/global/items/{item_id}", {"status": "paused"})
+
+def publish_delta(delta_path):
+    entries = read_delta(delta_path, changes=(CHANGE_NEW, CHANGE_CHANGED, CHANGE_REMOVED))
+    print(f"🔀 Delta {delta_path or '(ninguno)'}: {len(entries)} ASINs")
+    published = load_published_items() if entries else {}
+    for entry in entries:
+        asin = entry["asin"]
+        item_id = published.get(asin)
+        if entry["change"] == CHANGE_REMOVED:
+            if item_id:
+                print(f"⚠️ {asin} ya no está en Amazon — se pausa el item publicado {item_id}.")
+                try:
+                    pause_item(item_id)
+                except Exception as e:
+                    print(f"❌ Error pausando {item_id}: {e}")
+            continue
+        path = find_publish_ready(asin)
+        if not path:
+            print(f"⚠️ {asin}: no hay JSON en logs/publish_ready (¿corriste transform_mapper --delta?)")
+            continue
+        try:
+            if item_id and entry["change"] == CHANGE_CHANGED:
+                update_from_transform(path, item_id)
+            else:
+                publish_from_transform(path)
+        except Exception as e:
+            print(f"❌ Error con {asin}: {e}")
 
 # ============================================================
 def main():
     if len(sys.argv) < 2:
         print("Uso: python3 publisher_from_transform_global_like.py <archivo.json>")
+        print("     python3 publisher_from_transform_global_like.py --delta [delta.jsonl]")
         sys.exit(1)
+    delta_path = delta_arg(sys.argv)
+    if delta_path is not None:
+        publish_delta(delta_path)
+        print("\n✅ Proceso completo.")
+        return
     path = sys.argv[1]
     try:
         publish_from_transform(path)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rate_limit.py
+Limitador token-bucket thread-safe para APIs con cuota (SP-API, OpenAI…).
+Soporta backoff adaptativo (AIMD): baja la tasa al recibir throttling
+y la recupera de a poco con cada request exitoso.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket clásico: `rate` tokens por segundo, capacidad `burst`.
+    `acquire(n)` bloquea hasta poder consumir n tokens. Si n supera la
+    capacidad, espera a tener el bucket lleno y queda en deuda (negativo),
+    así pedidos grandes (p.ej. tokens de OpenAI) no se bloquean para siempre.
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float = None):
+        if rate <= 0 or burst <= 0:
+            raise ValueError("rate y burst deben ser > 0")
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.base_rate / 16.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens: float = 1.0):
+        need = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= need:
+                    self.tokens -= float(tokens)
+                    return
+                wait = (need - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, factor: float = 0.5):
+        """Throttling recibido: reduce la tasa y vacía el bucket."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0.0)
+
+    def recover(self, step: float = None):
+        """Request exitoso: recupera la tasa de forma aditiva hasta la base."""
+        if self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.base_rate, self.rate + (step or self.base_rate / 20.0))
+
+    def set_rate(self, rate: float):
+        """Ajusta la tasa base (p.ej. desde el header x-amzn-RateLimit-Limit)."""
+        with self._lock:
+            self._refill()
+            self.base_rate = float(rate)
+            self.rate = min(self.rate, self.base_rate)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+schema_cache.py
+Cache de schemas de categoría (atributos de ML ya compilados: value-name →
+value_id, unidades permitidas, tipo) en dos niveles:
+
+- LRU en memoria del proceso (SCHEMA_CACHE_SIZE categorías)
+- data/category_schemas.sqlite (WAL, seguro entre procesos): schema
+  compilado + ETag + fecha de descarga. Vale SCHEMA_TTL_S segundos; vencido
+  se revalida con GET condicional (If-None-Match) y un 304 solo renueva la fecha.
+
+Orden de búsqueda: memoria → disco vigente → API de ML → si la API falla,
+disco vencido y después el store local de categorías
+(data/cbt_categories.sqlite, un volcado sin fecha que nunca se revalida).
+Si no hay schema por ningún lado se lanza SchemaUnavailable en vez de
+devolver {} (un item sin atributos no sirve).
+
+Los hilos que piden la misma categoría a la vez comparten una sola descarga,
+y `prefetch(ids)` calienta en paralelo todas las categorías de un lote.
+
+Uso:
+  python3 schema_cache.py prefetch CBT1157 CBT3694 ...   # o --file ids.txt
+  python3 schema_cache.py show CBT1157
+  python3 schema_cache.py stats
+"""
+
+import os, sys, json, time, sqlite3, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from token_broker import meli_broker
+from category_store import get_category_store
+
+API = "https://api.mercadolibre.com"
+SCHEMA_CACHE_PATH = os.getenv("SCHEMA_CACHE_PATH", os.path.join("data", "category_schemas.sqlite"))
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "512"))
+SCHEMA_TTL_S = int(os.getenv("SCHEMA_TTL_S", str(24 * 3600)))
+SCHEMA_PREFETCH_WORKERS = int(os.getenv("SCHEMA_PREFETCH_WORKERS", "8"))
+
+
+class SchemaUnavailable(RuntimeError):
+    """No hay schema de la categoría: ni local, ni en cache, ni desde la API."""
+
+
+def compile_schema(attributes) -> dict:
+    schema = {}
+    for a in attributes:
+        if a.get("id"):
+            schema[a["id"]] = {
+                "value_type": a.get("value_type"),
+                "values": {v["name"].lower(): v["id"]
+                           for v in a.get("values",[]) if v.get("id")},
+                "allowed_units": [u["id"] for u in a.get("allowed_units",[])]
+                                 if a.get("allowed_units") else []
+            }
+    return schema
+
+
+# ============================================================
+# 📘 Cache de dos niveles
+# ============================================================
+class SchemaCache:
+    def __init__(self, path: str = SCHEMA_CACHE_PATH, size: int = SCHEMA_CACHE_SIZE, ttl: int = SCHEMA_TTL_S):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS schemas ("
+            " category_id TEXT PRIMARY KEY, etag TEXT, fetched_at REAL NOT NULL, schema TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._inflight = {}   # category_id → Future de la carga en curso
+        self._executor = None
+        self.counts = {"memory": 0, "local": 0, "disk": 0, "revalidated": 0, "fetched": 0, "stale": 0}
+
+    # --- Disco ---
+    def _read(self, category_id):
+        with self._db_lock:
+            row = self.conn.execute("SELECT etag, fetched_at, schema FROM schemas WHERE category_id = ?",
+                                    (category_id,)).fetchone()
+        if not row:
+            return None
+        return {"etag": row[0], "fetched_at": row[1], "schema": json.loads(row[2])}
+
+    def _write(self, category_id, schema, etag):
+        with self._db_lock:
+            self.conn.execute("INSERT OR REPLACE INTO schemas VALUES (?, ?, ?, ?)",
+                              (category_id, etag, time.time(), json.dumps(schema, ensure_ascii=False)))
+            self.conn.commit()
+
+    def _touch(self, category_id):
+        with self._db_lock:
+            self.conn.execute("UPDATE schemas SET fetched_at = ? WHERE category_id = ?", (time.time(), category_id))
+            self.conn.commit()
+
+    # --- Memoria ---
+    def _remember(self, category_id, schema):
+        with self._lock:
+            self._lru[category_id] = schema
+            self._lru.move_to_end(category_id)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _count(self, source):
+        with self._lock:
+            self.counts[source] += 1
+
+    # --- Carga ---
+    def _fetch(self, category_id, etag=None):
+        """(schema o None si 304, etag) desde la API de ML."""
+        headers = {"If-None-Match": etag} if etag else {}
+        r = meli_broker().request("GET", f"{API}/categories/{category_id}/attributes", headers=headers, timeout=10)
+        if r.status_code == 304:
+            return None, etag
+        r.raise_for_status()
+        return compile_schema(r.json()), r.headers.get("ETag")
+
+    def _load(self, category_id):
+        # 1) Disco vigente
+        cached = self._read(category_id)
+        if cached and time.time() - cached["fetched_at"] < self.ttl:
+            self._count("disk")
+            return cached["schema"]
+
+        # 2) API de ML (condicional si ya lo teníamos)
+        try:
+            schema, etag = self._fetch(category_id, cached["etag"] if cached else None)
+        except Exception as e:
+            # 3) Sin API: lo guardado aunque esté vencido, o el store local
+            if cached:
+                self._count("stale")
+                print(f"⚠️ No se pudo revalidar el schema {category_id} ({e}); uso el guardado.")
+                return cached["schema"]
+            store = get_category_store()
+            attrs = store.attributes(category_id) if store is not None else None
+            if attrs:
+                self._count("local")
+                print(f"⚠️ No se pudo obtener el schema {category_id} ({e}); uso el store local.")
+                return compile_schema(attrs)
+            raise SchemaUnavailable(f"No se pudo obtener schema {category_id}: {e}")
+        if schema is None:
+            self._touch(category_id)
+            self._count("revalidated")
+            return cached["schema"]
+        self._write(category_id, schema, etag)
+        self._count("fetched")
+        return schema
+
+    def get(self, category_id) -> dict:
+        """Schema compilado de la categoría (compartido: no modificar)."""
+        with self._lock:
+            if category_id in self._lru:
+                self._lru.move_to_end(category_id)
+                self.counts["memory"] += 1
+                return self._lru[category_id]
+            fut = self._inflight.get(category_id)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[category_id] = Future()
+        if not owner:   # otro hilo ya la está cargando: esperamos su resultado
+            return fut.result()
+        try:
+            schema = self._load(category_id)
+            self._remember(category_id, schema)
+            fut.set_result(schema)
+            return schema
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(category_id, None)
+
+    # --- Prefetch ---
+    def prefetch(self, category_ids, wait: bool = True, workers: int = SCHEMA_PREFETCH_WORKERS) -> dict:
+        """
+        Carga en paralelo los schemas de un lote. Con wait=False solo los
+        encola (para solaparlo con otro trabajo) y devuelve {}; si no,
+        devuelve {"ok": n, "failed": [ids]}.
+        """
+        ids = [c for c in dict.fromkeys(category_ids) if c]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="schema")
+            executor = self._executor
+        futures = {c: executor.submit(self.get, c) for c in ids}
+        if not wait:
+            return {}
+        failed = []
+        for c, f in futures.items():
+            try:
+                f.result()
+            except Exception as e:
+                failed.append(c)
+                print(f"⚠️ {e}")
+        return {"ok": len(ids) - len(failed), "failed": failed}
+
+    def invalidate(self, category_id):
+        with self._lock:
+            self._lru.pop(category_id, None)
+        with self._db_lock:
+            self.conn.execute("DELETE FROM schemas WHERE category_id = ?", (category_id,))
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            on_disk = self.conn.execute("SELECT COUNT(*) FROM schemas").fetchone()[0]
+        with self._lock:
+            return dict(self.counts, in_memory=len(self._lru), on_disk=on_disk)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_schema_cache() -> SchemaCache:
+    """SchemaCache del proceso."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SchemaCache()
+    return _cache
+
+
+# ============================================================
+# 🧩 CLI
+# ============================================================
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    args = [a for i, a in enumerate(sys.argv[2:], 2) if not a.startswith("--") and sys.argv[i - 1] != "--file"]
+    cache = get_schema_cache()
+    if cmd == "prefetch":
+        ids = list(args)
+        if "--file" in sys.argv:
+            with open(sys.argv[sys.argv.index("--file") + 1], "r", encoding="utf-8") as f:
+                ids += [line.strip() for line in f if line.strip()]
+        if not ids:
+            print(__doc__)
+            sys.exit(1)
+        started = time.time()
+        res = cache.prefetch(ids)
+        print(f"📘 {res['ok']}/{len(dict.fromkeys(ids))} schemas listos en {time.time() - started:.1f}s")
+        if res["failed"]:
+            print(f"❌ Sin schema: {', '.join(res['failed'])}")
+            sys.exit(1)
+    elif cmd == "show" and args:
+        print(json.dumps(cache.get(args[0]), indent=2, ensure_ascii=False))
+    elif cmd == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
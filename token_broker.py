@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+token_broker.py
+Broker de tokens OAuth en proceso para Mercado Libre y Amazon LWA.
+
+- Guarda access_token / refresh_token / vencimiento en .tokens/<proveedor>.json
+- Renueva de forma proactiva (antes de que venza, ver TOKEN_REFRESH_MARGIN_S)
+- Un solo refresh a la vez: lock de hilo + file lock (fcntl) entre procesos;
+  quien llega tarde relee el archivo y usa el token que ya renovó otro
+- `broker.request(...)` reintenta una vez con token nuevo si la API responde 401
+- Los tokens nuevos también se escriben en .env (compatibilidad con scripts viejos)
+"""
+
+import os, json, time, fcntl, threading
+import requests
+
+try:
+    import dotenv
+    dotenv.load_dotenv()
+except Exception:
+    dotenv = None
+
+TOKEN_DIR = os.getenv("TOKEN_STATE_DIR", ".tokens")
+ENV_FILE = ".env"
+REFRESH_MARGIN_S = int(os.getenv("TOKEN_REFRESH_MARGIN_S", "600"))
+
+
+def _env(*names):
+    for n in names:
+        v = os.getenv(n, "").strip()
+        if v:
+            return v
+    return ""
+
+
+class TokenBroker:
+    def __init__(self, name, token_url, client_id, client_secret, refresh_token,
+                 access_token="", access_env=None, refresh_env=None, default_ttl=3600):
+        self.name = name
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_env = access_env
+        self.refresh_env = refresh_env
+        self.default_ttl = default_ttl
+        self.state_path = os.path.join(TOKEN_DIR, f"{name}.json")
+        self.lock_path = os.path.join(TOKEN_DIR, f"{name}.lock")
+        self._lock = threading.Lock()         # un solo refresh a la vez
+        self._state_lock = threading.Lock()   # lecturas/escrituras de _state
+        self._state = {"access_token": access_token, "refresh_token": refresh_token, "expires_at": 0}
+        self._load_state()
+
+    # ============================================================
+    # 💾 Estado compartido
+    # ============================================================
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("access_token"):
+                with self._state_lock:
+                    self._state.update(saved)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def _snapshot(self) -> dict:
+        with self._state_lock:
+            return dict(self._state)
+
+    def _save_state(self, state: dict):
+        os.makedirs(TOKEN_DIR, exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.state_path)
+        if dotenv and os.path.exists(ENV_FILE):
+            if self.access_env:
+                dotenv.set_key(ENV_FILE, self.access_env, state["access_token"])
+            if self.refresh_env and state.get("refresh_token"):
+                dotenv.set_key(ENV_FILE, self.refresh_env, state["refresh_token"])
+        if self.access_env:
+            os.environ[self.access_env] = state["access_token"]
+
+    @staticmethod
+    def _needs_refresh(state: dict) -> bool:
+        return (not state.get("access_token")
+                or state.get("expires_at", 0) - time.time() < REFRESH_MARGIN_S)
+
+    # ============================================================
+    # 🔄 Refresh (single-flight)
+    # ============================================================
+    def refresh(self, stale_token: str = None, force: bool = False) -> str:
+        """
+        Renueva el token. Si mientras esperábamos el lock otro hilo u otro
+        proceso ya dejó un token vigente distinto de `stale_token`, se usa ese.
+        """
+        with self._lock:
+            os.makedirs(TOKEN_DIR, exist_ok=True)
+            with open(self.lock_path, "w") as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                self._load_state()
+                state = self._snapshot()
+                current = state.get("access_token")
+                if not force and not self._needs_refresh(state) and current != stale_token:
+                    return current
+                return self._do_refresh()
+
+    def _do_refresh(self) -> str:
+        refresh_token = self.refresh_token
+        if not (self.client_id and self.client_secret and refresh_token):
+            raise RuntimeError(f"Faltan credenciales para renovar el token de {self.name} (.env)")
+        print(f"🔄 Renovando access token de {self.name}...")
+        r = requests.post(self.token_url, data={
+            "grant_type": "refresh_token",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "refresh_token": refresh_token,
+        }, headers={"Content-Type": "application/x-www-form-urlencoded;charset=UTF-8"}, timeout=30)
+        data = r.json() if r.content else {}
+        if r.status_code != 200 or "access_token" not in data:
+            raise RuntimeError(f"Error al renovar token de {self.name} ({r.status_code}): {data or r.text[:200]}")
+        with self._state_lock:
+            self._state["access_token"] = data["access_token"]
+            if data.get("refresh_token"):   # ML rota el refresh_token en cada uso
+                self._state["refresh_token"] = data["refresh_token"]
+            self._state["expires_at"] = time.time() + int(data.get("expires_in") or self.default_ttl)
+            state = dict(self._state)
+        self._save_state(state)
+        print(f"✅ Token de {self.name} renovado (vence en {int(data.get('expires_in') or self.default_ttl) // 60} min).")
+        return state["access_token"]
+
+    # ============================================================
+    # 🔑 API pública
+    # ============================================================
+    @property
+    def refresh_token(self) -> str:
+        """refresh_token vigente (puede rotar en cada renovación)."""
+        with self._state_lock:
+            return self._state.get("refresh_token") or ""
+
+    @property
+    def expires_at(self) -> float:
+        """Epoch en que vence el access token actual (0 si no se sabe)."""
+        with self._state_lock:
+            return self._state.get("expires_at", 0)
+
+    def get_token(self) -> str:
+        # Otro proceso pudo haber renovado: releemos el estado antes de decidir
+        state = self._snapshot()
+        if self._needs_refresh(state):
+            self._load_state()
+            state = self._snapshot()
+        token = state.get("access_token")
+        if self._needs_refresh(state):
+            if not state.get("refresh_token"):
+                # Modo legacy: solo hay access token en .env, sin forma de renovarlo
+                if not token:
+                    raise RuntimeError(f"Falta el access token de {self.name} en .env")
+                return token
+            return self.refresh(stale_token=token)
+        return token
+
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.get_token()}"}
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """requests.request con Authorization; ante 401 renueva y repite una vez."""
+        headers = dict(kwargs.pop("headers", None) or {})
+        token = self.get_token()
+        headers["Authorization"] = f"Bearer {token}"
+        r = requests.request(method, url, headers=headers, **kwargs)
+        if r.status_code == 401 and self.refresh_token:
+            print(f"🔐 401 de {self.name} — renovando token y reintentando…")
+            headers["Authorization"] = f"Bearer {self.refresh(stale_token=token)}"
+            r = requests.request(method, url, headers=headers, **kwargs)
+        return r
+
+
+# ============================================================
+# 🏭 Brokers por proveedor (uno por proceso)
+# ============================================================
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+def meli_broker() -> TokenBroker:
+    with _brokers_lock:
+        if "meli" not in _brokers:
+            _brokers["meli"] = TokenBroker(
+                "meli", "https://api.mercadolibre.com/oauth/token",
+                client_id=_env("ML_CLIENT_ID"),
+                client_secret=_env("ML_CLIENT_SECRET"),
+                refresh_token=_env("ML_REFRESH_TOKEN"),
+                access_token=_env("ML_ACCESS_TOKEN"),
+                access_env="ML_ACCESS_TOKEN", refresh_env="ML_REFRESH_TOKEN",
+                default_ttl=21600,   # 6 h
+            )
+        return _brokers["meli"]
+
+def amazon_broker() -> TokenBroker:
+    with _brokers_lock:
+        if "amazon" not in _brokers:
+            _brokers["amazon"] = TokenBroker(
+                "amazon", "https://api.amazon.com/auth/o2/token",
+                client_id=_env("AMZ_CLIENT_ID", "LWA_CLIENT_ID"),
+                client_secret=_env("AMZ_CLIENT_SECRET", "LWA_CLIENT_SECRET"),
+                refresh_token=_env("AMZ_REFRESH_TOKEN", "REFRESH_TOKEN"),
+                access_token=_env("AMZ_ACCESS_TOKEN"),
+                access_env="AMZ_ACCESS_TOKEN", refresh_env="AMZ_REFRESH_TOKEN",
+                default_ttl=3600,   # 1 h
+            )
+        return _brokers["amazon"]
@@ -5,7 +5,7 @@
 # Amazon → MercadoLibre attribute translator + AI Category Detection
 # ============================================================
 
-import os, sys, json, re, requests
+import os, sys, json, re, time, threading, requests
 from typing import Dict, List, Any
 
 # ---------- 0) Auto-activar entorno virtual ----------
@@ -30,27 +30,18 @@ MARKUP_PCT = float(os.getenv("MARKUP_PCT", "35")) / 100.0
 
 from openai import OpenAI
 from category_matcher import match_category   # ← integración directa aquí
+from product_store import load_product, ProductNotFound
+from schema_cache import get_schema_cache, SchemaUnavailable
+from kv_store import get_kv_store
+from delta_feed import read_delta, delta_arg
 
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 API = "https://api.mercadolibre.com"
-HEADERS = {"Authorization": f"Bearer {ML_ACCESS_TOKEN}"} if ML_ACCESS_TOKEN else {}
 
-CACHE_PATH = "logs/ai_equivalences_cache.json"
-TITLE_CACHE_PATH = "logs/ai_title_cache.json"
-DESC_CACHE_PATH  = "logs/ai_desc_cache.json"
-
-def _load_small_cache(path):
-    try:
-        if os.path.exists(path):
-            return json.load(open(path, "r", encoding="utf-8"))
-    except:
-        pass
-    return {}
-
-def _save_small_cache(path, data):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# Caches de IA en el KV store (data/kv_store.sqlite), por namespace
+EQUIV_NS = "ai_equivalences"
+TITLE_NS = "ai_title"
+DESC_NS  = "ai_desc"
 
 # ============================================================
 # 📘 Utilidades básicas
@@ -121,6 +112,152 @@ def _to_kg(value, unit):
     if unit == "oz": return value * 0.028349523125
     return value
 
+
+# ============================================================
+# 🗂️ Producto aplanado (una sola pasada por producto)
+# ============================================================
+KEY_NGRAM = 3   # largo de los n-gramas del índice de claves
+
+class FlatProduct:
+    """
+    JSON de Amazon aplanado una sola vez, con las claves ya normalizadas.
+    Todos los extractores (find_value, get_package_dimension, _first, ...)
+    consultan este objeto en vez de volver a aplanar y normalizar el JSON.
+
+    - flat: {ruta en minúsculas: valor}, igual que flatten_summary
+    - norm_flat: {clave normalizada: valor}; si dos rutas normalizan igual,
+      queda el último valor en la posición de la primera (como el dict de antes)
+    - unit_keys: {ruta de un ".value": ruta de su hermano ".unit"}
+
+    Las búsquedas "claves que contienen X" / "claves contenidas en X" usan un
+    índice sobre las claves normalizadas (se arma en la primera consulta):
+    postings de trigramas para la primera y, para la segunda, solo se miran
+    los substrings de X con el largo de alguna clave. Ambas devuelven
+    posiciones en orden de inserción, así que el primer match es el mismo
+    que con el recorrido lineal de antes.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.flat = flatten_summary(data)
+        self.keys = list(self.flat)
+        self.values = list(self.flat.values())
+        nkeys = [normalize_key(k) for k in self.keys]
+        self.norm_flat = dict(zip(nkeys, self.values))
+        self.norm_keys = list(self.norm_flat)
+        self.rows = {}   # clave normalizada → posiciones en flat con esa clave
+        for i, nk in enumerate(nkeys):
+            self.rows.setdefault(nk, []).append(i)
+        self.unit_keys = {}
+        for k in self.keys:
+            if k.endswith(".value"):
+                unit_key = k[:-len(".value")] + ".unit"
+                if unit_key in self.flat:
+                    self.unit_keys[k] = unit_key
+        self._postings = None
+        self._memo = {}
+
+    def _build_index(self):
+        postings = {}
+        n = KEY_NGRAM
+        for i, fk in enumerate(self.norm_keys):
+            for g in {fk[j:j + n] for j in range(len(fk) - n + 1)}:
+                postings.setdefault(g, []).append(i)
+        self._position = {fk: i for i, fk in enumerate(self.norm_keys)}
+        self._lengths = sorted({len(fk) for fk in self.norm_keys})
+        self._postings = postings
+
+    @classmethod
+    def of(cls, data):
+        """El mismo objeto si ya es un FlatProduct; si no, aplana `data` (JSON crudo o ya aplanado)."""
+        return data if isinstance(data, cls) else cls(data or {})
+
+    # --- Claves normalizadas que contienen a `nk` / contenidas en `nk` (posiciones en norm_keys, en orden) ---
+    def containing(self, nk):
+        memo = self._memo.get(("in", nk))
+        if memo is not None:
+            return memo
+        if self._postings is None:
+            self._build_index()
+        if len(nk) < KEY_NGRAM:   # demasiado corta para los trigramas: recorrido lineal
+            out = [i for i, fk in enumerate(self.norm_keys) if nk in fk]
+        else:
+            lists = []
+            for g in {nk[j:j + KEY_NGRAM] for j in range(len(nk) - KEY_NGRAM + 1)}:
+                p = self._postings.get(g)
+                if p is None:
+                    lists = None
+                    break
+                lists.append(p)
+            if lists is None:
+                out = []
+            else:
+                lists.sort(key=len)
+                cand = set(lists[0]).intersection(*lists[1:2])   # las dos listas más cortas alcanzan
+                # Los trigramas filtran; la verificación confirma el substring real
+                out = sorted(i for i in cand if nk in self.norm_keys[i])
+        self._memo[("in", nk)] = out
+        return out
+
+    def contained_in(self, nk):
+        memo = self._memo.get(("of", nk))
+        if memo is not None:
+            return memo
+        if self._postings is None:
+            self._build_index()
+        found = set()
+        for length in self._lengths:
+            if length > len(nk):
+                break
+            for j in range(len(nk) - length + 1):
+                i = self._position.get(nk[j:j + length])
+                if i is not None:
+                    found.add(i)
+        out = sorted(found)
+        self._memo[("of", nk)] = out
+        return out
+
+    def matching_rows(self, path):
+        """Posiciones en flat cuya clave normalizada contiene a `path`, en orden."""
+        groups = [self.rows[self.norm_keys[i]] for i in self.containing(normalize_key(path))]
+        return sorted(r for g in groups for r in g)
+
+    def first(self, paths):
+        for p in paths:
+            rows = self.matching_rows(p)
+            if rows:
+                return self.values[rows[0]]
+        return None
+
+    def all(self, paths):
+        return [self.values[r] for p in paths for r in self.matching_rows(p)]
+
+    def first_parsed(self, paths, parse):
+        """Primer valor de `paths` que `parse` acepta (parse devuelve None si no)."""
+        for p in paths:
+            for r in self.matching_rows(p):
+                val = parse(self.values[r])
+                if val is not None:
+                    return val
+        return None
+
+    def key_at(self, i):
+        """Ruta de flat cuyo valor es el de norm_keys[i] (la última con esa clave normalizada)."""
+        return self.keys[self.rows[self.norm_keys[i]][-1]]
+
+    def find_key(self, keys):
+        """(ruta, valor) de la primera clave que contiene a alguna de `keys` o está contenida en ella."""
+        for key in keys:
+            nk = normalize_key(key)
+            hits = self.containing(nk) + self.contained_in(nk)
+            if hits:
+                i = min(hits)
+                return self.key_at(i), self.norm_flat[self.norm_keys[i]]
+        return None, None
+
+    def find(self, keys):
+        return self.find_key(keys)[1]
+
     # ============================================================
 # 🔍 Categoría automática (IA + embeddings locales)
 # ============================================================
@@ -171,7 +308,9 @@ Título: {title}"""
         match = match_category(ai_category, amazon_json.get("asin", "unknown"))
         cat_id = match.get("matched_category_id", "CBT1157")
         cat_name = match.get("matched_category_name", "Default")
-        print(f"✅ Categoría más cercana: {cat_name} ({cat_id}) | Similitud {match.get('similarity'):.3f}")
+        sim = match.get("similarity")
+        print(f"✅ Categoría más cercana: {cat_name} ({cat_id}) | "
+              + (f"Similitud {sim:.3f}" if sim is not None else f"Léxico (BM25 {match.get('score'):.3f})"))
         return cat_id
     except Exception as e:
         print(f"⚠️ Error detectando categoría: {e}")
@@ -182,33 +321,23 @@ Título: {title}"""
 # 📗 Obtener schema
 # ============================================================
 def get_category_schema(category_id):
-    try:
-        r = requests.get(f"{API}/categories/{category_id}/attributes",
-                         headers=HEADERS, timeout=10)
-        r.raise_for_status()
-        schema = {}
-        for a in r.json():
-            if a.get("id"):
-                schema[a["id"]] = {
-                    "value_type": a.get("value_type"),
-                    "values": {v["name"].lower(): v["id"]
-                               for v in a.get("values",[]) if v.get("id")},
-                    "allowed_units": [u["id"] for u in a.get("allowed_units",[])]
-                                     if a.get("allowed_units") else []
-                }
-        print(f"📘 Schema obtenido: {len(schema)} atributos.")
-        return schema
-    except Exception as e:
-        print(f"⚠️ No se pudo obtener schema {category_id}: {e}")
-        return {}
+    """Schema compilado (memoria → store local → disco con TTL/ETag → API); ver schema_cache.py."""
+    schema = get_schema_cache().get(category_id)
+    print(f"📘 Schema {category_id}: {len(schema)} atributos.")
+    return schema
+
+def prefetch_category_schemas(category_ids, wait=True):
+    """Calienta los schemas de todas las categorías de un lote (en paralelo)."""
+    return get_schema_cache().prefetch(category_ids, wait=wait)
 
 
 # ============================================================
 # 🔎 Buscar valor en flatten
 # ============================================================
-def find_value(flat, keys):
+def find_path(flat, keys):
+    """(ruta en flat, valor) de la primera coincidencia de `keys`; (None, None) si no hay."""
     if not keys:
-        return None
+        return None, None
     if isinstance(keys, str):
         keys = [keys]
     if isinstance(keys, dict):
@@ -221,15 +350,11 @@ def find_value(flat, keys):
         keys = new_keys
     keys = [k for k in keys if isinstance(k, str)]
     if not keys:
-        return None
+        return None, None
+    return FlatProduct.of(flat).find_key(keys)
 
-    norm_flat = {normalize_key(fk): v for fk, v in flat.items()}
-    for key in keys:
-        nk = normalize_key(key)
-        for fk, v in norm_flat.items():
-            if nk in fk or fk in nk:
-                return v
-    return None
+def find_value(flat, keys):
+    return find_path(flat, keys)[1]
 
 
 # ============================================================
@@ -264,9 +389,13 @@ PACKAGE_DIMENSION_KEYS = {
 # ============================================================
 # 📦 Extraer dimensiones del PAQUETE (solo paquete)
 # ============================================================
-def get_package_dimension(flat, kind):
+def locate_package_dimension(flat, kind):
+    """
+    (ruta del valor, ruta de la unidad o None) del paquete para `kind`;
+    (None, None) si el JSON no lo trae.
+    """
     kind = kind.lower()
-    norm_flat = {normalize_key(k): v for k, v in flat.items()}
+    fp = FlatProduct.of(flat)
 
     value_candidates = [
         f"attributes.item_package_dimensions[0].{kind}.value",
@@ -285,47 +414,47 @@ def get_package_dimension(flat, kind):
         f"{kind}.unit",
     ]
 
-    val = None
-    unit = None
+    value_key = None
     for c in value_candidates:
-        nk = normalize_key(c)
-        for fk, v in norm_flat.items():
-            if nk in fk:
-                val = extract_number(v)
-                if val is not None:
-                    break
-        if val is not None:
-            break
-
-    for c in unit_candidates:
-        nk = normalize_key(c)
-        for fk, v in norm_flat.items():
-            if nk in fk:
-                unit = str(v).strip()
+        for i in fp.containing(normalize_key(c)):
+            if extract_number(fp.norm_flat[fp.norm_keys[i]]) is not None:
+                value_key = fp.key_at(i)
                 break
-        if unit:
+        if value_key:
             break
 
-    if val is not None:
-        if kind == "weight":
-            val = _to_kg(val, unit or "kg")
-            return {"number": round(float(val), 3), "unit": "kg"}
-        else:
-            val = _to_cm(val, unit or "cm")
-            return {"number": round(float(val), 2), "unit": "cm"}
+    if value_key:
+        # La unidad hermana del mismo ".value" es la más confiable
+        unit_key = fp.unit_keys.get(value_key)
+        if not unit_key:
+            for c in unit_candidates:
+                hits = fp.containing(normalize_key(c))
+                if hits:
+                    unit_key = fp.key_at(hits[0])
+                    break
+        return value_key, unit_key
 
+    # Claves alternativas: solo la unidad hermana; si no hay, se asume cm / kg
     for c in PACKAGE_DIMENSION_KEYS.get(kind, []):
-        nk = normalize_key(c)
-        for fk, v in norm_flat.items():
-            if nk in fk:
-                num = extract_number(v)
-                if num is not None:
-                    if kind == "weight":
-                        return {"number": round(float(_to_kg(num, "kg")), 3), "unit": "kg"}
-                    return {"number": round(float(_to_cm(num, "cm")), 2), "unit": "cm"}
-
-    print(f"⚠️ No se encontró {kind} del paquete en el JSON (ni valor ni unidad).")
-    return None
+        for i in fp.containing(normalize_key(c)):
+            if extract_number(fp.norm_flat[fp.norm_keys[i]]) is not None:
+                value_key = fp.key_at(i)
+                return value_key, fp.unit_keys.get(value_key)
+    return None, None
+
+def package_dimension_struct(kind, num, unit=None):
+    if kind.lower() == "weight":
+        return {"number": round(float(_to_kg(num, unit or "kg")), 3), "unit": "kg"}
+    return {"number": round(float(_to_cm(num, unit or "cm")), 2), "unit": "cm"}
+
+def get_package_dimension(flat, kind):
+    fp = FlatProduct.of(flat)
+    value_key, unit_key = locate_package_dimension(fp, kind)
+    if value_key is None:
+        print(f"⚠️ No se encontró {kind.lower()} del paquete en el JSON (ni valor ni unidad).")
+        return None
+    return package_dimension_struct(kind, extract_number(fp.flat[value_key]),
+                                    fp.flat.get(unit_key) if unit_key else None)
 
 
 # ============================================================
@@ -349,18 +478,16 @@ BASE_EQUIV = {
 # ============================================================
 # 🧠 Cache persistente
 # ============================================================
-def load_cache():
-    if os.path.exists(CACHE_PATH):
-        try:
-            return json.load(open(CACHE_PATH))
-        except:
-            return {}
-    return {}
+def load_cache(attr_ids=None):
+    """{attr_id: claves de Amazon} aprendidas; solo las de `attr_ids` si se pasan."""
+    store = get_kv_store()
+    if attr_ids is None:
+        return store.items(EQUIV_NS)
+    return store.get_many(EQUIV_NS, attr_ids)
 
 def save_cache(cache):
-    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
-    with open(CACHE_PATH,"w",encoding="utf-8") as f:
-        json.dump(cache, f, indent=2, ensure_ascii=False)
+    """Guarda (upsert) las equivalencias de `cache` en una sola transacción."""
+    get_kv_store().put_many(EQUIV_NS, cache)
 
 
 # ============================================================
@@ -402,7 +529,7 @@ Reglas:
         if eqs:
             for k,v in eqs.items():
                 cache[k] = v
-            save_cache(cache)
+            save_cache(eqs)
             print(f"💾 {len(eqs)} nuevas equivalencias aprendidas y guardadas.")
         else:
             print("⚠️ La IA no devolvió equivalencias válidas.")
@@ -415,43 +542,34 @@ Reglas:
 # ============================================================
 # 📝 IA título + descripción
 # ============================================================
+# `data` puede ser el JSON crudo o un FlatProduct ya armado (se reutiliza)
 def _first(data, paths):
-    flat = flatten_summary(data)
-    for p in paths:
-        for k,v in flat.items():
-            if normalize_key(p) in normalize_key(k):
-                return v
-    return None
+    return FlatProduct.of(data).first(paths)
 
 def _list_from(data, paths):
-    flat = flatten_summary(data)
-    out=[]
-    for p in paths:
-        for k,v in flat.items():
-            if normalize_key(p) in normalize_key(k):
-                out.append(v)
-    return out
+    return FlatProduct.of(data).all(paths)
 
 def _dims_hint(data):
-    flat=flatten_summary(data)
-    for k,v in flat.items():
-        if "itempackagedimensions" in normalize_key(k) or "packagedimensions" in normalize_key(k):
-            return f"{k}:{v}"
+    fp = FlatProduct.of(data)
+    rows = sorted(set(fp.matching_rows("itempackagedimensions") + fp.matching_rows("packagedimensions")))
+    if rows:
+        return f"{fp.keys[rows[0]]}:{fp.values[rows[0]]}"
     return ""
 
 
-def generate_ai_title(asin: str, amazon_json: dict, max_chars=60)->str:
+def generate_ai_title(asin: str, amazon_json: dict, max_chars=60, flat=None)->str:
     base = amazon_json.get("item_name") or amazon_json.get("title") or "Producto"
     if not client:
         return base[:max_chars]
 
-    cache = _load_small_cache(TITLE_CACHE_PATH)
-    if asin and asin in cache:
-        return cache[asin]
+    cached = get_kv_store().get(TITLE_NS, asin) if asin else None
+    if cached is not None:
+        return cached
 
-    brand = _first(amazon_json, ["brandName","brand","attributes.brand[0].value","summaries[0].brandName"])
-    model = _first(amazon_json, ["model_name","model_number","model","summaries[0].modelNumber"])
-    bullets = _list_from(amazon_json, ["attributes.bullet_point","bullet_point"])[:3]
+    fp = FlatProduct.of(flat or amazon_json)
+    brand = _first(fp, ["brandName","brand","attributes.brand[0].value","summaries[0].brandName"])
+    model = _first(fp, ["model_name","model_number","model","summaries[0].modelNumber"])
+    bullets = _list_from(fp, ["attributes.bullet_point","bullet_point"])[:3]
 
     prompt = f"""Crea un título de máximo {max_chars} caracteres en español LATAM, claro y vendedor.
 Incluye marca y modelo si están. Sin emojis ni HTML.
@@ -466,27 +584,27 @@ Bullets: {bullets}"""
         )
         title = (r.choices[0].message.content or "").strip()[:max_chars]
         if asin:
-            cache[asin]=title
-            _save_small_cache(TITLE_CACHE_PATH, cache)
+            get_kv_store().put(TITLE_NS, asin, title)
         return title or base[:max_chars]
     except:
         return base[:max_chars]
 
 
-def generate_ai_description(asin: str, amazon_json: dict)->str:
+def generate_ai_description(asin: str, amazon_json: dict, flat=None)->str:
     if not client:
         return ""
-    cache = _load_small_cache(DESC_CACHE_PATH)
-    if asin and asin in cache:
-        return cache[asin]
-
-    brand   = _first(amazon_json, ["brandName","brand","attributes.brand[0].value","summaries[0].brandName"])
-    model   = _first(amazon_json, ["model_name","model_number","model","summaries[0].modelNumber"])
-    pieces  = _first(amazon_json, ["number_of_pieces","attributes.number_of_pieces[0].value"])
-    color   = _first(amazon_json, ["color","attributes.color[0].value"])
-    material= _first(amazon_json, ["material","attributes.material[0].value"])
-    bullets = _list_from(amazon_json, ["attributes.bullet_point","bullet_point"])[:8]
-    dims_pkg= _dims_hint(amazon_json)
+    cached = get_kv_store().get(DESC_NS, asin) if asin else None
+    if cached is not None:
+        return cached
+
+    fp      = FlatProduct.of(flat or amazon_json)
+    brand   = _first(fp, ["brandName","brand","attributes.brand[0].value","summaries[0].brandName"])
+    model   = _first(fp, ["model_name","model_number","model","summaries[0].modelNumber"])
+    pieces  = _first(fp, ["number_of_pieces","attributes.number_of_pieces[0].value"])
+    color   = _first(fp, ["color","attributes.color[0].value"])
+    material= _first(fp, ["material","attributes.material[0].value"])
+    bullets = _list_from(fp, ["attributes.bullet_point","bullet_point"])[:8]
+    dims_pkg= _dims_hint(fp)
 
     prompt = f"""Redacta una descripción larga (≥3 párrafos) en español LATAM, persuasiva y clara, para Mercado Libre.
 Incluye beneficios y especificaciones relevantes sin inventar. Sin HTML, solo texto plano.
@@ -503,8 +621,7 @@ Cierra con un llamado a la acción suave."""
         )
         desc = (r.choices[0].message.content or "").strip()
         if asin:
-            cache[asin]=desc
-            _save_small_cache(DESC_CACHE_PATH, cache)
+            get_kv_store().put(DESC_NS, asin, desc)
         return desc
     except:
         return ""
@@ -521,15 +638,7 @@ def _read_number(x, default=None):
         return default
 
 def _try_paths(d, paths: List[str]):
-    flat = flatten_summary(d)
-    for p in paths:
-        nk = normalize_key(p)
-        for k, v in flat.items():
-            if nk in normalize_key(k):
-                val = _read_number(v)
-                if val is not None:
-                    return val
-    return None
+    return FlatProduct.of(d).first_parsed(paths, _read_number)
 
 def get_amazon_base_price(amazon_json) -> float:
     candidates = [
@@ -583,16 +692,153 @@ def _infer_asin_from_flat(flat: dict)->str|None:
     return None
 
 
+# ============================================================
+# 🗺️ Planes de extracción por categoría
+# ============================================================
+PLANS_DIR = os.getenv("EXTRACTION_PLANS_DIR", os.path.join("logs", "extraction_plans"))
+EXTRACTION_PLANS = os.getenv("EXTRACTION_PLANS", "1") == "1"
+
+PACKAGE_ATTRS = {
+    "length": "SELLER_PACKAGE_LENGTH",
+    "width": "SELLER_PACKAGE_WIDTH",
+    "height": "SELLER_PACKAGE_HEIGHT",
+    "weight": "SELLER_PACKAGE_WEIGHT",
+}
+
+class ExtractionPlan:
+    """
+    Rutas exactas del JSON aplanado que resolvieron cada atributo en productos
+    anteriores de la misma categoría. Los productos siguientes leen esas rutas
+    directo (un dict.get por atributo); solo lo que falla pasa por el
+    descubrimiento (BASE_EQUIV → cache de equivalencias → IA), que agrega al
+    plan la ruta que encontró.
+
+    - paths: {attr_id: [ruta, ...]} en orden de aprendizaje
+    - units: {ruta de valor: ruta de su unidad} cuando no es el hermano ".unit"
+    Tipo, unidades permitidas y value_id salen del schema compilado.
+
+    Se guarda en logs/extraction_plans/<category_id>.json.
+    """
+
+    def __init__(self, category_id, paths=None, units=None):
+        self.category_id = category_id
+        self.paths = paths or {}
+        self.units = units or {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(PLANS_DIR, f"{self.category_id}.json")
+
+    @classmethod
+    def load(cls, category_id):
+        plan = cls(category_id)
+        try:
+            with open(plan.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            plan.paths = data.get("paths") or {}
+            plan.units = data.get("units") or {}
+        except (OSError, json.JSONDecodeError):
+            pass
+        return plan
+
+    def lookup(self, fp, aid, parse=None):
+        """Primera ruta aprendida para `aid` que existe en este producto (y que `parse` acepta)."""
+        for path in self.paths.get(aid, ()):
+            val = fp.flat.get(path)
+            if val and (parse is None or parse(val) is not None):
+                return path
+        return None
+
+    def unit_key(self, fp, path):
+        return self.units.get(path) or fp.unit_keys.get(path)
+
+    def learn(self, aid, path, unit_key=None):
+        with self._lock:
+            paths = self.paths.setdefault(aid, [])
+            if path not in paths:
+                paths.append(path)
+                self.dirty = True
+            if unit_key and unit_key != self.units.get(path):
+                self.units[path] = unit_key
+                self.dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            data = json.dumps({
+                "category_id": self.category_id,
+                "paths": self.paths,
+                "units": self.units,
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }, indent=2, ensure_ascii=False)
+            self.dirty = False
+        os.makedirs(PLANS_DIR, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+def get_extraction_plan(category_id) -> ExtractionPlan:
+    """Plan de la categoría (uno por proceso, compartido entre hilos)."""
+    with _plans_lock:
+        if category_id not in _plans:
+            _plans[category_id] = ExtractionPlan.load(category_id)
+        return _plans[category_id]
+
+
+def _format_attr(aid, val, meta, unit=None):
+    """Atributo ML para un valor extraído; `unit` = unidad que trae el JSON junto al valor."""
+    vtype=meta.get("value_type")
+    a={"id":aid}
+    if isinstance(val, dict) and "number" in val and "unit" in val:
+        a["value_struct"] = {"number": float(val["number"]), "unit": val["unit"]}
+    elif vtype=="number_unit":
+        num=extract_number(val)
+        allowed=meta.get("allowed_units") or []
+        is_dim=("WEIGHT" in aid) or aid.endswith(("LENGTH","WIDTH","HEIGHT"))
+        m=re.search(r"(cm|mm|kg|g|m|in|lb|oz)",str(val).lower())
+        if m:
+            u=m.group(1)
+        elif unit and (_norm_unit(unit) in allowed or is_dim):
+            u=_norm_unit(unit)
+        else:
+            u=(allowed or [None])[0] or "cm"
+        if "WEIGHT" in aid:
+            num = _to_kg(num, u); u = "kg"
+        elif aid.endswith(("LENGTH","WIDTH","HEIGHT")):
+            num = _to_cm(num, u); u = "cm"
+        if num is not None:a["value_struct"]={"number":float(num),"unit":u}
+    elif vtype=="list":
+        lower=str(val).lower()
+        if lower in meta.get("values",{}):
+            a["value_id"]=meta["values"][lower]
+        else:a["value_name"]=val
+    else:
+        a["value_name"]=val
+    return a
+
+
 # ============================================================
 # 🏗️ Construir atributos ML
 # ============================================================
 def build_meli_attributes(amazon_json, category_id):
     schema = get_category_schema(category_id)
-    flat = flatten_summary(amazon_json)
-    cache = load_cache()
+    fp = FlatProduct(amazon_json)   # se aplana una sola vez y lo comparten todos los extractores
+    flat = fp.flat
+    cache = load_cache(schema.keys())
 
+    plan = get_extraction_plan(category_id) if EXTRACTION_PLANS else None
     matched, missing = {}, []
+    sources = {}   # attr_id → ruta de flat de donde salió el valor
     reused = 0
+    planned = 0
 
     asin = amazon_json.get("asin") or _infer_asin_from_flat(flat)
     if asin:
@@ -602,27 +848,39 @@ def build_meli_attributes(amazon_json, category_id):
     if gtins:
         matched["GTIN"] = gtins[0]
 
-    for kind, aid in {
-        "length": "SELLER_PACKAGE_LENGTH",
-        "width": "SELLER_PACKAGE_WIDTH",
-        "height": "SELLER_PACKAGE_HEIGHT",
-        "weight": "SELLER_PACKAGE_WEIGHT",
-    }.items():
-        dim = get_package_dimension(flat, kind)
-        if dim:
-            matched[aid] = dim
+    for kind, aid in PACKAGE_ATTRS.items():
+        path = plan.lookup(fp, aid, extract_number) if plan else None
+        if path:
+            planned += 1
+            unit_key = plan.unit_key(fp, path)
+        else:
+            path, unit_key = locate_package_dimension(fp, kind)
+            if path is None:
+                print(f"⚠️ No se encontró {kind} del paquete en el JSON (ni valor ni unidad).")
+                continue
+            if plan:
+                plan.learn(aid, path, unit_key)
+        matched[aid] = package_dimension_struct(kind, extract_number(flat[path]),
+                                                flat.get(unit_key) if unit_key else None)
 
     for aid, meta in schema.items():
         if aid in matched:
             continue
-        keys = BASE_EQUIV.get(aid, [])
-        val = find_value(flat, keys) if keys else None
-        if not val and aid in cache:
-            val = find_value(flat, cache[aid])
-            if val:
-                reused += 1
-        if val:
-            matched[aid] = val
+        path = plan.lookup(fp, aid) if plan else None
+        if path:
+            planned += 1
+        else:
+            keys = BASE_EQUIV.get(aid, [])
+            path, _ = find_path(fp, keys) if keys else (None, None)
+            if not path and aid in cache:
+                path, _ = find_path(fp, cache[aid])
+                if path:
+                    reused += 1
+            if path and plan:
+                plan.learn(aid, path)
+        if path:
+            matched[aid] = flat[path]
+            sources[aid] = path
         else:
             missing.append(aid)
 
@@ -635,9 +893,15 @@ def build_meli_attributes(amazon_json, category_id):
             print(f"🤖 Pidiendo equivalencias IA solo para {len(new_to_ask)} nuevas…")
             new_eq = ask_gpt_equivalences(category_id, new_to_ask, flat, cache)
             for k,v in new_eq.items():
-                val = find_value(flat, v)
-                if val:
+                path, val = find_path(fp, v)
+                if path:
                     matched[k] = val
+                    sources[k] = path
+                    if plan:
+                        plan.learn(k, path)
+
+    if plan:
+        plan.save()
 
     pkg_l = (matched.get("SELLER_PACKAGE_LENGTH") or {}).get("number")
     pkg_w = (matched.get("SELLER_PACKAGE_WIDTH") or {}).get("number")
@@ -646,38 +910,19 @@ def build_meli_attributes(amazon_json, category_id):
     if all([pkg_l, pkg_w, pkg_h, pkg_wt]):
         print(f"📦 Paquete: {pkg_l:.2f}×{pkg_w:.2f}×{pkg_h:.2f} cm – {pkg_wt:.3f} kg")
 
-    prices = compute_price_with_markup(amazon_json)
+    prices = compute_price_with_markup(fp)
     print(f"💰 Precio base: ${prices['base_price_usd']:.2f} → con markup ({int(MARKUP_PCT*100)}%): ${prices['price_with_markup_usd']:.2f}")
 
-    title = generate_ai_title(asin or "", amazon_json, max_chars=60)
-    description = generate_ai_description(asin or "", amazon_json)
+    title = generate_ai_title(asin or "", amazon_json, max_chars=60, flat=fp)
+    description = generate_ai_description(asin or "", amazon_json, flat=fp)
 
     attrs=[]
     for aid,val in matched.items():
-        meta=schema.get(aid,{})
-        vtype=meta.get("value_type")
-        a={"id":aid}
-        if isinstance(val, dict) and "number" in val and "unit" in val:
-            a["value_struct"] = {"number": float(val["number"]), "unit": val["unit"]}
-        elif vtype=="number_unit":
-            num=extract_number(val)
-            unit=re.search(r"(cm|mm|kg|g|m|in|lb|oz)",str(val).lower())
-            u=unit.group(1) if unit else (meta.get("allowed_units",[None])[0] or "cm")
-            if "WEIGHT" in aid:
-                num = _to_kg(num, u); u = "kg"
-            elif aid.endswith(("LENGTH","WIDTH","HEIGHT")):
-                num = _to_cm(num, u); u = "cm"
-            if num is not None:a["value_struct"]={"number":float(num),"unit":u}
-        elif vtype=="list":
-            lower=str(val).lower()
-            if lower in meta.get("values",{}):
-                a["value_id"]=meta["values"][lower]
-            else:a["value_name"]=val
-        else:
-            a["value_name"]=val
-        attrs.append(a)
+        path=sources.get(aid)
+        unit_key=(plan.unit_key(fp, path) if plan else fp.unit_keys.get(path)) if path else None
+        attrs.append(_format_attr(aid, val, schema.get(aid,{}), flat.get(unit_key) if unit_key else None))
 
-    print(f"\n📊 Resumen final → Atributos directos: {len(attrs)} | Faltantes IA: {len(missing)} | Cache reutilizado: {reused}")
+    print(f"\n📊 Resumen final → Atributos directos: {len(attrs)} | Faltantes IA: {len(missing)} | Cache reutilizado: {reused} | Desde plan: {planned}")
 
         # =========================================
         # =========================================
@@ -863,21 +1108,38 @@ def build_meli_attributes(amazon_json, category_id):
 # ============================================================
 def main():
     if len(sys.argv) < 2:
-        print("Uso: python3 transform_mapper_new.py <ruta_json_amazon>")
+        print("Uso: python3 transform_mapper_new.py <ruta_json_amazon | ASIN>")
+        print("     python3 transform_mapper_new.py --delta [delta.jsonl]   (solo ASINs nuevos/cambiados)")
         sys.exit(1)
 
-    arg_path = sys.argv[1]
-    if not os.path.exists(arg_path):
-        for base in ["outputs/json", "outputs"]:
-            candidate = os.path.join(base, os.path.basename(arg_path))
-            if os.path.exists(candidate):
-                arg_path = candidate
-                break
-    if not os.path.exists(arg_path):
-        print(f"❌ No se encontró el archivo: {arg_path}")
+    delta_path = delta_arg(sys.argv)
+    if delta_path is not None:
+        entries = read_delta(delta_path)
+        print(f"🔀 Delta {delta_path or '(ninguno)'}: {len(entries)} ASINs para transformar")
+        for entry in entries:
+            try:
+                transform_product(entry["asin"])
+            except (ProductNotFound, SchemaUnavailable) as e:
+                print(f"⚠️ {entry['asin']}: {e}, se saltea.")
+        return
+
+    try:
+        transform_product(sys.argv[1])
+    except (ProductNotFound, SchemaUnavailable) as e:
+        print(f"❌ {e}")
         sys.exit(1)
 
-    amazon_json = load_json_file(arg_path)
+
+def transform_product(arg_path):
+    if not os.path.exists(arg_path):
+        candidate = os.path.join("outputs", os.path.basename(arg_path))
+        if os.path.exists(candidate):
+            arg_path = candidate
+    amazon_json = load_product(arg_path)   # ruta, o ASIN en el product store
+    if amazon_json is None:
+        raise ProductNotFound(f"No se encontró el archivo ni el ASIN: {arg_path}")
+    if not arg_path.endswith(".json"):
+        arg_path = f"{arg_path}.json"
     title = amazon_json.get("title") or amazon_json.get("product_title") or "Producto"
     match = match_category(title, amazon_json.get("asin", ""))
     cid = match["matched_category_id"] if match else "CBT1157"
@@ -892,6 +1154,7 @@ def main():
 
     print(f"\n✅ Guardado: {out_path}")
     print(json.dumps(result["api_ready_item"], indent=2, ensure_ascii=False))
+    return out_path
 
     # ============================================================
 # 🧩 Normalizador desde JSON CBT → formato /global/items
@@ -920,7 +1183,7 @@ def normalize_cbt_item(json_path: str) -> dict:
         "package_height": H,
         "package_weight": KG,
         "attributes": [],
-        "sale_terms": item.get("sale_terms", [])
+        "sale_terms": item.get("sale_terms", []),
         "pictures": images,
         # Publicación con Net Proceeds (no enviar 'price')
         "global_net_proceeds": net_amount,